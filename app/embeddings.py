@@ -1,28 +1,70 @@
 import cohere
 import numpy as np
 
+from .exceptions import ValidationError
 from .settings import settings
+from .utils.quantization import (
+    EMBEDDING_DTYPES,
+    SUPPORTED_DIMENSIONS,
+    EmbeddingType,
+)
 from .utils.smart_chunker import SmartChunker
 
 
 class Embedder:
-    def __init__(self):
+    def __init__(
+        self, output_dimension: int = 1024, embedding_type: EmbeddingType = "float"
+    ):
         """Initialize the Embedder with Cohere client and default settings."""
         self.co = cohere.ClientV2(api_key=settings.cohere_api_key)
         self.model = "embed-v4.0"
         self.input_type = "search_query"
+        self.output_dimension = output_dimension
+        self.embedding_type = embedding_type
         self.chunker = SmartChunker.create_optimized_for_embeddings()
 
+    @staticmethod
+    def options_from_metadata(metadata: dict | None) -> dict:
+        """Read a library's embedding options from its metadata.
+
+        Libraries opt into compressed embeddings with the ``embedding_dimension``
+        and ``embedding_type`` metadata keys.
+        """
+        metadata = metadata or {}
+        output_dimension = metadata.get("embedding_dimension", 1024)
+        embedding_type = metadata.get("embedding_type", "float")
+
+        if output_dimension not in SUPPORTED_DIMENSIONS:
+            raise ValidationError(
+                f"embedding_dimension must be one of {list(SUPPORTED_DIMENSIONS)}"
+            )
+        if embedding_type not in EMBEDDING_DTYPES:
+            raise ValidationError(
+                f"embedding_type must be one of {list(EMBEDDING_DTYPES)}"
+            )
+        return {"output_dimension": output_dimension, "embedding_type": embedding_type}
+
+    def configure(self, output_dimension: int, embedding_type: EmbeddingType):
+        """Switch the output dimension and type requested from the provider."""
+        self.output_dimension = output_dimension
+        self.embedding_type = embedding_type
+        return self
+
     def embed(self, phrases: list[str]):
-        """Generate embeddings for a list of text phrases using Cohere's embed model."""
+        """Generate embeddings for a list of text phrases using Cohere's embed model.
+
+        Non-float embedding types are returned by the provider already quantized:
+        ``int8`` as signed bytes and ``ubinary`` as packed unsigned bits.
+        """
         res = self.co.embed(
             texts=phrases,
             model=self.model,
             input_type=self.input_type,
-            output_dimension=1024,
-            embedding_types=["float"],
+            output_dimension=self.output_dimension,
+            embedding_types=[self.embedding_type],
         )
-        return np.array(res.embeddings.float)
+        values = getattr(res.embeddings, self.embedding_type)
+        return np.array(values, dtype=EMBEDDING_DTYPES[self.embedding_type])
 
     def _chunk_text(self, text: str):
         """Chunk text using smart chunking with overlap and boundary detection."""
@@ -57,6 +57,12 @@ class EmbeddingError(VectorDBException):
     pass
 
 
+class EmbeddingTimeoutError(EmbeddingError):
+    """Raised when the embedding provider does not answer within the budget."""
+
+    pass
+
+
 class IndexError(VectorDBException):
     """Raised when vector index operations fail."""
 
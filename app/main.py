@@ -11,10 +11,11 @@ from .routes.documents import router as documents_router
 from .settings import settings
 
 # Fix forward references after all imports
-from .models.models import SearchResult
+from .models.models import SearchDebugResponse, SearchResult
 from .models.document import Document
 
 SearchResult.model_rebuild()
+SearchDebugResponse.model_rebuild()
 
 
 @asynccontextmanager
@@ -3,7 +3,7 @@ from __future__ import annotations
 from typing import Any, Literal
 from uuid import UUID
 
-from pydantic import BaseModel, ConfigDict, Field
+from pydantic import BaseModel, ConfigDict, Field, PrivateAttr, model_validator
 
 
 class MetadataFilter(BaseModel):
@@ -31,12 +31,138 @@ class MetadataFilter(BaseModel):
     )
 
 
-class SearchText(BaseModel):
-    content: str
-    library_id: UUID
+class FilterGroup(BaseModel):
+    """Boolean combination of metadata filters and nested groups.
+
+    ``and`` matches when all filters match, ``or`` when any does, and ``not``
+    when the filters do not all match.
+    """
+
+    operator: Literal["and", "or", "not"]
+    filters: list[MetadataFilter | FilterGroup] = Field(default_factory=list)
+
+    model_config = ConfigDict(
+        json_schema_extra={
+            "example": {
+                "operator": "or",
+                "filters": [
+                    {"field": "author", "operator": "eq", "value": "John Doe"},
+                    {
+                        "operator": "not",
+                        "filters": [
+                            {"field": "status", "operator": "eq", "value": "draft"}
+                        ],
+                    },
+                ],
+            }
+        }
+    )
+
+
+FilterExpression = MetadataFilter | FilterGroup
+
+
+class SearchOptions(BaseModel):
+    """Filters, ranking and result options shared by the search requests."""
+
     index_type: Literal["ivf", "flat"] = "flat"
-    metadata_filters: list[MetadataFilter] = Field(default_factory=list)
+    metadata_filters: list[MetadataFilter | FilterGroup] = Field(default_factory=list)
     limit: int = Field(default=5, ge=1, le=100)
+    min_score: float | None = Field(
+        default=None,
+        ge=-1,
+        le=1,
+        description="Drop chunks whose vector similarity is below this score",
+    )
+    aggregation: Literal["max", "sum", "top_n"] = Field(
+        default="max",
+        description="How chunk scores combine into a document score: the best "
+        "chunk, all chunks, or the top_n best chunks",
+    )
+    top_n: int = Field(
+        default=3, ge=1, le=100, description="Chunks summed by top_n aggregation"
+    )
+    granularity: Literal["document", "chunk"] = Field(
+        default="document",
+        description="Return the best documents, or the best matching chunks "
+        "without their document bodies",
+    )
+    fields: list[Literal["content", "metadata", "offsets"]] | None = Field(
+        default=None,
+        description="Optional result parts to return, all if omitted: the chunk "
+        "text or document body, their metadata, and chunk offsets",
+    )
+    rerank: Literal["none", "mmr"] = Field(
+        default="none",
+        description="Re-rank candidates by maximal marginal relevance so "
+        "near-duplicate passages give way to distinct ones",
+    )
+    diversity: float = Field(
+        default=0.5,
+        ge=0,
+        le=1,
+        description="Weight of novelty against relevance under MMR re-ranking",
+    )
+    cursor: str | None = Field(
+        default=None,
+        description="next_cursor of the previous page; the next page continues "
+        "its query, filters and options",
+    )
+
+    def options(self) -> dict[str, Any]:
+        """The shared search options, to carry them over to another request."""
+        return {name: getattr(self, name) for name in SearchOptions.model_fields}
+
+
+class SearchText(SearchOptions):
+    content: str
+    library_id: UUID | None = None
+    library_ids: list[UUID] | None = Field(
+        default=None,
+        min_length=1,
+        max_length=100,
+        description="Libraries to search together, merging their best results",
+    )
+    mode: Literal["vector", "keyword", "hybrid"] = Field(
+        default="vector",
+        description="Rank by embedding similarity, BM25 keyword score, or both",
+    )
+    fusion: Literal["rrf", "weighted"] = Field(
+        default="rrf",
+        description="How hybrid mode combines the vector and keyword rankings",
+    )
+    keyword_weight: float = Field(
+        default=0.5,
+        ge=0,
+        le=1,
+        description="Weight of the keyword scores under weighted fusion",
+    )
+    facets: list[str] = Field(
+        default_factory=list,
+        max_length=20,
+        description="Metadata fields whose values are counted over the search",
+    )
+    facet_scope: Literal["candidates", "results"] = Field(
+        default="candidates",
+        description="Count facets over every chunk passing the filters, or over "
+        "the returned results only",
+    )
+    facet_limit: int = Field(
+        default=10, ge=1, le=100, description="Most frequent values kept per facet"
+    )
+
+    @model_validator(mode="after")
+    def check_libraries(self) -> SearchText:
+        """Require a library to search."""
+        if self.library_id is None and not self.library_ids:
+            raise ValueError("Provide library_id or library_ids")
+        return self
+
+    @property
+    def libraries(self) -> list[UUID]:
+        """The libraries to search, library_id first, without duplicates."""
+        ids = [self.library_id] if self.library_id is not None else []
+        return list(dict.fromkeys([*ids, *(self.library_ids or [])]))
 
     model_config = ConfigDict(
         json_schema_extra={
@@ -48,6 +174,96 @@ class SearchText(BaseModel):
                     {"field": "created_at", "operator": "gte", "value": "2024-01-01"}
                 ],
                 "limit": 10,
+                "mode": "hybrid",
+            }
+        }
+    )
+
+
+class RangeSearchText(BaseModel):
+    """Query for every chunk within a similarity radius of the text."""
+
+    content: str
+    library_id: UUID
+    radius: float = Field(
+        ..., ge=-1, le=1, description="Minimum cosine similarity of returned chunks"
+    )
+    index_type: Literal["ivf", "flat"] = "flat"
+    metadata_filters: list[MetadataFilter | FilterGroup] = Field(default_factory=list)
+    fields: list[Literal["content", "metadata", "offsets"]] | None = Field(
+        default=None,
+        description="Optional chunk result parts to return, all if omitted",
+    )
+
+    model_config = ConfigDict(
+        json_schema_extra={
+            "example": {
+                "content": "quarterly revenue guidance",
+                "library_id": "123e4567-e89b-12d3-a456-426614174000",
+                "radius": 0.8,
+                "fields": ["offsets"],
+            }
+        }
+    )
+
+
+class ExampleSearchText(SearchOptions):
+    """Search by the stored embeddings of example chunks.
+
+    The query vector moves towards the ``positive`` examples and away from the
+    ``negative`` ones, without calling the embedding provider. Example chunks
+    are left out of the results.
+    """
+
+    library_id: UUID | None = Field(
+        default=None, description="Library to search, the example's own if omitted"
+    )
+    positive: list[UUID] = Field(
+        default_factory=list, description="Chunks the results should resemble"
+    )
+    negative: list[UUID] = Field(
+        default_factory=list, description="Chunks the results should not resemble"
+    )
+    negative_weight: float = Field(
+        default=0.5,
+        ge=0,
+        le=1,
+        description="Weight of the negative examples against the positive ones",
+    )
+
+    model_config = ConfigDict(
+        json_schema_extra={
+            "example": {
+                "negative": ["3fa85f64-5717-4562-b3fc-2c963f66afa6"],
+                "granularity": "chunk",
+                "limit": 10,
+            }
+        }
+    )
+
+
+class VectorSearchText(ExampleSearchText):
+    """Search by a caller-supplied query vector and/or example chunks."""
+
+    library_id: UUID
+    vector: list[float] | None = Field(
+        default=None,
+        description="Query vector with the dimension of the library's embeddings",
+    )
+
+    @model_validator(mode="after")
+    def check_query(self) -> VectorSearchText:
+        """Require a vector or a positive example to search by."""
+        if self.vector is None and not self.positive:
+            raise ValueError("Provide a query vector or positive example chunks")
+        return self
+
+    model_config = ConfigDict(
+        json_schema_extra={
+            "example": {
+                "library_id": "123e4567-e89b-12d3-a456-426614174000",
+                "vector": [0.012, -0.087, 0.044],
+                "limit": 10,
             }
         }
     )
@@ -58,7 +274,11 @@ class SearchResult(BaseModel):
 
     document: Document
     score: float = Field(
-        ..., description="Similarity score (0-1, higher is more similar)"
+        ...,
+        description=(
+            "Chunk scores aggregated per document: cosine similarities, or BM25 "
+            "or fused scores in keyword and hybrid modes (higher is more similar)"
+        ),
     )
     matching_chunks: int = Field(
         ..., description="Number of matching chunks in this document"
@@ -77,3 +297,134 @@ class SearchResult(BaseModel):
             }
         }
     )
+
+
+class ChunkSearchResult(BaseModel):
+    """A matching chunk returned by chunk-granularity search."""
+
+    chunk_id: UUID
+    document_id: UUID
+    score: float = Field(
+        ...,
+        description="Cosine similarity, or BM25 or fused score in keyword and "
+        "hybrid modes (higher is more similar)",
+    )
+    content: str | None = Field(default=None, description="Chunk text")
+    start_position: int | None = Field(
+        default=None,
+        description="Offset of the chunk's first character in the document",
+    )
+    end_position: int | None = Field(
+        default=None, description="Offset just past the chunk's last character"
+    )
+    chunk_number: int | None = Field(
+        default=None, description="Position of the chunk within its document"
+    )
+    metadata: dict | None = None
+
+    model_config = ConfigDict(
+        json_schema_extra={
+            "example": {
+                "chunk_id": "3fa85f64-5717-4562-b3fc-2c963f66afa6",
+                "document_id": "123e4567-e89b-12d3-a456-426614174000",
+                "score": 0.91,
+                "content": "Gradient descent updates the weights...",
+                "start_position": 1800,
+                "end_position": 2750,
+                "chunk_number": 2,
+            }
+        }
+    )
+
+
+class SearchPlan(BaseModel):
+    """Execution plan chosen for a search request, with its estimates."""
+
+    strategy: Literal[
+        "unfiltered", "brute_force", "in_scan_mask", "post_filter", "keyword"
+    ] = Field(..., description="How the vector search was executed")
+    mode: Literal["vector", "keyword", "hybrid"] = "vector"
+    index_type: Literal["ivf", "flat"]
+    library_id: UUID | None = Field(
+        default=None, description="Library searched, in multi-library searches"
+    )
+    fetch_k: int = Field(..., description="Number of chunks requested from the scan")
+    total_rows: int | None = Field(
+        default=None, description="Chunk rows in the library index, if it was loaded"
+    )
+    sql_candidates: int | None = Field(
+        default=None,
+        description="Candidate chunks selected in SQL, if within the prefilter limit",
+    )
+    estimated_selectivity: float | None = Field(
+        default=None, description="Estimated fraction of rows passing the filters"
+    )
+    estimated_matches: int | None = Field(
+        default=None, description="Estimated number of rows passing the filters"
+    )
+    fallback: bool = Field(
+        default=False,
+        description="Post-filtering returned too few chunks and was rerun as a "
+        "masked scan",
+    )
+    expansions: int = Field(
+        default=0,
+        description="Times the vector scan was resumed for more chunks to reach "
+        "the requested number of documents",
+    )
+    keyword_matches: int | None = Field(
+        default=None, description="Chunks containing a query term, in keyword modes"
+    )
+    degraded: Literal["embedding_timeout", "embedding_error"] | None = Field(
+        default=None,
+        description="Why the query could not be embedded, if the search fell back "
+        "to keyword retrieval",
+    )
+    next_cursor: str | None = Field(
+        default=None,
+        description="Opaque cursor resuming the search after this page, if more "
+        "results may follow",
+    )
+
+    # Vector scan and query of the search, kept to resume it for the next page
+    _scan: Any = PrivateAttr(default=None)
+    _query_vector: Any = PrivateAttr(default=None)
+
+
+class FacetValue(BaseModel):
+    """A metadata value with the number of search matches that have it."""
+
+    value: Any
+    count: int = Field(
+        ...,
+        description="Matching documents with the value, or matching chunks at "
+        "chunk granularity",
+    )
+
+
+class SearchDebugResponse(BaseModel):
+    """Search results together with the plan that produced them."""
+
+    plan: SearchPlan
+    library_plans: list[SearchPlan] = Field(
+        default_factory=list,
+        description="Plan of every library of a multi-library search; plan is "
+        "the first library's",
+    )
+    results: list[SearchResult | ChunkSearchResult]
+
+
+class SearchResponse(BaseModel):
+    """A page of search results with the next page's cursor and facet counts."""
+
+    results: list[SearchResult | ChunkSearchResult]
+    next_cursor: str | None = Field(
+        default=None,
+        description="Cursor of the next page, sent back as ``cursor``; null on "
+        "the last page or for searches that are not paged",
+    )
+    facets: dict[str, list[FacetValue]] | None = Field(
+        default=None,
+        description="Most frequent values of each requested facet field, most "
+        "frequent first",
+    )
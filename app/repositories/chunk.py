@@ -1,10 +1,13 @@
+import hashlib
 import json
 from collections.abc import Sequence
 from datetime import UTC, datetime
 from uuid import UUID
 
 from app.models.chunk import Chunk
+from app.models.models import FilterExpression
 from app.repositories.base import BaseRepository
+from app.utils.sql_filter import SQLFilterCompiler
 
 
 class ChunkRepository(BaseRepository[Chunk]):
@@ -87,18 +90,95 @@ class ChunkRepository(BaseRepository[Chunk]):
 
         return await self.find(entity.id)
 
-    async def find_by_library(self, library_id: UUID) -> list[Chunk]:
+    async def find_by_library(
+        self,
+        library_id: UUID,
+        metadata_filters: list[FilterExpression] | None = None,
+    ) -> list[Chunk]:
+        """Find a library's chunks, narrowed in SQL by the given filters.
+
+        Filters are pushed down as a candidate clause, so the result can still
+        contain rows that the filters reject; callers must verify them.
+        """
+        where, params = self._filter_clause(metadata_filters)
         rows = await self.db.read_query(
-            """
+            f"""
             SELECT c.id, c.content, c.document_id, c.embedding,
             c.created_at, c.updated_at, c.metadata
             FROM chunks c
             JOIN documents d ON c.document_id = d.id
+            WHERE d.library_id = ? AND {where}
+            """,
+            (str(library_id), *params),
+        )
+        return [self.to_entity(row) for row in rows]
+
+    async def find_ids_by_library(
+        self,
+        library_id: UUID,
+        metadata_filters: list[FilterExpression] | None = None,
+        limit: int | None = None,
+    ) -> list[UUID]:
+        """Find the ids of candidate chunks for the filters without loading rows."""
+        where, params = self._filter_clause(metadata_filters)
+        limit_sql = ""
+        if limit is not None:
+            limit_sql = "LIMIT ?"
+            params = [*params, limit]
+        rows = await self.db.read_query(
+            f"""
+            SELECT c.id
+            FROM chunks c
+            JOIN documents d ON c.document_id = d.id
+            WHERE d.library_id = ? AND {where}
+            {limit_sql}
+            """,
+            (str(library_id), *params),
+        )
+        return [UUID(row[0]) for row in rows]
+
+    async def library_generation(self, library_id: UUID) -> str:
+        """Fingerprint the library's chunk and document rows in one aggregate.
+
+        Adding, updating or deleting a chunk or document of the library changes
+        the row count, the rowid sum or the newest timestamps, so the
+        fingerprint identifies the generation of the library's vector index.
+        """
+        row = await self.db.read_one(
+            """
+            SELECT COUNT(*), TOTAL(c.rowid), MAX(c.created_at), MAX(c.updated_at),
+            COUNT(DISTINCT d.id), MAX(d.created_at), MAX(d.updated_at)
+            FROM chunks c
+            JOIN documents d ON c.document_id = d.id
             WHERE d.library_id = ?
             """,
             (str(library_id),),
         )
-        return [self.to_entity(row) for row in rows]
+        return hashlib.blake2b(repr(tuple(row)).encode(), digest_size=8).hexdigest()
+
+    async def find_many(self, ids: list[UUID]) -> list[Chunk]:
+        """Find chunks by id, in the order of the given ids."""
+        if not ids:
+            return []
+        placeholders = ", ".join("?" * len(ids))
+        rows = await self.db.read_query(
+            f"""
+            SELECT id, content, document_id, embedding, created_at, updated_at, metadata
+            FROM chunks WHERE id IN ({placeholders})
+            """,
+            [str(id) for id in ids],
+        )
+        chunks = {chunk.id: chunk for chunk in map(self.to_entity, rows)}
+        return [chunks[id] for id in ids if id in chunks]
+
+    def _filter_clause(
+        self, metadata_filters: list[FilterExpression] | None
+    ) -> tuple[str, list]:
+        """Translate metadata filters into a WHERE clause over the chunks alias."""
+        if not metadata_filters:
+            return "1", []
+        compiler = SQLFilterCompiler(alias="c", hot_columns=self.db.hot_columns)
+        return compiler.compile(metadata_filters)
 
     async def find_by_document(self, document_id: UUID) -> list[Chunk]:
         rows = await self.db.read_query(
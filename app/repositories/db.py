@@ -7,6 +7,7 @@ import aiosqlite
 from fastapi import Request
 
 from app.settings import settings
+from app.utils.sql_filter import HOT_FIELD_PATTERN, hot_field_column, json_path
 
 logger = logging.getLogger(__name__)
 
@@ -41,13 +42,23 @@ CREATE TABLE IF NOT EXISTS chunks (
     updated_at INT,
     FOREIGN KEY (document_id) REFERENCES documents(id) ON DELETE CASCADE
 );
+
+CREATE INDEX IF NOT EXISTS idx_documents_library_id ON documents(library_id);
+CREATE INDEX IF NOT EXISTS idx_chunks_document_id ON chunks(document_id);
 """
 
 
 class DB:
-    def __init__(self, db_path: str):
+    def __init__(self, db_path: str, hot_metadata_fields: list[str] | None = None):
         """Initialize database connection manager with path and concurrency controls."""
         self.db_path = db_path
+        self.hot_metadata_fields = (
+            settings.hot_metadata_fields
+            if hot_metadata_fields is None
+            else hot_metadata_fields
+        )
+        # Hot metadata field -> generated column on the chunks table
+        self.hot_columns: dict[str, str] = {}
         self.conn: aiosqlite.Connection | None = None
         self._read_semaphore = asyncio.Semaphore(10)  # 10 concurrent reads
         self._write_lock = asyncio.Lock()  # single writer
@@ -69,6 +80,7 @@ class DB:
             await self.conn.execute("PRAGMA foreign_keys = ON")
             await self.conn.execute("PRAGMA journal_mode = WAL")
             await self.conn.executescript(_TABLES)
+            await self._create_hot_columns()
             await self.conn.commit()
 
             self._initialized = True
@@ -78,6 +90,30 @@ class DB:
                 self.conn = None
             raise
 
+    async def _create_hot_columns(self):
+        """Materialize hot metadata fields as indexed virtual generated columns."""
+        async with self.conn.execute("PRAGMA table_xinfo(chunks)") as cursor:
+            existing = {row[1] for row in await cursor.fetchall()}
+
+        for field in self.hot_metadata_fields:
+            if not HOT_FIELD_PATTERN.match(field):
+                logger.warning(
+                    f"Skipping hot metadata field with invalid name: {field}"
+                )
+                continue
+
+            column = hot_field_column(field)
+            if column not in existing:
+                await self.conn.execute(
+                    f"ALTER TABLE chunks ADD COLUMN {column} "
+                    f"GENERATED ALWAYS AS (json_extract(metadata, {json_path(field)})) "
+                    "VIRTUAL"
+                )
+            await self.conn.execute(
+                f"CREATE INDEX IF NOT EXISTS idx_chunks_{column} ON chunks({column})"
+            )
+            self.hot_columns[field] = column
+
     async def read_query(self, query: str, params=None):
         """Execute a SELECT query and return all results."""
         if not self._initialized:
@@ -48,6 +48,21 @@ class DocumentRepository(BaseRepository[Document]):
         )
         return [self.to_entity(row) for row in rows]
 
+    async def find_attributes_by_library(self, id: UUID) -> list[Document]:
+        """Find the documents of a library without loading their content.
+
+        Indexes only need the filterable attributes and update times of a
+        library's documents, not the document text.
+        """
+        rows = await self.db.read_query(
+            """
+            SELECT id, title, NULL, library_id, created_at, updated_at, metadata FROM
+            documents WHERE library_id = ?
+            """,
+            (str(id),),
+        )
+        return [self.to_entity(row) for row in rows]
+
     async def find(self, id: UUID) -> Document | None:
         row = await self.db.read_one(
             """
@@ -62,6 +77,21 @@ class DocumentRepository(BaseRepository[Document]):
 
         return self.to_entity(row)
 
+    async def find_many(self, ids: list[UUID]) -> list[Document]:
+        """Find documents by id, in the order of the given ids."""
+        if not ids:
+            return []
+        placeholders = ", ".join("?" * len(ids))
+        rows = await self.db.read_query(
+            f"""
+            SELECT id, title, content, library_id, created_at, updated_at, metadata FROM
+            documents WHERE id IN ({placeholders})
+            """,
+            [str(id) for id in ids],
+        )
+        documents = {document.id: document for document in map(self.to_entity, rows)}
+        return [documents[id] for id in ids if id in documents]
+
     async def find_all(self) -> Sequence[Document]:
         rows = await self.db.read_query(
             """
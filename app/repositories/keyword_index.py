@@ -0,0 +1,56 @@
+from uuid import UUID
+
+from app.models.chunk import Chunk
+from app.repositories.chunk import ChunkRepository
+from app.repositories.db import DB
+from app.utils.bm25 import BM25Index
+
+# BM25 indexes of the libraries searched by keyword, shared by all requests
+_keyword_indexes: dict[UUID, BM25Index] = {}
+
+
+class KeywordIndexRepository:
+    """Per-library BM25 indexes over chunk content, kept in process memory.
+
+    A library's index is built from the database the first time it is searched
+    and afterwards maintained incrementally by the services that create, update
+    and delete chunks. Changes to libraries that were never searched are ignored
+    since their index will be built from the current rows.
+    """
+
+    def __init__(self, db: DB):
+        """Initialize the repository with the database used to build indexes."""
+        self.chunks = ChunkRepository(db)
+
+    async def get(self, library_id: UUID) -> BM25Index:
+        """Return the library's keyword index, building it on first use."""
+        index = _keyword_indexes.get(library_id)
+        if index is None:
+            index = BM25Index()
+            for chunk in await self.chunks.find_by_library(library_id):
+                index.add(chunk.id, chunk.content)
+            _keyword_indexes[library_id] = index
+        return index
+
+    def add_chunks(self, library_id: UUID, chunks: list[Chunk]):
+        """Index new or updated chunks of a library."""
+        index = _keyword_indexes.get(library_id)
+        if index is not None:
+            for chunk in chunks:
+                index.add(chunk.id, chunk.content)
+
+    def update_chunk(self, chunk: Chunk):
+        """Reindex the content of a chunk wherever it is indexed."""
+        for index in _keyword_indexes.values():
+            if chunk.id in index:
+                index.add(chunk.id, chunk.content)
+
+    def remove_chunks(self, chunk_ids: list[UUID]):
+        """Drop chunks from the keyword indexes that contain them."""
+        for index in _keyword_indexes.values():
+            for chunk_id in chunk_ids:
+                index.remove(chunk_id)
+
+    def drop(self, library_id: UUID):
+        """Forget a library's keyword index."""
+        _keyword_indexes.pop(library_id, None)
@@ -6,6 +6,7 @@ import numpy as np
 from app.models.chunk import Chunk
 from app.utils.flat_index import FlatIndex
 from app.utils.ivf import IVF
+from app.utils.quantization import chunks_to_vectors
 
 
 class VectorIndexRepository(ABC):
@@ -14,9 +15,29 @@ class VectorIndexRepository(ABC):
         """Train the index with the provided chunks."""
         raise NotImplementedError
 
+    def search_chunks(
+        self, query_vector: np.ndarray, k: int = 5, mask: np.ndarray | None = None
+    ) -> list[Chunk]:
+        """Search for k most similar chunks to the query vector.
+
+        If a boolean row mask is given, only chunks it selects are returned.
+        """
+        return [
+            chunk for chunk, _ in self.search_chunks_with_scores(query_vector, k, mask)
+        ]
+
     @abstractmethod
-    def search_chunks(self, query_vector: np.ndarray, k: int = 5) -> list[Chunk]:
-        """Search for k most similar chunks to the query vector."""
+    def search_chunks_with_scores(
+        self,
+        query_vector: np.ndarray,
+        k: int = 5,
+        mask: np.ndarray | None = None,
+        min_score: float | None = None,
+    ) -> list[tuple[Chunk, float]]:
+        """Return the k most similar chunks with their similarity, best first.
+
+        Chunks scoring below ``min_score`` are not returned.
+        """
         raise NotImplementedError
 
     @abstractmethod
@@ -31,7 +52,7 @@ class VectorIndexRepository(ABC):
 
     def _chunks_to_vectors(self, chunks: list[Chunk]) -> np.ndarray:
         """Convert chunk embeddings to numpy array of vectors."""
-        return np.array([np.frombuffer(chunk.embedding) for chunk in chunks])
+        return chunks_to_vectors(chunks)
 
 
 class FlatIndexRepository(VectorIndexRepository):
@@ -49,10 +70,22 @@ class FlatIndexRepository(VectorIndexRepository):
             raw_vectors = self._chunks_to_vectors(chunks)
             self._vectors = self.flat_index.fit(raw_vectors)
 
-    def search_chunks(self, query_vector: np.ndarray, k: int = 5) -> list[Chunk]:
+    def search_chunks_with_scores(
+        self,
+        query_vector: np.ndarray,
+        k: int = 5,
+        mask: np.ndarray | None = None,
+        min_score: float | None = None,
+    ) -> list[tuple[Chunk, float]]:
         """Search for k most similar chunks to the query vector."""
-        indices = self.flat_index.search(query_vector, self._vectors, k=k)
-        return [self._chunks[i] for i in indices if i < len(self._chunks)]
+        indices, scores = self.flat_index.search_with_scores(
+            query_vector, self._vectors, k=k, mask=mask, min_score=min_score
+        )
+        return [
+            (self._chunks[i], float(score))
+            for i, score in zip(indices, scores, strict=True)
+            if i < len(self._chunks)
+        ]
 
     def add_chunks(self, chunks: list[Chunk]):
         """Add new chunks to the existing index."""
@@ -115,14 +148,25 @@ class IVFIndexRepository(VectorIndexRepository):
             self.ivf.fit(vectors)
             self.ivf.create_index(vectors)
 
-    def search_chunks(self, query_vector: np.ndarray, k: int = 5) -> list[Chunk]:
+    def search_chunks_with_scores(
+        self,
+        query_vector: np.ndarray,
+        k: int = 5,
+        mask: np.ndarray | None = None,
+        min_score: float | None = None,
+    ) -> list[tuple[Chunk, float]]:
         """Search for k most similar chunks using IVF index."""
         if not self._chunks:
             return []
 
-        indices = self.ivf.search(query_vector)
-        result_chunks = [self._chunks[i] for i in indices if i < len(self._chunks)]
-        return result_chunks[:k]
+        indices, scores = self.ivf.search_with_scores(
+            query_vector, k=k, mask=mask, min_score=min_score
+        )
+        return [
+            (self._chunks[i], float(score))
+            for i, score in zip(indices, scores, strict=True)
+            if i < len(self._chunks)
+        ]
 
     def add_chunks(self, chunks: list[Chunk]):
         """Add new chunks and rebuild the IVF index."""
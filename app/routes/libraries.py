@@ -2,7 +2,7 @@ from uuid import UUID
 
 from fastapi import APIRouter, Depends, HTTPException, status
 
-from app.exceptions import DatabaseError, LibraryNotFoundException
+from app.exceptions import DatabaseError, LibraryNotFoundException, ValidationError
 from app.models.library import Library, LibraryCreate, LibraryUpdate
 from app.services.library_service import LibraryService, get_library_service
 
@@ -65,6 +65,10 @@ async def update_library_by_path(
         return updated_library
     except LibraryNotFoundException as e:
         raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail=str(e)) from e
+    except ValidationError as e:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST, detail=str(e)
+        ) from e
     except DatabaseError as e:
         raise HTTPException(
             status_code=status.HTTP_500_INTERNAL_SERVER_ERROR, detail=str(e)
@@ -81,6 +85,10 @@ async def update_library(
         return updated_library
     except LibraryNotFoundException as e:
         raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail=str(e)) from e
+    except ValidationError as e:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST, detail=str(e)
+        ) from e
     except DatabaseError as e:
         raise HTTPException(
             status_code=status.HTTP_500_INTERNAL_SERVER_ERROR, detail=str(e)
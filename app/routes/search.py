@@ -1,27 +1,208 @@
-from fastapi import APIRouter, Depends, HTTPException, status
+from uuid import UUID
 
-from app.exceptions import ValidationError
-from app.models.models import SearchResult, SearchText
+from fastapi import APIRouter, Depends, HTTPException, Response, status
+from fastapi.responses import StreamingResponse
+
+from app.exceptions import ChunkNotFoundException, ValidationError
+from app.models.models import (
+    ChunkSearchResult,
+    ExampleSearchText,
+    RangeSearchText,
+    SearchDebugResponse,
+    SearchPlan,
+    SearchResponse,
+    SearchResult,
+    SearchText,
+    VectorSearchText,
+)
 from app.services.search_service import SearchService, get_search_service
 
 router = APIRouter(prefix="/search", tags=["search"])
 
+# Response header set when the query could not be embedded and keyword
+# retrieval answered instead; its value is the reason
+DEGRADED_HEADER = "X-Search-Degraded"
+
+
+async def _search(
+    service: SearchService, search_data: SearchText, response: Response
+) -> tuple[list[SearchResult] | list[ChunkSearchResult], list[SearchPlan]]:
+    """Run a search request and set its degraded header.
+
+    Returns the results with the plan of every searched library. Service errors
+    are raised as HTTP errors.
+    """
+    try:
+        search_results, plans = await service.search_libraries(search_data)
+    except ValidationError as e:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST, detail=str(e)
+        ) from e
+    except Exception as e:
+        raise HTTPException(
+            status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
+            detail=f"Search failed: {str(e)}",
+        ) from e
+
+    degraded = next((plan.degraded for plan in plans if plan.degraded), None)
+    if degraded:
+        response.headers[DEGRADED_HEADER] = degraded
+    return search_results or [], plans
 
-@router.post("", response_model=list[SearchResult], status_code=status.HTTP_200_OK)
+
+@router.post(
+    "",
+    response_model=SearchResponse,
+    response_model_exclude_unset=True,
+    status_code=status.HTTP_200_OK,
+)
 async def search_similar(
-    search_data: SearchText, service: SearchService = Depends(get_search_service)
+    search_data: SearchText,
+    response: Response,
+    service: SearchService = Depends(get_search_service),
+):
+    """Search for similar documents in a library with optional metadata filtering.
+
+    With ``granularity="chunk"`` the matching chunks are returned instead of
+    their documents. Result parts left out by ``fields`` are omitted from the
+    response. Degraded responses carry the ``X-Search-Degraded`` header.
+
+    While more results may follow, ``next_cursor`` holds a cursor; sending it
+    back as ``cursor`` returns the next page of the same search.
+
+    With ``library_ids`` the libraries are searched concurrently with one query
+    embedding and their best results merged; such searches are not paged.
+
+    ``facets`` counts the values of those metadata fields over every chunk
+    passing the filters, or only the returned results with
+    ``facet_scope="results"``. Counts are of documents, or chunks at chunk
+    granularity, keep the ``facet_limit`` most frequent values per field and
+    are returned as ``facets``.
+    """
+    search_results, plans = await _search(service, search_data, response)
+    search_response = SearchResponse(
+        results=search_results, next_cursor=plans[0].next_cursor
+    )
+    if search_data.facets:
+        try:
+            search_response.facets = await service.search_facets(
+                search_data, search_results
+            )
+        except Exception as e:
+            raise HTTPException(
+                status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
+                detail=f"Search failed: {str(e)}",
+            ) from e
+    return search_response
+
+
+@router.post(
+    "/debug", response_model=SearchDebugResponse, status_code=status.HTTP_200_OK
+)
+async def search_similar_debug(
+    search_data: SearchText,
+    response: Response,
+    service: SearchService = Depends(get_search_service),
+):
+    """Run a search and return the chosen execution plan with its estimates."""
+    search_results, plans = await _search(service, search_data, response)
+    return SearchDebugResponse(
+        plan=plans[0],
+        library_plans=plans if len(plans) > 1 else [],
+        results=search_results,
+    )
+
+
+@router.post(
+    "/vector",
+    response_model=SearchResponse,
+    response_model_exclude_unset=True,
+    status_code=status.HTTP_200_OK,
+)
+async def search_by_vector(
+    search_data: VectorSearchText,
+    service: SearchService = Depends(get_search_service),
 ):
-    """Search for similar documents in a library with optional metadata filtering."""
+    """Search by a caller-supplied query vector instead of text.
+
+    The vector may be combined with positive and negative example chunks; no
+    embedding call is made. Paging works as for ``/search``.
+    """
     try:
-        search_results = await service.search_similar_documents(
-            search_text=search_data.content,
-            library_id=search_data.library_id,
-            index_type=search_data.index_type,
-            limit=search_data.limit,
-            metadata_filters=search_data.metadata_filters,
+        search_results, plan = await service.search_by_vector(search_data)
+        return SearchResponse(
+            results=search_results or [], next_cursor=plan.next_cursor
         )
+    except ChunkNotFoundException as e:
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail=str(e)) from e
+    except ValidationError as e:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST, detail=str(e)
+        ) from e
+    except Exception as e:
+        raise HTTPException(
+            status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
+            detail=f"Search failed: {str(e)}",
+        ) from e
+
+
+@router.post(
+    "/similar-to/{chunk_id}",
+    response_model=SearchResponse,
+    response_model_exclude_unset=True,
+    status_code=status.HTTP_200_OK,
+)
+async def search_similar_to(
+    chunk_id: UUID,
+    search_data: ExampleSearchText,
+    service: SearchService = Depends(get_search_service),
+):
+    """Search for content like a stored chunk, using its embedding.
+
+    The chunk itself and any example chunks are left out of the results.
+    Paging works as for ``/search``.
+    """
+    try:
+        search_results, plan = await service.search_similar_to(chunk_id, search_data)
+        return SearchResponse(
+            results=search_results or [], next_cursor=plan.next_cursor
+        )
+    except ChunkNotFoundException as e:
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail=str(e)) from e
+    except ValidationError as e:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST, detail=str(e)
+        ) from e
+    except Exception as e:
+        raise HTTPException(
+            status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
+            detail=f"Search failed: {str(e)}",
+        ) from e
+
+
+@router.post(
+    "/range",
+    status_code=status.HTTP_200_OK,
+    response_class=StreamingResponse,
+    responses={
+        200: {
+            "content": {"application/x-ndjson": {}},
+            "description": "One ChunkSearchResult JSON object per line, best first",
+        }
+    },
+)
+async def search_range(
+    search_data: RangeSearchText,
+    service: SearchService = Depends(get_search_service),
+):
+    """Stream every chunk with similarity >= ``radius`` to the query.
 
-        return search_results or []
+    Results are streamed as newline-delimited JSON in descending score order,
+    for deduplication and find-all-mentions workflows that need more than the
+    top ``limit`` matches.
+    """
+    try:
+        batches = await service.range_search(search_data)
     except ValidationError as e:
         raise HTTPException(
             status_code=status.HTTP_400_BAD_REQUEST, detail=str(e)
@@ -31,3 +212,10 @@ async def search_similar(
             status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
             detail=f"Search failed: {str(e)}",
         ) from e
+
+    def lines():
+        for batch in batches:
+            for result in batch:
+                yield result.model_dump_json(exclude_unset=True) + "\n"
+
+    return StreamingResponse(lines(), media_type="application/x-ndjson")
@@ -6,12 +6,14 @@ from fastapi import Depends
 from app.models.chunk import Chunk, ChunkUpdate
 from app.repositories.chunk import ChunkRepository
 from app.repositories.db import get_db
+from app.repositories.keyword_index import KeywordIndexRepository
 
 
 class ChunkService:
     def __init__(self, chunk_repo: ChunkRepository):
         """Initialize ChunkService with chunk repository."""
         self.chunk_repo = chunk_repo
+        self.keyword_indexes = KeywordIndexRepository(chunk_repo.db)
 
     async def get_chunk(self, chunk_id: UUID) -> Chunk | None:
         """Get a chunk by ID."""
@@ -43,11 +45,16 @@ class ChunkService:
             update={**update_data, "updated_at": datetime.now(UTC)}
         )
 
-        return await self.chunk_repo.update(updated_chunk)
+        chunk = await self.chunk_repo.update(updated_chunk)
+        if chunk:
+            self.keyword_indexes.update_chunk(chunk)
+        return chunk
 
     async def delete_chunk(self, chunk_id: UUID) -> int:
         """Delete a chunk by ID. Returns number of deleted rows."""
-        return await self.chunk_repo.delete(chunk_id)
+        deleted_count = await self.chunk_repo.delete(chunk_id)
+        self.keyword_indexes.remove_chunks([chunk_id])
+        return deleted_count
 
 
 def get_chunk_service(db=Depends(get_db)) -> ChunkService:
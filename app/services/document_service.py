@@ -4,12 +4,19 @@ from uuid import UUID
 from fastapi import Depends
 
 from app.embeddings import Embedder
-from app.exceptions import DatabaseError, DocumentNotFoundException, EmbeddingError
+from app.exceptions import (
+    DatabaseError,
+    DocumentNotFoundException,
+    EmbeddingError,
+    ValidationError,
+)
 from app.models.chunk import Chunk
 from app.models.document import Document
 from app.repositories.chunk import ChunkRepository
 from app.repositories.db import DB, get_db
 from app.repositories.document import DocumentRepository
+from app.repositories.keyword_index import KeywordIndexRepository
+from app.repositories.library import LibraryRepository
 
 logger = logging.getLogger(__name__)
 
@@ -26,17 +33,24 @@ class DocumentService:
         self.embedder = Embedder()
         self.docs = DocumentRepository(self.db)
         self.chunks = ChunkRepository(self.db)
+        self.libraries = LibraryRepository(self.db)
+        self.keyword_indexes = KeywordIndexRepository(self.db)
 
     async def create(self, document: Document) -> Document:
         try:
+            await self._configure_embedder(document.library_id)
             # Use transaction to ensure document and chunks are created atomically
+            chunks = []
             async with self.db.transaction() as tx_db:
                 created_doc = await self.docs.create_transactional(document, tx_db)
                 if document.content:
                     chunks = self._chunk_and_embed_document(created_doc)
                     for chunk in chunks:
                         await self.chunks.create_transactional(chunk, tx_db)
+            self.keyword_indexes.add_chunks(created_doc.library_id, chunks)
             return created_doc
+        except EmbeddingError:
+            raise
         except Exception as e:
             logger.error(f"Failed to create document {document.title}: {str(e)}")
             raise DatabaseError(f"Failed to create document: {str(e)}") from e
@@ -70,6 +84,7 @@ class DocumentService:
             updated_doc = await self.docs.update(document)
 
             if content_changed:
+                await self._configure_embedder(updated_doc.library_id)
                 await self._handle_content_change(document_id, updated_doc)
 
             return updated_doc
@@ -79,6 +94,17 @@ class DocumentService:
             logger.error(f"Failed to update document {document_id}: {str(e)}")
             raise DatabaseError(f"Failed to update document: {str(e)}") from e
 
+    async def _configure_embedder(self, library_id: UUID) -> None:
+        """Use the embedding dimension and type the library opted into."""
+        library = await self.libraries.find(library_id)
+        try:
+            options = Embedder.options_from_metadata(
+                library.metadata if library else None
+            )
+        except ValidationError as e:
+            raise EmbeddingError(f"Invalid embedding options: {str(e)}") from e
+        self.embedder.configure(**options)
+
     async def _get_and_validate_document(self, document_id: UUID) -> Document:
         """Get document by ID and validate it exists."""
         document = await self.docs.find(document_id)
@@ -95,31 +121,40 @@ class DocumentService:
     ) -> None:
         """Handle content change by recreating chunks with new embeddings."""
         # Use transaction to ensure chunk operations are atomic
+        new_chunks = []
         async with self.db.transaction() as tx_db:
-            await self._delete_existing_chunks(document_id, tx_db)
+            old_chunks = await self._delete_existing_chunks(document_id, tx_db)
 
             if document.content:  # Only create chunks if content exists
-                await self._create_new_chunks(document, tx_db)
+                new_chunks = await self._create_new_chunks(document, tx_db)
+
+        self.keyword_indexes.remove_chunks([chunk.id for chunk in old_chunks])
+        self.keyword_indexes.add_chunks(document.library_id, new_chunks)
 
         # Note: Caller should invalidate search indexes after this operation
 
-    async def _delete_existing_chunks(self, document_id: UUID, tx_db) -> None:
-        """Delete all existing chunks for a document."""
+    async def _delete_existing_chunks(self, document_id: UUID, tx_db) -> list[Chunk]:
+        """Delete all existing chunks for a document and return them."""
         old_chunks = await self.chunks.find_by_document(document_id)
         for chunk in old_chunks:
             await self.chunks.delete_transactional(chunk.id, tx_db)
+        return old_chunks
 
-    async def _create_new_chunks(self, document: Document, tx_db) -> None:
-        """Create new chunks with embeddings for the document."""
+    async def _create_new_chunks(self, document: Document, tx_db) -> list[Chunk]:
+        """Create new chunks with embeddings for the document and return them."""
         chunks = self._chunk_and_embed_document(document)
         for chunk in chunks:
             await self.chunks.create_transactional(chunk, tx_db)
+        return chunks
 
     async def delete(self, document_id: UUID) -> bool:
         try:
             # First verify document exists
             await self.get(document_id)
+            # Chunks are deleted with the document by the foreign key cascade
+            chunk_ids = [c.id for c in await self.chunks.find_by_document(document_id)]
             deleted_count = await self.docs.delete(document_id)
+            self.keyword_indexes.remove_chunks(chunk_ids)
             return deleted_count > 0
         except DocumentNotFoundException:
             raise
@@ -143,7 +178,8 @@ class DocumentService:
                 combined_metadata = {
                     **chunk_metadata,  # Smart chunker metadata
                     "embedding_model": self.embedder.model,
-                    "embedding_dimension": len(embedding),
+                    "embedding_dimension": self.embedder.output_dimension,
+                    "embedding_type": self.embedder.embedding_type,
                     "dtype": str(embedding.dtype),
                     "document_title": document.title,
                     "document_id": str(document.id),
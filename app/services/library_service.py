@@ -3,11 +3,13 @@ from uuid import UUID
 
 from fastapi import Depends
 
-from app.exceptions import DatabaseError, LibraryNotFoundException
+from app.embeddings import Embedder
+from app.exceptions import DatabaseError, LibraryNotFoundException, ValidationError
 from app.models.document import Document
 from app.models.library import Library
 from app.repositories.db import DB, get_db
 from app.repositories.document import DocumentRepository
+from app.repositories.keyword_index import KeywordIndexRepository
 from app.repositories.library import LibraryRepository
 
 logger = logging.getLogger(__name__)
@@ -19,6 +21,7 @@ class LibraryService:
         self.db = db
         self.libraries = LibraryRepository(self.db)
         self.docs = DocumentRepository(self.db)
+        self.keyword_indexes = KeywordIndexRepository(self.db)
 
     async def create_library(self, library: Library) -> Library:
         """Create a new library."""
@@ -64,26 +67,47 @@ class LibraryService:
             raise DatabaseError(f"Failed to get documents: {str(e)}") from e
 
     async def update_library(self, library: Library) -> Library:
-        """Update an existing library."""
+        """Update an existing library.
+
+        The embedding options of a library that already has documents cannot
+        change, since its stored chunks were embedded with the old ones.
+        """
         try:
+            await self._check_embedding_options(library)
             updated_library = await self.libraries.update(library)
             if not updated_library:
                 raise LibraryNotFoundException(library.id)
             return updated_library
         except KeyError as e:
             raise LibraryNotFoundException(library.id) from e
-        except LibraryNotFoundException:
+        except (LibraryNotFoundException, ValidationError):
             raise
         except Exception as e:
             logger.error(f"Failed to update library {library.id}: {str(e)}")
             raise DatabaseError(f"Failed to update library: {str(e)}") from e
 
+    async def _check_embedding_options(self, library: Library) -> None:
+        """Reject new embedding options for a library whose chunks are embedded."""
+        existing = await self.libraries.find(library.id)
+        if existing is None:
+            return
+        options = Embedder.options_from_metadata(library.metadata)
+        if options == Embedder.options_from_metadata(
+            existing.metadata
+        ) or not await self.docs.find_by_library(library.id):
+            return
+        raise ValidationError(
+            "Cannot change the embedding options of a library with documents; "
+            "delete its documents or create a new library"
+        )
+
     async def delete_library(self, library_id: UUID) -> bool:
         """Delete a library by ID. Returns True if deleted successfully."""
         try:
             # First verify library exists
             await self.get_library(library_id)
             deleted_count = await self.libraries.delete(library_id)
+            self.keyword_indexes.drop(library_id)
             return deleted_count > 0
         except LibraryNotFoundException:
             raise
@@ -1,20 +1,132 @@
+import asyncio
+import heapq
+import itertools
 import logging
-from typing import Literal
+import math
+from collections import Counter, OrderedDict
+from collections.abc import Iterable, Iterator
 from uuid import UUID
 
+import numpy as np
 from fastapi import Depends
 
 from app.embeddings import Embedder
-from app.exceptions import IndexError, ValidationError
-from app.models.models import MetadataFilter, SearchResult
+from app.exceptions import (
+    ChunkNotFoundException,
+    EmbeddingError,
+    EmbeddingTimeoutError,
+    IndexError,
+    ValidationError,
+)
+from app.models.chunk import Chunk
+from app.models.document import Document
+from app.models.models import (
+    ChunkSearchResult,
+    ExampleSearchText,
+    FacetValue,
+    FilterExpression,
+    FilterGroup,
+    MetadataFilter,
+    RangeSearchText,
+    SearchPlan,
+    SearchResult,
+    SearchText,
+    VectorSearchText,
+)
 from app.repositories.chunk import ChunkRepository
 from app.repositories.db import DB, get_db
 from app.repositories.document import DocumentRepository
+from app.repositories.keyword_index import KeywordIndexRepository
+from app.repositories.library import LibraryRepository
+from app.settings import settings
+from app.utils.example_query import example_query
+from app.utils.flat_index import FlatIndex
 from app.utils.metadata_filter import MetadataFilterProcessor
-from app.utils.persistent_index import PersistentFlatIndex, PersistentIVFIndex
+from app.utils.mmr import mmr
+from app.utils.persistent_index import (
+    ChunkScan,
+    FilteredChunkScan,
+    PersistentFlatIndex,
+    PersistentIVFIndex,
+)
+from app.utils.quantization import (
+    chunks_to_vectors,
+    decode_embedding,
+    embedding_type_of,
+    to_float_vectors,
+)
+from app.utils.rank_fusion import reciprocal_rank_fusion, weighted_fusion
+from app.utils.score_aggregation import aggregate_scores
+from app.utils.search_cursor import SearchCursor, new_token
+from app.utils.topk import RankedScan
 
 logger = logging.getLogger(__name__)
 
+# Filters passing at least this fraction of rows are applied after an IVF search
+POST_FILTER_MIN_SELECTIVITY = 0.5
+# Extra chunks fetched for post-filtering beyond limit / selectivity
+OVERFETCH_FACTOR = 2.0
+# Candidate chunks per requested chunk that MMR re-ranking chooses from
+MMR_CANDIDATE_FACTOR = 4
+# Optional search result parts a request can project
+RESULT_PARTS = ("content", "metadata", "offsets")
+# Recently embedded queries, keyed by text and embedding options (LRU)
+_query_vectors: OrderedDict[tuple, np.ndarray] = OrderedDict()
+
+
+class _SearchPage:
+    """Scan of a paged vector search, positioned after the cursor's last result.
+
+    Pages rank results by descending score, ties by ascending id, and each
+    page starts after the last result of the previous one. A scan restarted
+    from a cursor skips everything ranked at or before that result, so it
+    returns the same page as the live scan would.
+    """
+
+    def __init__(
+        self,
+        scan: ChunkScan | FilteredChunkScan,
+        plan: SearchPlan,
+        cursor: SearchCursor,
+    ):
+        self.scan = scan
+        self.plan = plan
+        self.cursor = cursor
+        self.by_document = cursor.granularity == "document"
+        # Scanned chunks not returned yet, the results already returned, and
+        # the lowest score the scan handed out so far
+        self.pending: list[tuple[Chunk, float]] = []
+        self.seen: set[UUID] = set()
+        self.floor = math.inf
+
+    def key(self, chunk: Chunk) -> UUID:
+        """Return the id of the result a chunk belongs to."""
+        return chunk.document_id if self.by_document else chunk.id
+
+    def admit(self, scored: list[tuple[Chunk, float]]) -> list[tuple[Chunk, float]]:
+        """Drop chunks of results that earlier pages returned."""
+        kept = []
+        for chunk, score in scored:
+            key = self.key(chunk)
+            if self.cursor.precedes(score, key):
+                self.seen.add(key)
+            elif key not in self.seen:
+                kept.append((chunk, score))
+        return kept
+
+    def rank(self, scored: list[tuple[Chunk, float]]) -> list[tuple[UUID, float]]:
+        """Rank the results of scored chunks, documents by their best chunk."""
+        best: dict[UUID, float] = {}
+        for chunk, score in scored:
+            key = self.key(chunk)
+            best[key] = max(score, best.get(key, -math.inf))
+        return sorted(best.items(), key=lambda item: (-item[1], item[0]))
+
+
+# Live page scans keyed by cursor token, so next pages neither re-embed the
+# query nor rescan returned rows (LRU)
+_search_pages: OrderedDict[str, _SearchPage] = OrderedDict()
+
 
 class SearchService:
     def __init__(self, db: DB):
@@ -23,86 +135,605 @@ class SearchService:
         self.embedder = Embedder()
         self.chunks = ChunkRepository(self.db)
         self.docs = DocumentRepository(self.db)
-        self.flat_index = PersistentFlatIndex()
+        self.libraries = LibraryRepository(self.db)
+        self.keyword_indexes = KeywordIndexRepository(self.db)
+        self.flat_index = PersistentFlatIndex(
+            memmap_min_rows=settings.flat_index_memmap_rows
+        )
         self.ivf_index = PersistentIVFIndex()
-        self._loaded_indexes = {}
+        self.flat_index_kernel = FlatIndex()
+        self._loaded_indexes: dict[str, PersistentFlatIndex | PersistentIVFIndex] = {}
 
     async def search_similar_documents(
-        self,
-        search_text: str,
-        library_id: UUID,
-        index_type: Literal["flat", "ivf"] = "flat",
-        limit: int = 1,
-        metadata_filters: list[MetadataFilter] = None,
-    ) -> list[SearchResult]:
+        self, search: SearchText
+    ) -> list[SearchResult] | list[ChunkSearchResult]:
         """Search for similar documents in a library using vector similarity with
         metadata filtering."""
-        if metadata_filters is None:
-            metadata_filters = []
+        search_results, _ = await self.search_with_plan(search)
+        return search_results
+
+    async def search_with_plan(
+        self,
+        search: SearchText,
+        query_vector: np.ndarray | None = None,
+        paged: bool = True,
+    ) -> tuple[list[SearchResult] | list[ChunkSearchResult], SearchPlan]:
+        """Search for similar documents and return the execution plan used.
+
+        ``keyword`` mode ranks chunks by BM25 over their content without calling
+        the embedding provider; ``hybrid`` runs keyword and vector retrieval
+        concurrently and fuses the two rankings with ``fusion``. If the query
+        cannot be embedded within ``embedding_timeout`` and no cached vector
+        exists, the search degrades to keyword retrieval and the plan says why.
+
+        Documents are scored by ``aggregation`` over their matching chunks: the
+        best chunk's score, the sum of all, or the sum of the ``top_n`` best.
+        ``min_score`` drops chunks whose vector similarity is below it inside
+        the search kernels, so their documents are never loaded.
+
+        ``chunk`` granularity returns the best chunks themselves instead, with
+        their text and chunker offsets but no embeddings, and loads no
+        documents. ``fields`` limits the optional parts of either result kind to
+        ``content``, ``metadata`` and ``offsets``; omitted parts are left unset.
+
+        ``mmr`` re-ranking orders the candidate chunks by maximal marginal
+        relevance so near-duplicate passages give way to distinct ones, trading
+        relevance for novelty by ``diversity``. Chunk results follow that order;
+        documents are ranked by when one of their chunks is first selected.
+
+        Vector searches ranked by similarity alone (no re-ranking, documents
+        scored by their best chunk) return a ``next_cursor`` in the plan while
+        more results may follow. Passing it as ``cursor`` returns the next page
+        of that search, whose query and options are read from the cursor. IVF
+        searches are only paged when every list was probed for the first page
+        (e.g. selective filters), since partial probes return chunks out of
+        global score order.
+
+        A ``query_vector`` in the library's embedding space is searched as is in
+        vector mode, without embedding the search content. ``paged=False``
+        issues no cursor.
+
+        Only ``search.library_id`` is searched; ``search_libraries`` searches
+        several libraries together.
+        """
+        library_id, limit, fields = search.library_id, search.limit, search.fields
+        if search.cursor is not None:
+            return await self._next_page(search.cursor, library_id, limit, fields)
+
+        granularity, rerank = search.granularity, search.rerank
 
         # Validate metadata filters
-        filter_errors = MetadataFilterProcessor.validate_filters(metadata_filters)
+        filter_errors = MetadataFilterProcessor.validate_filters(
+            search.metadata_filters
+        )
         if filter_errors:
             raise ValidationError(
                 f"Invalid metadata filters: {'; '.join(filter_errors)}"
             )
 
-        # Get embedding for search text
-        embedding = self.embedder.embed([search_text])[0]
+        generation = None
+        if (
+            paged
+            and search.mode == "vector"
+            and rerank == "none"
+            and (granularity == "chunk" or search.aggregation == "max")
+        ):
+            # Read before the scan, so a concurrent change makes the cursor stale
+            generation = await self.chunks.library_generation(library_id)
 
-        # Get all chunks for the library
-        chunks = await self.chunks.find_by_library(library_id)
-        if not chunks:
-            return []
+        if granularity == "chunk":
+            similar_chunks, plan = await self._retrieve(
+                search,
+                limit * MMR_CANDIDATE_FACTOR if rerank == "mmr" else limit,
+                query_vector=query_vector,
+            )
+            if rerank == "mmr":
+                selected = itertools.islice(
+                    self._diversify(similar_chunks, search.diversity), limit
+                )
+            elif self._pages(plan, generation):
+                page = self._start_page(plan, search, generation, similar_chunks)
+                return await self._page_results(page, plan, limit, fields), plan
+            else:
+                selected = sorted(
+                    similar_chunks, key=lambda pair: pair[1], reverse=True
+                )[:limit]
+            return self._chunk_results(selected, fields), plan
 
-        # Apply metadata filters to chunks first
-        if metadata_filters:
-            chunks = MetadataFilterProcessor.apply_filters(chunks, metadata_filters)
-            if not chunks:
-                return []
-
-        # Perform vector search based on index type
-        similar_chunks = self._search_chunks(
-            chunks, embedding, index_type, limit * 3, library_id
-        )  # Get more chunks to account for document grouping
-
-        # Group chunks by document and calculate scores
-        document_scores = {}
-        document_chunk_counts = {}
-
-        for i, chunk in enumerate(similar_chunks):
-            doc_id = chunk.document_id
-            # Calculate similarity score (inverse of rank, normalized)
-            score = 1.0 - (i / len(similar_chunks))
-
-            if doc_id not in document_scores:
-                document_scores[doc_id] = score
-                document_chunk_counts[doc_id] = 1
+        # Get more chunks to account for document grouping
+        similar_chunks, plan = await self._retrieve(
+            search, limit * 3, min_documents=limit, query_vector=query_vector
+        )
+        if self._pages(plan, generation):
+            page = self._start_page(plan, search, generation, similar_chunks)
+            return await self._page_results(page, plan, limit, fields), plan
+
+        # Group chunks by document and aggregate their scores
+        doc_ids, scores, counts = aggregate_scores(
+            [chunk.document_id for chunk, _ in similar_chunks],
+            np.array([score for _, score in similar_chunks]),
+            search.aggregation,
+            search.top_n,
+        )
+        if rerank == "mmr":
+            aggregated = dict(
+                zip(doc_ids, zip(scores, counts, strict=True), strict=True)
+            )
+            doc_ids = []
+            for chunk, _ in self._diversify(similar_chunks, search.diversity):
+                if chunk.document_id not in doc_ids:
+                    doc_ids.append(chunk.document_id)
+                    if len(doc_ids) == limit:
+                        break
+            scores = [aggregated[doc_id][0] for doc_id in doc_ids]
+            counts = [aggregated[doc_id][1] for doc_id in doc_ids]
+
+        search_results = await self._document_results(
+            doc_ids[:limit], scores[:limit], counts[:limit], fields
+        )
+        return search_results, plan
+
+    async def _document_results(
+        self, doc_ids: list[UUID], scores, counts, fields: list[str] | None
+    ) -> list[SearchResult]:
+        """Load ranked documents and build their results in rank order."""
+        # Document attributes were already filtered on with the chunk rows, so
+        # the ranked documents are loaded in one query
+        documents = await self.docs.find_many(doc_ids)
+        omitted = {"content", "metadata"} - set(fields or RESULT_PARTS)
+        found = {
+            document.id: (
+                Document.model_validate(document.model_dump(exclude=omitted))
+                if omitted
+                else document
+            )
+            for document in documents
+        }
+        return [
+            SearchResult(
+                document=found[doc_id], score=float(score), matching_chunks=int(count)
+            )
+            for doc_id, score, count in zip(doc_ids, scores, counts, strict=True)
+            if doc_id in found
+        ]
+
+    async def search_libraries(
+        self, search: SearchText
+    ) -> tuple[list[SearchResult] | list[ChunkSearchResult], list[SearchPlan]]:
+        """Search several libraries concurrently and merge their best results.
+
+        The query is embedded once per distinct embedding options of the
+        libraries, every library is searched for its own best ``limit``
+        results, and a heap selects the global best ``limit`` by score. Vector
+        similarities compare across libraries; BM25 and fused scores are
+        relative to each library. Returns the results and each library's plan.
+
+        A single library is searched by ``search_with_plan``; only such
+        searches are paged.
+        """
+        library_ids = search.libraries
+        if len(library_ids) == 1:
+            search_results, plan = await self.search_with_plan(
+                search.model_copy(
+                    update={"library_id": library_ids[0], "library_ids": None}
+                )
+            )
+            return search_results, [plan]
+        if search.cursor is not None:
+            raise ValidationError("Search cursors only page single-library searches")
+
+        vectors, degraded = {}, {}
+        mode = search.mode
+        if mode != "keyword":
+            vectors, degraded = await self._embed_for_libraries(
+                search.content, library_ids
+            )
+        outcomes = await asyncio.gather(
+            *(
+                self.search_with_plan(
+                    search.model_copy(
+                        update={
+                            "library_id": library_id,
+                            "library_ids": None,
+                            "mode": "keyword" if library_id in degraded else mode,
+                        }
+                    ),
+                    query_vector=vectors.get(library_id),
+                    paged=False,
+                )
+                for library_id in library_ids
+            )
+        )
+
+        plans = []
+        for library_id, (_, plan) in zip(library_ids, outcomes, strict=True):
+            plan.library_id = library_id
+            if library_id in degraded:
+                plan.mode = mode
+                plan.degraded = degraded[library_id]
+            plans.append(plan)
+        search_results = heapq.nlargest(
+            search.limit,
+            itertools.chain.from_iterable(results for results, _ in outcomes),
+            key=lambda result: result.score,
+        )
+        return search_results, plans
+
+    async def search_facets(
+        self,
+        search: SearchText,
+        results: list[SearchResult] | list[ChunkSearchResult] | None = None,
+    ) -> dict[str, list[FacetValue]]:
+        """Count the values of metadata fields over the rows a search matches.
+
+        The ``facets`` fields are counted over the search's candidates, every
+        chunk passing its filters, or, with the ``results`` facet scope, only
+        over the returned ``results``: the chunks, or the matching chunks of the
+        documents. A cursor page counts the candidates of the cursor's filters.
+        They are computed on the cached index of each library the search ran on,
+        from its attribute columns with a bitmap and a ``bincount``, without
+        loading chunks, and count documents unless the granularity is
+        ``chunk``. The ``facet_limit`` most frequent values of each field are
+        returned, most frequent first, and the counts of several libraries are
+        added up.
+        """
+        granularity, index_type = search.granularity, search.index_type
+        filters = list(search.metadata_filters)
+        if search.cursor is not None:
+            try:
+                position = SearchCursor.decode(search.cursor)
+            except ValueError as e:
+                raise ValidationError(f"Invalid search cursor: {str(e)}") from e
+            granularity, index_type = position.granularity, position.index_type
+            filters = list(position.metadata_filters)
+        if search.facet_scope == "results":
+            if granularity == "chunk":
+                field, ids = "id", [result.chunk_id for result in results or []]
             else:
-                # Take the maximum score for the document and count chunks
-                document_scores[doc_id] = max(document_scores[doc_id], score)
-                document_chunk_counts[doc_id] += 1
-
-        # Get documents and create search results
-        search_results = []
-        for doc_id, score in sorted(
-            document_scores.items(), key=lambda x: x[1], reverse=True
-        )[:limit]:
-            doc = await self.docs.find(doc_id)
-            if doc:
-                # Apply metadata filters to documents as well
-                if not metadata_filters or MetadataFilterProcessor.apply_filters(
-                    [doc], metadata_filters
-                ):
-                    search_results.append(
-                        SearchResult(
-                            document=doc,
-                            score=score,
-                            matching_chunks=document_chunk_counts[doc_id],
+                field = "document.id"
+                ids = [result.document.id for result in results or []]
+            filters.append(
+                MetadataFilter(field=field, operator="in", value=list(map(str, ids)))
+            )
+
+        distinct_by = "document.id" if granularity == "document" else None
+        counts = {field: Counter() for field in search.facets}
+        for library_id in search.libraries:
+            index = await self._load_index(library_id, index_type)
+            if index is None:
+                continue
+            mask = index.filter_mask(filters) if filters else None
+            for field in search.facets:
+                counts[field].update(index.facet_counts(field, mask, distinct_by))
+
+        return {
+            field: [
+                FacetValue(value=key[1], count=count)
+                for key, count in sorted(
+                    values.items(), key=lambda item: (-item[1], str(item[0][1]))
+                )[: search.facet_limit]
+            ]
+            for field, values in counts.items()
+        }
+
+    async def _next_page(
+        self, cursor: str, library_id: UUID, limit: int, fields: list[str] | None
+    ) -> tuple[list[SearchResult] | list[ChunkSearchResult], SearchPlan]:
+        """Return the page after a cursor without embedding the query again.
+
+        The live scan is continued if this process still holds it; otherwise
+        the search is restarted from the cursor's query vector and filters and
+        results ranked at or before the cursor's last result are skipped.
+        Cursors are only issued for scans returning chunks in global score
+        order, and a restarted IVF scan probes every list before ranking, so
+        both return the same page. Cursors issued before the library's chunks
+        or documents changed are rejected.
+        """
+        try:
+            position = SearchCursor.decode(cursor)
+        except ValueError as e:
+            raise ValidationError(f"Invalid search cursor: {str(e)}") from e
+        if position.library_id != library_id:
+            raise ValidationError("Search cursor belongs to another library")
+        if await self.chunks.library_generation(library_id) != position.generation:
+            raise ValidationError(
+                "Search cursor is stale: the library changed since it was issued"
+            )
+
+        page = _search_pages.pop(position.token, None)
+        if page is None:
+            scan, plan = await self._plan_scan(
+                library_id,
+                position.query_vector(),
+                position.index_type,
+                limit,
+                position.metadata_filters,
+                position.min_score,
+                ordered=True,
+            )
+            page = _SearchPage(scan, plan, position)
+        plan = page.plan.model_copy(
+            update={"fetch_k": limit, "expansions": 0, "fallback": False}
+        )
+        return await self._page_results(page, plan, limit, fields), plan
+
+    @staticmethod
+    def _pages(plan: SearchPlan, generation: str | None) -> bool:
+        """Whether a first page is ranked for paging and gets a cursor."""
+        # IVF batches are only the best of the lists probed so far, so no
+        # result splits the returned chunks from the rest
+        return generation is not None and plan._scan is not None and plan._scan.ordered
+
+    @staticmethod
+    def _start_page(
+        plan: SearchPlan,
+        search: SearchText,
+        generation: str,
+        scored: list[tuple[Chunk, float]],
+    ) -> _SearchPage:
+        """Wrap the vector scan and scored chunks of a first page for paging."""
+        cursor = SearchCursor.for_query(
+            plan._query_vector,
+            library_id=search.library_id,
+            index_type=plan.index_type,
+            granularity=search.granularity,
+            metadata_filters=search.metadata_filters,
+            min_score=search.min_score,
+            generation=generation,
+        )
+        page = _SearchPage(plan._scan, plan, cursor)
+        page.pending = scored
+        page.floor = min((score for _, score in scored), default=math.inf)
+        return page
+
+    async def _page_results(
+        self,
+        page: _SearchPage,
+        plan: SearchPlan,
+        limit: int,
+        fields: list[str] | None,
+    ) -> list[SearchResult] | list[ChunkSearchResult]:
+        """Return the next page of a paged search and set its cursor."""
+        scored = self._take_page(page, plan, limit)
+        ranked = page.rank(scored)[:limit]
+        page.seen.update(key for key, _ in ranked)
+        page.pending = [pair for pair in scored if page.key(pair[0]) not in page.seen]
+        plan.next_cursor = self._keep_page(page, ranked, limit)
+
+        if not page.by_document:
+            chunks = {chunk.id: (chunk, score) for chunk, score in scored}
+            return self._chunk_results([chunks[key] for key, _ in ranked], fields)
+        counts = Counter(chunk.document_id for chunk, _ in scored)
+        return await self._document_results(
+            [key for key, _ in ranked],
+            [score for _, score in ranked],
+            [counts[key] for key, _ in ranked],
+            fields,
+        )
+
+    def _take_page(
+        self, page: _SearchPage, plan: SearchPlan, limit: int
+    ) -> list[tuple[Chunk, float]]:
+        """Take the scored chunks a page is chosen from.
+
+        Chunks left pending by the previous page come first. The scan is then
+        read in doubling batches until ``limit`` new results were found and
+        every chunk tied with the last of them was read, the scan is exhausted
+        or ``search_candidate_budget`` chunks were taken.
+        """
+        scored = page.admit(page.pending)
+        page.pending = []
+        batch = limit * 3 if page.by_document else limit
+        while (
+            not page.scan.exhausted and len(scored) < settings.search_candidate_budget
+        ):
+            ranked = page.rank(scored)
+            # Unread chunks score at most the floor, so none ranks before the
+            # last result once the floor is below its score
+            if len(ranked) >= limit and page.floor < ranked[limit - 1][1]:
+                break
+            more = self._next_chunks(page.scan, batch, page.cursor.library_id)
+            if not more:
+                break
+            page.floor = min(page.floor, min(score for _, score in more))
+            scored.extend(page.admit(more))
+            batch *= 2
+            plan.expansions += 1
+
+        # A restarted scan may find a document ranked before the cursor only
+        # after some of its lower chunks
+        return [pair for pair in scored if page.key(pair[0]) not in page.seen]
+
+    @staticmethod
+    def _keep_page(
+        page: _SearchPage, ranked: list[tuple[UUID, float]], limit: int
+    ) -> str | None:
+        """Keep a page's scan for the next page and return the cursor to it.
+
+        ``ranked`` are the page's result ids and scores, best first. Returns
+        None if the page was the last one.
+        """
+        if len(ranked) < limit or (page.scan.exhausted and not page.pending):
+            return None
+
+        last_id, score = ranked[-1]
+        page.cursor = page.cursor.model_copy(
+            update={"token": new_token(), "score": float(score), "last_id": last_id}
+        )
+        _search_pages[page.cursor.token] = page
+        if len(_search_pages) > settings.search_page_cache_size:
+            _search_pages.popitem(last=False)
+        return page.cursor.encode()
+
+    async def search_by_vector(
+        self, search: VectorSearchText
+    ) -> tuple[list[SearchResult] | list[ChunkSearchResult], SearchPlan]:
+        """Search by a query vector and/or example chunks without embedding text.
+
+        A lone ``vector`` is searched as is. Otherwise the query combines it
+        with the stored embeddings of the ``positive`` example chunks and moves
+        away from the ``negative`` ones, and the example chunks are excluded
+        from the results. Vectors must have the dimension of the library's
+        embeddings; queries of binary libraries are quantized to sign bits.
+        """
+        library_id, vector = search.library_id, search.vector
+        text_search = SearchText(content="", library_id=library_id, **search.options())
+        if search.cursor is not None:
+            return await self.search_with_plan(text_search)
+
+        positive, negative = search.positive, search.negative
+
+        examples = {
+            chunk.id: self._float_embedding(chunk)
+            for chunk in await self.chunks.find_many(positive + negative)
+        }
+        for chunk_id in positive + negative:
+            if chunk_id not in examples:
+                raise ChunkNotFoundException(chunk_id)
+
+        # Any stored chunk tells the library's embedding dimension and type
+        stored = await self.chunks.find_ids_by_library(library_id, limit=1)
+        reference = await self.chunks.find(stored[0]) if stored else None
+        positives = [examples[chunk_id] for chunk_id in positive]
+        if vector is not None:
+            positives.insert(0, np.asarray(vector, dtype=np.float64))
+        negatives = [examples[chunk_id] for chunk_id in negative]
+        if reference is not None:
+            dimension = len(self._float_embedding(reference))
+            if any(len(row) != dimension for row in positives + negatives):
+                raise ValidationError(
+                    f"Query vectors must have the library's embedding dimension "
+                    f"{dimension}"
+                )
+
+        if positive or negative:
+            try:
+                query = example_query(
+                    np.array(positives),
+                    np.array(negatives) if negatives else None,
+                    search.negative_weight,
+                )
+            except ValueError as e:
+                raise ValidationError(str(e)) from e
+            text_search.metadata_filters = [
+                *search.metadata_filters,
+                FilterGroup(
+                    operator="not",
+                    filters=[
+                        MetadataFilter(
+                            field="id",
+                            operator="in",
+                            value=[str(chunk_id) for chunk_id in positive + negative],
                         )
-                    )
+                    ],
+                ),
+            ]
+        else:
+            query = positives[0]
+        if reference is not None and embedding_type_of(reference) == "ubinary":
+            query = np.packbits(query > 0)
 
-        return search_results
+        return await self.search_with_plan(text_search, query_vector=query)
+
+    async def search_similar_to(
+        self, chunk_id: UUID, search: ExampleSearchText
+    ) -> tuple[list[SearchResult] | list[ChunkSearchResult], SearchPlan]:
+        """Search for chunks like a stored chunk, by its embedding.
+
+        The chunk is the first positive example of ``search_by_vector``; the
+        chunk's own library is searched unless the search names a library.
+        """
+        chunk = await self.chunks.find(chunk_id)
+        if chunk is None:
+            raise ChunkNotFoundException(chunk_id)
+        library_id = search.library_id
+        if library_id is None:
+            document = await self.docs.find(chunk.document_id)
+            library_id = document.library_id
+
+        return await self.search_by_vector(
+            VectorSearchText(
+                library_id=library_id,
+                positive=[chunk_id, *search.positive],
+                negative=search.negative,
+                negative_weight=search.negative_weight,
+                **search.options(),
+            )
+        )
+
+    async def range_search(
+        self, search: RangeSearchText
+    ) -> Iterator[list[ChunkSearchResult]]:
+        """Find every chunk with similarity >= radius to the query.
+
+        The query is embedded and the library index loaded before returning, so
+        failures surface here; the returned iterator only runs the index scan
+        and yields batches of chunk results in descending score order.
+        """
+        metadata_filters = search.metadata_filters
+        filter_errors = MetadataFilterProcessor.validate_filters(metadata_filters)
+        if filter_errors:
+            raise ValidationError(
+                f"Invalid metadata filters: {'; '.join(filter_errors)}"
+            )
+
+        embedding = await self._embed_for_library(search.content, search.library_id)
+        index = await self._load_index(search.library_id, search.index_type)
+        if index is None:
+            return iter(())
+
+        mask = index.filter_mask(metadata_filters) if metadata_filters else None
+        return (
+            self._chunk_results(batch, search.fields)
+            for batch in index.range_chunks(embedding, search.radius, mask)
+        )
+
+    @staticmethod
+    def _float_embedding(chunk: Chunk) -> np.ndarray:
+        """Decode a chunk's stored embedding to real values."""
+        return to_float_vectors(
+            decode_embedding(chunk.embedding, embedding_type_of(chunk))
+        )
+
+    @staticmethod
+    def _diversify(
+        similar_chunks: list[tuple[Chunk, float]], diversity: float
+    ) -> Iterator[tuple[Chunk, float]]:
+        """Yield scored chunks in maximal marginal relevance order."""
+        if not similar_chunks:
+            return
+        vectors = chunks_to_vectors([chunk for chunk, _ in similar_chunks])
+        relevance = np.array([score for _, score in similar_chunks])
+        for position in mmr(relevance, vectors, diversity):
+            yield similar_chunks[position]
+
+    @staticmethod
+    def _chunk_results(
+        selected: Iterable[tuple[Chunk, float]], fields: list[str] | None
+    ) -> list[ChunkSearchResult]:
+        """Build chunk results holding only the requested parts, in order."""
+        parts = set(fields or RESULT_PARTS)
+        results = []
+        for chunk, score in selected:
+            values = {
+                "chunk_id": chunk.id,
+                "document_id": chunk.document_id,
+                "score": score,
+            }
+            if "content" in parts:
+                values["content"] = chunk.content
+            if "metadata" in parts:
+                values["metadata"] = chunk.metadata
+            if "offsets" in parts:
+                # Offsets are recorded by the chunker on each chunk it produced
+                metadata = chunk.metadata or {}
+                values.update(
+                    (key, metadata[key])
+                    for key in ("start_position", "end_position", "chunk_number")
+                    if key in metadata
+                )
+            results.append(ChunkSearchResult(**values))
+        return results
 
     async def invalidate_index(self, library_id: UUID, index_type: str = None):
         """Invalidate cached indexes for a library."""
@@ -130,34 +761,521 @@ class SearchService:
             logger.error(f"Failed to delete indexes for library {library_id}: {str(e)}")
             raise IndexError(f"Failed to delete indexes: {str(e)}") from e
 
-    def _search_chunks(
-        self, chunks, embedding, index_type: str, limit: int, library_id: UUID
-    ):
-        """Search chunks using the specified index type with persistent indexes."""
+    async def _retrieve(
+        self,
+        search: SearchText,
+        limit: int,
+        min_documents: int | None = None,
+        query_vector: np.ndarray | None = None,
+    ) -> tuple[list[tuple[Chunk, float]], SearchPlan]:
+        """Run the retrievers of the search mode and merge their rankings.
+
+        Returns ``(chunk, score)`` pairs, best first: vector similarities, BM25
+        scores, or fused scores depending on the mode. Single-retriever modes
+        fetch past ``limit`` chunks until they span ``min_documents`` documents;
+        hybrid mode fuses two rankings of ``limit`` chunks each. The vector
+        retriever embeds the search content unless a ``query_vector`` is given.
+        """
+        search_text, library_id = search.content, search.library_id
+        index_type, metadata_filters = search.index_type, search.metadata_filters
+        min_score, mode = search.min_score, search.mode
+        vector = keyword = None
+        if mode == "keyword":
+            keyword = await self._keyword_search(
+                library_id, search_text, limit, metadata_filters, min_documents
+            )
+        elif mode == "hybrid":
+            vector, keyword = await asyncio.gather(
+                self._vector_search(
+                    search_text,
+                    library_id,
+                    index_type,
+                    limit,
+                    metadata_filters,
+                    min_score,
+                    query_vector=query_vector,
+                ),
+                self._keyword_search(library_id, search_text, limit, metadata_filters),
+                return_exceptions=True,
+            )
+        else:
+            try:
+                vector = await self._vector_search(
+                    search_text,
+                    library_id,
+                    index_type,
+                    limit,
+                    metadata_filters,
+                    min_score,
+                    min_documents,
+                    query_vector,
+                )
+            except EmbeddingError as e:
+                vector = e
+
+        for outcome in (vector, keyword):
+            if isinstance(outcome, Exception) and not isinstance(
+                outcome, EmbeddingError
+            ):
+                raise outcome
+
+        degraded = None
+        if isinstance(vector, EmbeddingError):
+            logger.warning(
+                f"Degrading search in library {library_id} to keyword "
+                f"retrieval: {str(vector)}"
+            )
+            degraded = self._degraded_reason(vector)
+            vector = None
+            if keyword is None:
+                keyword = await self._keyword_search(
+                    library_id, search_text, limit, metadata_filters, min_documents
+                )
+
+        if vector is None:
+            similar_chunks, keyword_matches = keyword
+            plan = SearchPlan(strategy="keyword", index_type=index_type, fetch_k=limit)
+        elif keyword is None:
+            similar_chunks, plan = vector
+        else:
+            (vector_scored, plan), (keyword_scored, keyword_matches) = vector, keyword
+            similar_chunks = self._fuse(
+                vector_scored, keyword_scored, search.fusion, search.keyword_weight
+            )[:limit]
+
+        plan.mode = mode
+        plan.degraded = degraded
+        if keyword is not None:
+            plan.keyword_matches = keyword_matches
+        return similar_chunks, plan
+
+    async def _embed_query(self, search_text: str):
+        """Embed a query within the latency budget, reusing cached query vectors.
+
+        Raises EmbeddingTimeoutError when the provider does not answer within
+        ``embedding_timeout`` seconds and EmbeddingError when it fails.
+        """
+        key = (
+            search_text,
+            self.embedder.model,
+            self.embedder.output_dimension,
+            self.embedder.embedding_type,
+        )
+        embedding = _query_vectors.get(key)
+        if embedding is not None:
+            _query_vectors.move_to_end(key)
+            return embedding
+
         try:
-            # Check if we need to load/update the index for this library
-            index_key = f"{library_id}_{index_type}"
+            # The embedding call blocks on the provider, so keep it off the loop
+            embeddings = await asyncio.wait_for(
+                asyncio.to_thread(self.embedder.embed, [search_text]),
+                timeout=settings.embedding_timeout,
+            )
+        except TimeoutError as e:
+            raise EmbeddingTimeoutError(
+                f"Query embedding exceeded {settings.embedding_timeout}s"
+            ) from e
+        except Exception as e:
+            raise EmbeddingError(f"Query embedding failed: {str(e)}") from e
+
+        embedding = _query_vectors[key] = embeddings[0]
+        if len(_query_vectors) > settings.query_vector_cache_size:
+            _query_vectors.popitem(last=False)
+        return embedding
+
+    async def _embed_for_library(self, search_text: str, library_id: UUID):
+        """Embed a query with the options the library's chunks were embedded with."""
+        # Embed the query with the library's embedding options so it matches the
+        # stored (possibly quantized) chunk vectors
+        library = await self.libraries.find(library_id)
+        self.embedder.configure(
+            **Embedder.options_from_metadata(library.metadata if library else None)
+        )
+        return await self._embed_query(search_text)
+
+    async def _embed_for_libraries(
+        self, search_text: str, library_ids: list[UUID]
+    ) -> tuple[dict[UUID, np.ndarray], dict[UUID, str]]:
+        """Embed a query once per distinct embedding options of the libraries.
+
+        Returns the query vector of each library, and the degradation reason
+        of the libraries whose query could not be embedded.
+        """
+        libraries = await asyncio.gather(
+            *(self.libraries.find(library_id) for library_id in library_ids)
+        )
+        groups: dict[tuple, list[UUID]] = {}
+        for library_id, library in zip(library_ids, libraries, strict=True):
+            options = Embedder.options_from_metadata(
+                library.metadata if library else None
+            )
+            groups.setdefault(tuple(options.items()), []).append(library_id)
+
+        vectors, degraded = {}, {}
+        for options, members in groups.items():
+            self.embedder.configure(**dict(options))
+            try:
+                embedding = await self._embed_query(search_text)
+            except EmbeddingError as e:
+                logger.warning(
+                    f"Degrading search in {len(members)} libraries to keyword "
+                    f"retrieval: {str(e)}"
+                )
+                degraded.update(dict.fromkeys(members, self._degraded_reason(e)))
+            else:
+                vectors.update(dict.fromkeys(members, embedding))
+        return vectors, degraded
+
+    @staticmethod
+    def _degraded_reason(error: EmbeddingError) -> str:
+        """Name why a query could not be embedded, as reported in the plan."""
+        if isinstance(error, EmbeddingTimeoutError):
+            return "embedding_timeout"
+        return "embedding_error"
+
+    async def _vector_search(
+        self,
+        search_text: str,
+        library_id: UUID,
+        index_type: str,
+        limit: int,
+        metadata_filters: list[FilterExpression],
+        min_score: float | None = None,
+        min_documents: int | None = None,
+        query_vector: np.ndarray | None = None,
+    ) -> tuple[list[tuple[Chunk, float]], SearchPlan]:
+        """Embed the query if no vector is given and run the planned vector search.
+
+        With ``min_documents``, the scan is deepened past ``limit`` chunks until
+        they span that many documents.
+        """
+        embedding = query_vector
+        if embedding is None:
+            embedding = await self._embed_for_library(search_text, library_id)
+        if min_documents is None:
+            return await self._plan_and_search(
+                library_id, embedding, index_type, limit, metadata_filters, min_score
+            )
+
+        scan, plan = await self._plan_scan(
+            library_id, embedding, index_type, limit, metadata_filters, min_score
+        )
+        plan._scan, plan._query_vector = scan, embedding
+        return self._expand(scan, plan, limit, min_documents, library_id), plan
+
+    async def _keyword_search(
+        self,
+        library_id: UUID,
+        search_text: str,
+        limit: int,
+        metadata_filters: list[FilterExpression],
+        min_documents: int | None = None,
+    ) -> tuple[list[tuple[Chunk, float]], int]:
+        """Rank chunks by BM25 and return the best ones passing the filters.
+
+        Ranked chunks are loaded and verified in batches until enough pass and,
+        with ``min_documents``, until they span that many documents or
+        ``search_candidate_budget`` chunks were taken. Also returns the number
+        of chunks containing any query term.
+        """
+        index = await self.keyword_indexes.get(library_id)
+        ranked = index.search(search_text)
+        batch_size = limit if not metadata_filters else max(limit * 2, 32)
+
+        results = []
+        document_ids = set()
+        for start in range(0, len(ranked), batch_size):
+            batch = dict(ranked[start : start + batch_size])
+            chunks = await self.chunks.find_many(list(batch))
+            if metadata_filters:
+                documents = await self.docs.find_many(
+                    list({chunk.document_id for chunk in chunks})
+                )
+                chunks = MetadataFilterProcessor.apply_filters(
+                    chunks,
+                    metadata_filters,
+                    documents={document.id: document for document in documents},
+                )
+            results.extend((chunk, batch[chunk.id]) for chunk in chunks)
+            document_ids.update(chunk.document_id for chunk in chunks)
+            if len(results) >= limit and (
+                min_documents is None
+                or len(document_ids) >= min_documents
+                or len(results) >= settings.search_candidate_budget
+            ):
+                break
+        if min_documents is None:
+            return results[:limit], len(ranked)
+        return results[: max(limit, settings.search_candidate_budget)], len(ranked)
+
+    @staticmethod
+    def _fuse(
+        vector_results: list[tuple[Chunk, float]],
+        keyword_results: list[tuple[Chunk, float]],
+        fusion: str,
+        keyword_weight: float,
+    ) -> list[tuple[Chunk, float]]:
+        """Merge the vector and keyword rankings into one scored chunk ranking."""
+        chunks = {chunk.id: chunk for chunk, _ in keyword_results}
+        chunks.update((chunk.id, chunk) for chunk, _ in vector_results)
+        vector_scored = [(chunk.id, score) for chunk, score in vector_results]
+        keyword_scored = [(chunk.id, score) for chunk, score in keyword_results]
 
-            match index_type:
-                case "ivf":
-                    if index_key not in self._loaded_indexes:
-                        self.ivf_index.load_or_create_index(library_id, chunks)
-                        self._loaded_indexes[index_key] = True
-                    return self.ivf_index.search_chunks(embedding, k=limit)
-                case "flat":
-                    if index_key not in self._loaded_indexes:
-                        self.flat_index.load_or_create_index(library_id, chunks)
-                        self._loaded_indexes[index_key] = True
-                    return self.flat_index.search_chunks(embedding, k=limit)
-                case _:
-                    raise ValueError(f"Unsupported index type: {index_type}")
+        if fusion == "weighted":
+            fused = weighted_fusion(
+                [vector_scored, keyword_scored], [1 - keyword_weight, keyword_weight]
+            )
+        else:
+            fused = reciprocal_rank_fusion(
+                [
+                    [chunk_id for chunk_id, _ in vector_scored],
+                    [chunk_id for chunk_id, _ in keyword_scored],
+                ]
+            )
+        return [(chunks[chunk_id], score) for chunk_id, score in fused]
+
+    def _get_index(self, chunks, index_type: str, library_id: UUID, documents=None):
+        """Return the persistent index for a library, loading it if needed.
+
+        The library's documents are denormalized into the index's attribute
+        store so document-level filters resolve in the row mask.
+        """
+        # Check if we need to load/update the index for this library
+        index_key = f"{library_id}_{index_type}"
+        index = self._loaded_indexes.get(index_key)
+        if index is not None:
+            return index
+
+        match index_type:
+            case "ivf":
+                index = self.ivf_index
+            case "flat":
+                index = self.flat_index
+            case _:
+                raise ValueError(f"Unsupported index type: {index_type}")
+
+        # The configured index serves the first library; every other library
+        # gets its own copy, so libraries searched together share no state
+        if any(loaded is index for loaded in self._loaded_indexes.values()):
+            index = index.empty_like()
+        index.load_or_create_index(library_id, chunks, documents)
+        self._loaded_indexes[index_key] = index
+        return index
+
+    async def _load_index(self, library_id: UUID, index_type: str):
+        """Return the library's loaded persistent index, or None if it is empty.
+
+        Chunks and document attributes are only read when the index is not
+        loaded yet; a loaded index already holds its attribute columns.
+        """
+        index = self._loaded_indexes.get(f"{library_id}_{index_type}")
+        if index is not None:
+            return index
+        chunks = await self.chunks.find_by_library(library_id)
+        if not chunks:
+            return None
+        documents = await self.docs.find_attributes_by_library(library_id)
+        return self._get_index(chunks, index_type, library_id, documents)
+
+    async def _plan_and_search(
+        self,
+        library_id: UUID,
+        embedding,
+        index_type: str,
+        limit: int,
+        metadata_filters: list[FilterExpression],
+        min_score: float | None = None,
+    ) -> tuple[list[tuple[Chunk, float]], SearchPlan]:
+        """Run the planned vector search for its first ``limit`` chunks.
+
+        Returns ``(chunk, similarity)`` pairs, best first, none below ``min_score``.
+        """
+        scan, plan = await self._plan_scan(
+            library_id, embedding, index_type, limit, metadata_filters, min_score
+        )
+        plan._scan, plan._query_vector = scan, embedding
+        return self._next_chunks(scan, limit, library_id), plan
+
+    async def _plan_scan(
+        self,
+        library_id: UUID,
+        embedding,
+        index_type: str,
+        limit: int,
+        metadata_filters: list[FilterExpression],
+        min_score: float | None = None,
+        ordered: bool = False,
+    ) -> tuple[ChunkScan | FilteredChunkScan, SearchPlan]:
+        """Choose how to execute a filtered vector search and start its scan.
+
+        * ``brute_force``: the filters select at most ``sql_prefilter_limit``
+          chunks in SQL, so only those are loaded and scored exactly.
+        * ``post_filter``: most rows pass the filters, so the IVF index is
+          searched unmasked for ``limit / selectivity`` chunks, which are then
+          filtered. Falls back to a masked scan if too few survive.
+        * ``in_scan_mask``: the filters are resolved to a row bitmap that
+          restricts the index scan.
+
+        Every strategy matches chunks together with their document's attributes,
+        so document-level filters apply before ranking. The returned scan hands
+        out chunks best first and resumes where the previous batch stopped;
+        ``ordered`` makes IVF scans probe every list up front, so their chunks
+        come out in global score order.
+        """
+        plan = SearchPlan(strategy="unfiltered", index_type=index_type, fetch_k=limit)
+
+        if metadata_filters:
+            candidate_ids = await self.chunks.find_ids_by_library(
+                library_id, metadata_filters, limit=settings.sql_prefilter_limit + 1
+            )
+            if len(candidate_ids) <= settings.sql_prefilter_limit:
+                plan.strategy = "brute_force"
+                plan.sql_candidates = len(candidate_ids)
+                scan = await self._scan_candidates(
+                    candidate_ids, embedding, metadata_filters, min_score
+                )
+                return scan, plan
+
+        # The index always covers the whole library
+        index = await self._load_index(library_id, index_type)
+        if index is None:
+            return ChunkScan(RankedScan(np.empty(0, np.int64), np.empty(0)), []), plan
+
+        plan.total_rows = index.num_rows
+        if not metadata_filters:
+            scan = self._scan_chunks(
+                index, embedding, library_id, min_score=min_score, ordered=ordered
+            )
+            return scan, plan
+
+        selectivity = index.estimate_selectivity(metadata_filters)
+        plan.estimated_selectivity = selectivity
+        plan.estimated_matches = round(selectivity * index.num_rows)
+        if index_type == "ivf" and selectivity >= POST_FILTER_MIN_SELECTIVITY:
+            plan.strategy = "post_filter"
+            plan.fetch_k = min(
+                index.num_rows, math.ceil(limit / selectivity * OVERFETCH_FACTOR)
+            )
+            scan = FilteredChunkScan(
+                self._scan_chunks(
+                    index, embedding, library_id, min_score=min_score, ordered=ordered
+                ),
+                lambda batch: MetadataFilterProcessor.apply_filters(
+                    batch, metadata_filters, documents=index.documents
+                ),
+                plan.fetch_k,
+            )
+            if scan.fetch() >= limit or scan.exhausted:
+                return scan, plan
+            plan.fallback = True
+
+        plan.strategy = "in_scan_mask"
+        plan.fetch_k = limit
+        scan = self._scan_chunks(
+            index, embedding, library_id, metadata_filters, min_score, ordered
+        )
+        return scan, plan
+
+    def _expand(
+        self,
+        scan: ChunkScan | FilteredChunkScan,
+        plan: SearchPlan,
+        limit: int,
+        min_documents: int,
+        library_id: UUID,
+    ) -> list[tuple[Chunk, float]]:
+        """Take chunks from a scan until they span ``min_documents`` documents.
+
+        Starts with ``limit`` chunks and doubles the batch while too few
+        distinct documents were found, the scan has more chunks and fewer than
+        ``search_candidate_budget`` were taken.
+        """
+        scored = self._next_chunks(scan, limit, library_id)
+        document_ids = {chunk.document_id for chunk, _ in scored}
+        batch = limit
+        while (
+            len(document_ids) < min_documents
+            and len(scored) < settings.search_candidate_budget
+            and not scan.exhausted
+        ):
+            batch = min(batch * 2, settings.search_candidate_budget - len(scored))
+            more = self._next_chunks(scan, batch, library_id)
+            scored.extend(more)
+            document_ids.update(chunk.document_id for chunk, _ in more)
+            plan.expansions += 1
+        return scored
+
+    async def _scan_candidates(
+        self,
+        candidate_ids: list[UUID],
+        embedding,
+        metadata_filters: list[FilterExpression],
+        min_score: float | None = None,
+    ) -> ChunkScan:
+        """Brute-force scan over chunks preselected in SQL."""
+        # The SQL clause selects a superset; verify with the exact filters
+        chunks = await self.chunks.find_many(candidate_ids)
+        documents = await self.docs.find_many(
+            list({chunk.document_id for chunk in chunks})
+        )
+        candidates = MetadataFilterProcessor.apply_filters(
+            chunks,
+            metadata_filters,
+            documents={document.id: document for document in documents},
+        )
+        vectors = (
+            self.flat_index_kernel.fit(chunks_to_vectors(candidates))
+            if candidates
+            else None
+        )
+        return ChunkScan(
+            self.flat_index_kernel.scan(embedding, vectors, min_score=min_score),
+            candidates,
+        )
+
+    def _scan_chunks(
+        self,
+        index,
+        embedding,
+        library_id: UUID,
+        metadata_filters: list[FilterExpression] | None = None,
+        min_score: float | None = None,
+        ordered: bool = False,
+    ) -> ChunkScan:
+        """Scan a loaded persistent index, masking rows by the metadata filters.
+
+        ``ordered`` scores every row up front, see ``_plan_scan``.
+        """
+        try:
+            mask = None
+            if metadata_filters:
+                # Resolve filters against the index's attribute store as a row
+                # bitmap aligned with the index
+                mask = index.filter_mask(metadata_filters)
+
+            scan = index.scan_chunks(embedding, mask=mask, min_score=min_score)
+            if ordered:
+                scan.probe_all()
+            return scan
         except Exception as e:
             logger.error(
-                f"Search failed for library {library_id} with {index_type} index: "
-                f"{str(e)}"
+                f"Search failed for library {library_id} with "
+                f"{type(index).__name__}: {str(e)}"
             )
             raise IndexError(f"Search operation failed: {str(e)}") from e
 
+    @staticmethod
+    def _next_chunks(
+        scan: ChunkScan | FilteredChunkScan, k: int, library_id: UUID
+    ) -> list[tuple[Chunk, float]]:
+        """Take the next k chunks from a scan, reporting kernel failures."""
+        try:
+            return scan.next(k)
+        except Exception as e:
+            logger.error(f"Search failed for library {library_id}: {str(e)}")
+            raise IndexError(f"Search operation failed: {str(e)}") from e
+
 
 def get_search_service(db: DB = Depends(get_db)) -> SearchService:
     """Dependency to get SearchService instance."""
@@ -16,5 +16,22 @@ class Settings(BaseSettings):
     cohere_api_key: str | None = None
     db_path: str = "data/demo.sqlite"
 
+    # Chunk metadata keys materialized as indexed generated columns
+    hot_metadata_fields: list[str] = []
+    # Filtered searches matching at most this many chunks in SQL skip the index
+    sql_prefilter_limit: int = 1000
+    # Most chunks a search takes while deepening to find enough documents
+    search_candidate_budget: int = 1000
+    # Flat indexes of at least this many chunks are memory-mapped and scanned in
+    # tiles instead of being loaded into memory
+    flat_index_memmap_rows: int = 100_000
+    # Live scans of paged searches kept to serve next pages without rescanning
+    search_page_cache_size: int = 64
+
+    # Seconds a search waits for the query embedding before degrading to keyword
+    embedding_timeout: float = 2.0
+    # Query vectors kept to answer repeated queries without the provider
+    query_vector_cache_size: int = 1024
+
 
 settings = Settings()
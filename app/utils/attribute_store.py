@@ -0,0 +1,578 @@
+"""Per-library attribute indexes for evaluating metadata filters as row bitmaps."""
+
+from collections import defaultdict
+from collections.abc import Hashable
+from datetime import UTC, datetime, timedelta
+from typing import Any
+
+import numpy as np
+
+from app.models.models import FilterExpression, FilterGroup, MetadataFilter
+from app.utils.filter_plan import compile_filter, compile_filters
+from app.utils.metadata_filter import MetadataFilterProcessor
+
+# Comparison kinds of an attribute value under MetadataFilterProcessor range
+# semantics. Numbers and numeric strings share the float column, ISO date strings
+# live in the date column, and anything else is only reachable by scanning.
+NUMBER = "number"
+NUMERIC_STRING = "numeric_str"
+DATE = "date"
+OTHER = "other"
+
+# Timezone state of a date column cell; naive and aware datetimes never compare
+NO_DATE, NAIVE_DATE, AWARE_DATE = 0, 1, 2
+
+_RANGE_OPERATORS = {
+    "gt": np.greater,
+    "gte": np.greater_equal,
+    "lt": np.less,
+    "lte": np.less_equal,
+}
+
+# Operators answered from the trigram index of a field's distinct values
+_SUBSTRING_OPERATORS = ("contains", "starts_with", "ends_with")
+TRIGRAM_LENGTH = 3
+
+_EPOCH = datetime(1970, 1, 1)
+_MICROSECOND = timedelta(microseconds=1)
+
+
+def _parse_number(value: str) -> float | None:
+    """Parse a string the way MetadataFilterProcessor converts numbers."""
+    try:
+        return float(value)
+    except ValueError:
+        return None
+
+
+def _parse_date(value: str) -> datetime | None:
+    """Parse a string the way MetadataFilterProcessor converts ISO dates."""
+    try:
+        return datetime.fromisoformat(value.replace("Z", "+00:00"))
+    except ValueError:
+        return None
+
+
+def _epoch_micros(value: datetime) -> tuple[int, int]:
+    """Encode a datetime as epoch microseconds and its timezone state.
+
+    Naive datetimes are encoded as if they were UTC, which preserves their
+    ordering among each other.
+    """
+    if value.tzinfo is None:
+        return (value - _EPOCH) // _MICROSECOND, NAIVE_DATE
+    return (value - _EPOCH.replace(tzinfo=UTC)) // _MICROSECOND, AWARE_DATE
+
+
+def classify_value(value: Any) -> tuple[str, float | None, datetime | None]:
+    """Return the comparison kind of a value with its parsed number or date."""
+    if isinstance(value, bool | int | float):
+        return NUMBER, float(value), None
+    if not isinstance(value, str):
+        return OTHER, None, None
+    date = _parse_date(value)
+    if date is not None:
+        return DATE, None, date
+    number = _parse_number(value)
+    if number is not None:
+        return NUMERIC_STRING, number, None
+    return OTHER, None, None
+
+
+def trigrams(text: str) -> set[str]:
+    """All overlapping three-character substrings of a string."""
+    return {
+        text[start : start + TRIGRAM_LENGTH]
+        for start in range(len(text) - TRIGRAM_LENGTH + 1)
+    }
+
+
+def _value_trigrams(key: tuple[str, Hashable]) -> set[str]:
+    """Trigrams of a value as the substring operators compare it."""
+    return trigrams(str(key[1]).lower())
+
+
+def _is_plain_string(value: Any) -> bool:
+    """Check if a string compares by plain equality in MetadataFilterProcessor.
+
+    Strings that parse as numbers or ISO dates are normalized before comparison,
+    so they cannot be answered with an exact-value lookup.
+    """
+    return isinstance(value, str) and classify_value(value)[0] == OTHER
+
+
+class AttributeStore:
+    """Inverted index from attribute field and value to sorted chunk rows.
+
+    Rows are aligned with the vector index that owns the store. Posting lists are
+    keyed by ``(type name, value)`` so values that Python considers equal across
+    types (``1``, ``1.0``, ``True``) stay distinct. Filters are resolved per
+    distinct value with MetadataFilterProcessor semantics, and the posting lists
+    of matching values are unioned into a bitmap, so the per-row Python scan is
+    replaced by one check per distinct value. Plain-string ``eq`` and ``in``
+    filters are answered with direct lookups.
+
+    Every field also keeps typed columns aligned with the rows: a float64 column
+    for numbers and numeric strings, and an epoch-microsecond int64 column for
+    ISO date strings such as the built-in ``created_at``/``updated_at``. Values
+    are parsed once when rows are added, so range filters become vectorized
+    numpy comparisons instead of re-parsing every value per query.
+
+    Substring filters (``contains``/``starts_with``/``ends_with``) look up the
+    trigrams of the searched text in a per-field trigram index over the distinct
+    lowercased values and only check the values containing all of them. A
+    field's trigram index is built the first time it is searched and kept up to
+    date as rows are added and removed; it is pickled with the store, so it
+    persists with the next save of the owning index.
+
+    Facet counts use a value code column per field, mapping every row to the
+    position of its distinct value, so counting the values of any row bitmap is
+    one ``bincount``. A field's code column is built the first time it is
+    faceted and dropped whenever rows change.
+    """
+
+    def __init__(self):
+        """Initialize an empty attribute store."""
+        self.num_rows = 0
+        self._postings: dict[str, dict[tuple[str, Hashable], np.ndarray]] = {}
+        self._unhashable: dict[str, dict[int, Any]] = {}
+        self._numbers: dict[str, np.ndarray] = {}
+        self._dates: dict[str, np.ndarray] = {}
+        self._date_states: dict[str, np.ndarray] = {}
+        self._keys_by_kind: dict[str, dict[str, set]] = {}
+        self._trigrams: dict[str, dict[str, set]] = {}
+        self._codes: dict[str, tuple[list, np.ndarray]] = {}
+
+    @property
+    def trigram_fields(self) -> frozenset[str]:
+        """Fields whose trigram index has been built."""
+        return frozenset(self._trigrams)
+
+    @classmethod
+    def from_items(
+        cls, items: list[Any], documents: dict[Any, Any] | None = None
+    ) -> "AttributeStore":
+        """Build a store whose rows follow the order of items."""
+        store = cls()
+        store.add_items(items, documents)
+        return store
+
+    def add_items(self, items: list[Any], documents: dict[Any, Any] | None = None):
+        """Append items as new rows at the end of the store.
+
+        If documents (keyed by id) are given, each row also carries the
+        attributes of its item's document.
+        """
+        self._codes.clear()
+        new_postings = defaultdict(lambda: defaultdict(list))
+        for row, item in enumerate(items, start=self.num_rows):
+            attributes = MetadataFilterProcessor.row_attributes(item, documents)
+            for field, value in attributes.items():
+                if value is None:
+                    continue
+                if isinstance(value, Hashable):
+                    new_postings[field][(type(value).__name__, value)].append(row)
+                else:
+                    self._unhashable.setdefault(field, {})[row] = value
+
+        for field, values in new_postings.items():
+            postings = self._postings.setdefault(field, {})
+            for key, rows in values.items():
+                new_rows = np.array(rows, dtype=np.int64)
+                existing = postings.get(key)
+                postings[key] = (
+                    new_rows
+                    if existing is None
+                    else np.concatenate([existing, new_rows])
+                )
+                if existing is None and field in self._trigrams:
+                    self._index_trigrams(self._trigrams[field], key)
+
+        self._append_columns(new_postings, len(items))
+        self.num_rows += len(items)
+
+    def _append_columns(self, new_postings: dict, num_items: int):
+        """Extend the typed columns with the parsed values of new rows."""
+        fields = set(self._numbers) | set(self._dates) | set(new_postings)
+        for field in fields:
+            numbers = np.full(num_items, np.nan)
+            dates = np.zeros(num_items, dtype=np.int64)
+            date_states = np.full(num_items, NO_DATE, dtype=np.int8)
+            keys_by_kind = self._keys_by_kind.setdefault(
+                field, {NUMERIC_STRING: set(), DATE: set(), OTHER: set()}
+            )
+            for key, rows in new_postings.get(field, {}).items():
+                kind, number, date = classify_value(key[1])
+                offsets = np.array(rows, dtype=np.int64) - self.num_rows
+                if number is not None:
+                    numbers[offsets] = number
+                if date is not None:
+                    dates[offsets], date_states[offsets] = _epoch_micros(date)
+                if kind != NUMBER:
+                    keys_by_kind[kind].add(key)
+
+            if field in self._numbers or not np.isnan(numbers).all():
+                self._numbers[field] = self._extend_column(
+                    self._numbers.get(field), numbers, np.nan
+                )
+            if field in self._dates or date_states.any():
+                self._dates[field] = self._extend_column(
+                    self._dates.get(field), dates, 0
+                )
+                self._date_states[field] = self._extend_column(
+                    self._date_states.get(field), date_states, NO_DATE
+                )
+
+    def _extend_column(
+        self, column: np.ndarray | None, values: np.ndarray, fill: Any
+    ) -> np.ndarray:
+        """Append values to a column, backfilling rows added before it existed."""
+        if column is None:
+            column = np.full(self.num_rows, fill, dtype=values.dtype)
+        return np.concatenate([column, values])
+
+    def remove_rows(self, rows: np.ndarray):
+        """Remove rows and shift the rows after them down to stay aligned."""
+        rows = np.unique(np.asarray(rows, dtype=np.int64))
+        if len(rows) == 0:
+            return
+
+        self._codes.clear()
+        for field, postings in self._postings.items():
+            for key, posting in list(postings.items()):
+                kept = posting[~np.isin(posting, rows)]
+                if len(kept) == 0:
+                    del postings[key]
+                    for keys in self._keys_by_kind.get(field, {}).values():
+                        keys.discard(key)
+                    if field in self._trigrams:
+                        self._unindex_trigrams(self._trigrams[field], key)
+                else:
+                    postings[key] = kept - np.searchsorted(rows, kept)
+
+        removed = set(rows.tolist())
+        for field, values in self._unhashable.items():
+            self._unhashable[field] = {
+                row - int(np.searchsorted(rows, row)): value
+                for row, value in values.items()
+                if row not in removed
+            }
+        for columns in (self._numbers, self._dates, self._date_states):
+            for field, column in columns.items():
+                columns[field] = np.delete(column, rows)
+        self.num_rows -= len(rows)
+
+    def build_mask(self, filters: list[FilterExpression]) -> np.ndarray:
+        """Evaluate filters (AND) into a boolean row bitmap.
+
+        Filters are evaluated in the selectivity order of their compiled plan and
+        evaluation stops as soon as no row is left.
+        """
+        mask = np.ones(self.num_rows, dtype=bool)
+        for expression in compile_filters(filters).filters:
+            mask &= self.expression_mask(expression)
+            if not mask.any():
+                break
+        return mask
+
+    def expression_mask(self, expression: FilterExpression) -> np.ndarray:
+        """Evaluate a filter or a nested group with bitwise bitmap operations."""
+        if not isinstance(expression, FilterGroup):
+            return self.filter_mask(expression)
+
+        match expression.operator:
+            case "and":
+                return self.build_mask(expression.filters)
+            case "not":
+                return ~self.build_mask(expression.filters)
+            case _:
+                mask = np.zeros(self.num_rows, dtype=bool)
+                for child in compile_filters(expression.filters).filters:
+                    mask |= self.expression_mask(child)
+                    if mask.all():
+                        break
+                return mask
+
+    def estimate_selectivity(
+        self, filters: list[FilterExpression], sample_size: int = 64
+    ) -> float:
+        """Estimate the fraction of rows the filters (AND) select.
+
+        Lookups and typed-column comparisons are counted exactly. Filters that
+        need a per-value check are estimated from a sample of distinct values,
+        and clauses are combined assuming independence.
+        """
+        if self.num_rows == 0:
+            return 0.0
+        return float(
+            np.prod([self._selectivity(f, sample_size) for f in filters], initial=1.0)
+        )
+
+    def _selectivity(self, expression: FilterExpression, sample_size: int) -> float:
+        """Estimate the selectivity of a filter or nested group."""
+        if isinstance(expression, FilterGroup):
+            parts = np.array(
+                [self._selectivity(f, sample_size) for f in expression.filters]
+            )
+            match expression.operator:
+                case "and":
+                    return float(np.prod(parts))
+                case "not":
+                    return 1.0 - float(np.prod(parts))
+                case _:
+                    return 1.0 - float(np.prod(1.0 - parts))
+
+        match expression.operator:
+            case "in" | "gt" | "gte" | "lt" | "lte":
+                return float(self.filter_mask(expression).mean())
+            case "eq" | "ne" if expression.value is None or _is_plain_string(
+                expression.value
+            ):
+                return float(self.filter_mask(expression).mean())
+            case _:
+                return self._sampled_selectivity(expression, sample_size)
+
+    def _sampled_selectivity(
+        self, filter_condition: MetadataFilter, sample_size: int
+    ) -> float:
+        """Estimate selectivity by checking an evenly spaced sample of values."""
+        postings = self._postings.get(filter_condition.field, {})
+        if len(postings) <= sample_size:
+            return float(self.filter_mask(filter_condition).mean())
+
+        keys = list(postings)
+        sampled = keys[:: len(keys) // sample_size][:sample_size]
+        matches_value = compile_filter(filter_condition)
+        sampled_rows = sum(len(postings[key]) for key in sampled)
+        matched_rows = sum(
+            len(postings[key]) for key in sampled if matches_value(key[1])
+        )
+
+        present_rows = sum(len(rows) for rows in postings.values())
+        estimate = matched_rows / sampled_rows * present_rows
+        estimate += len(self._scan_unhashable(filter_condition))
+        if filter_condition.operator == "ne" and filter_condition.value is not None:
+            # Rows without the field match ``ne``
+            unhashable_rows = len(self._unhashable.get(filter_condition.field, {}))
+            estimate += self.num_rows - present_rows - unhashable_rows
+        return min(1.0, estimate / self.num_rows)
+
+    def facet_counts(
+        self,
+        field: str,
+        mask: np.ndarray | None = None,
+        distinct_by: str | None = None,
+    ) -> dict[tuple[str, Hashable], int]:
+        """Count the rows of each distinct value of a field within a row bitmap.
+
+        Counts are keyed by ``(type name, value)`` like the posting lists, and
+        values without a selected row are left out. If ``distinct_by`` names
+        another field, the distinct values of that field are counted instead of
+        rows, e.g. documents via ``document.id``. Unhashable values are not
+        counted.
+        """
+        keys, codes = self._value_codes(field)
+        if mask is not None:
+            codes = codes[mask]
+        present = codes >= 0
+        codes = codes[present]
+
+        if distinct_by is not None:
+            group_keys, groups = self._value_codes(distinct_by)
+            groups = groups if mask is None else groups[mask]
+            groups = groups[present]
+            grouped = groups >= 0
+            # Each (value, group) pair counts once
+            pairs = np.unique(codes[grouped] * len(group_keys) + groups[grouped])
+            codes = pairs // len(group_keys)
+
+        counts = np.bincount(codes, minlength=len(keys))
+        return {keys[code]: int(counts[code]) for code in np.flatnonzero(counts)}
+
+    def _value_codes(self, field: str) -> tuple[list, np.ndarray]:
+        """Return the distinct values of a field and each row's value position.
+
+        Rows without a hashable value have position -1.
+        """
+        cached = self._codes.get(field)
+        if cached is None:
+            postings = self._postings.get(field, {})
+            keys = list(postings)
+            codes = np.full(self.num_rows, -1, dtype=np.int64)
+            for code, key in enumerate(keys):
+                codes[postings[key]] = code
+            cached = self._codes[field] = (keys, codes)
+        return cached
+
+    def filter_mask(self, filter_condition: MetadataFilter) -> np.ndarray:
+        """Evaluate a single filter into a boolean row bitmap."""
+        match filter_condition.operator:
+            case "eq":
+                return self._eq_mask(filter_condition)
+            case "ne":
+                if filter_condition.value is None:
+                    return self._has_value_mask(filter_condition.field)
+                # ``ne`` matches exactly the rows ``eq`` rejects, missing ones too
+                return ~self._eq_mask(
+                    filter_condition.model_copy(update={"operator": "eq"})
+                )
+            case "in":
+                return self._in_mask(filter_condition)
+            case "gt" | "gte" | "lt" | "lte":
+                return self._range_mask(filter_condition)
+            case "contains" | "starts_with" | "ends_with":
+                return self._substring_mask(filter_condition)
+            case _:
+                return self._scan_values(filter_condition)
+
+    def _eq_mask(self, filter_condition: MetadataFilter) -> np.ndarray:
+        """Resolve an equality filter, by lookup when the value is a plain string."""
+        if not _is_plain_string(filter_condition.value):
+            return self._scan_values(filter_condition)
+
+        postings = self._postings.get(filter_condition.field, {})
+        return self._rows_to_mask(
+            [postings.get(("str", filter_condition.value))],
+            self._scan_unhashable(filter_condition),
+        )
+
+    def _in_mask(self, filter_condition: MetadataFilter) -> np.ndarray:
+        """Resolve an ``in`` filter by looking up each listed value."""
+        if not isinstance(filter_condition.value, list | tuple | set):
+            return np.zeros(self.num_rows, dtype=bool)
+
+        postings = self._postings.get(filter_condition.field, {})
+        matches = []
+        for value in filter_condition.value:
+            if isinstance(value, bool | int | float):
+                # Python's ``in`` treats equal numbers of any type as members
+                matches.extend(
+                    postings.get((type_name, value))
+                    for type_name in ("bool", "int", "float")
+                )
+            elif isinstance(value, Hashable):
+                matches.append(postings.get((type(value).__name__, value)))
+        return self._rows_to_mask(matches, self._scan_unhashable(filter_condition))
+
+    def _range_mask(self, filter_condition: MetadataFilter) -> np.ndarray:
+        """Resolve a range filter with a vectorized comparison on a typed column.
+
+        Only the values whose comparison is decided by the column are covered;
+        values of the other kinds (e.g. date strings under a numeric bound, which
+        compare lexicographically) are still checked one distinct value at a time.
+        """
+        field = filter_condition.field
+        compare = _RANGE_OPERATORS[filter_condition.operator]
+        keys_by_kind = self._keys_by_kind.get(field, {})
+        kind, number, date = classify_value(filter_condition.value)
+
+        if kind in (NUMBER, NUMERIC_STRING):
+            mask = np.zeros(self.num_rows, dtype=bool)
+            numbers = self._numbers.get(field)
+            if numbers is not None:
+                mask |= compare(numbers, number)
+            uncovered = (DATE, OTHER)
+        elif kind == DATE and _parse_number(filter_condition.value) is None:
+            mask = np.zeros(self.num_rows, dtype=bool)
+            dates = self._dates.get(field)
+            if dates is not None:
+                bound, state = _epoch_micros(date)
+                mask |= (self._date_states[field] == state) & compare(dates, bound)
+            # Plain numbers never compare with a date string
+            uncovered = (NUMERIC_STRING, OTHER)
+        else:
+            return self._scan_values(filter_condition)
+
+        keys = set().union(*(keys_by_kind.get(kind, ()) for kind in uncovered))
+        mask |= self._scan_values(filter_condition, keys)
+        return mask
+
+    def _substring_mask(self, filter_condition: MetadataFilter) -> np.ndarray:
+        """Resolve a substring filter by trigram lookup and verify the candidates.
+
+        Only plain strings of at least three characters are looked up; other
+        needles (numbers or dates are normalized before comparison) are scanned.
+        """
+        needle = filter_condition.value
+        if not _is_plain_string(needle) or len(needle.lower()) < TRIGRAM_LENGTH:
+            return self._scan_values(filter_condition)
+        return self._scan_values(
+            filter_condition,
+            self._trigram_candidates(filter_condition.field, needle.lower()),
+        )
+
+    def _trigram_candidates(self, field: str, text: str) -> set:
+        """Keys of the field's values that contain every trigram of the text."""
+        index = self._trigram_index(field)
+        postings = sorted((index.get(gram, set()) for gram in trigrams(text)), key=len)
+        if not postings or not postings[0]:
+            return set()
+        return postings[0].intersection(*postings[1:])
+
+    def _trigram_index(self, field: str) -> dict[str, set]:
+        """Return the trigram index of a field, building it on first use."""
+        index = self._trigrams.get(field)
+        if index is None:
+            index = self._trigrams[field] = {}
+            for key in self._postings.get(field, {}):
+                self._index_trigrams(index, key)
+        return index
+
+    @staticmethod
+    def _index_trigrams(index: dict[str, set], key: tuple[str, Hashable]):
+        """Add a distinct value to a trigram index."""
+        for gram in _value_trigrams(key):
+            index.setdefault(gram, set()).add(key)
+
+    @staticmethod
+    def _unindex_trigrams(index: dict[str, set], key: tuple[str, Hashable]):
+        """Remove a distinct value from a trigram index."""
+        for gram in _value_trigrams(key):
+            keys = index.get(gram)
+            if keys is not None:
+                keys.discard(key)
+                if not keys:
+                    del index[gram]
+
+    def _scan_values(
+        self, filter_condition: MetadataFilter, keys: set | None = None
+    ) -> np.ndarray:
+        """Check each distinct value of the field once and union matching rows.
+
+        If keys are given, only those posting lists are checked.
+        """
+        postings = self._postings.get(filter_condition.field, {})
+        if keys is not None:
+            postings = {key: postings[key] for key in keys if key in postings}
+        matches_value = compile_filter(filter_condition)
+        matches = [
+            rows for (_, value), rows in postings.items() if matches_value(value)
+        ]
+        return self._rows_to_mask(matches, self._scan_unhashable(filter_condition))
+
+    def _scan_unhashable(self, filter_condition: MetadataFilter) -> list[int]:
+        """Evaluate rows whose value (a list or dict) cannot be indexed."""
+        values = self._unhashable.get(filter_condition.field, {})
+        if not values:
+            return []
+        matches_value = compile_filter(filter_condition)
+        return [row for row, value in values.items() if matches_value(value)]
+
+    def _has_value_mask(self, field: str) -> np.ndarray:
+        """Rows where the field is present and not None."""
+        return self._rows_to_mask(
+            list(self._postings.get(field, {}).values()),
+            list(self._unhashable.get(field, {})),
+        )
+
+    def _rows_to_mask(
+        self, postings: list[np.ndarray | None], extra_rows: list[int]
+    ) -> np.ndarray:
+        """Union posting lists and loose rows into a boolean row bitmap."""
+        mask = np.zeros(self.num_rows, dtype=bool)
+        for rows in postings:
+            if rows is not None:
+                mask[rows] = True
+        if extra_rows:
+            mask[extra_rows] = True
+        return mask
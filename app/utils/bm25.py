@@ -0,0 +1,91 @@
+"""In-process BM25 keyword index over chunk content."""
+
+import heapq
+import math
+import re
+from collections import Counter
+from collections.abc import Hashable
+
+_TOKEN_PATTERN = re.compile(r"\w+")
+
+
+def tokenize(text: str | None) -> list[str]:
+    """Split text into lowercase word tokens."""
+    return _TOKEN_PATTERN.findall(text.lower()) if text else []
+
+
+class BM25Index:
+    """Okapi BM25 inverted index that supports incremental inserts and deletes.
+
+    Posting lists map each term to the term frequency per document, and document
+    lengths are kept alongside, so adding or removing a document only touches
+    its own terms. Corpus statistics (document count, average length) are read
+    at query time and always reflect the current contents.
+    """
+
+    def __init__(self, k1: float = 1.2, b: float = 0.75):
+        """Initialize an empty index with the BM25 saturation parameters."""
+        self.k1 = k1
+        self.b = b
+        self._postings: dict[str, dict[Hashable, int]] = {}
+        self._term_counts: dict[Hashable, Counter] = {}
+        self._lengths: dict[Hashable, int] = {}
+        self._total_length = 0
+
+    def __len__(self) -> int:
+        return len(self._term_counts)
+
+    def __contains__(self, doc_id: Hashable) -> bool:
+        return doc_id in self._term_counts
+
+    def add(self, doc_id: Hashable, text: str | None):
+        """Index a document's text, replacing any previous version of it."""
+        if doc_id in self._term_counts:
+            self.remove(doc_id)
+
+        counts = Counter(tokenize(text))
+        self._term_counts[doc_id] = counts
+        self._lengths[doc_id] = counts.total()
+        self._total_length += self._lengths[doc_id]
+        for term, frequency in counts.items():
+            self._postings.setdefault(term, {})[doc_id] = frequency
+
+    def remove(self, doc_id: Hashable):
+        """Drop a document from the index if it is present."""
+        counts = self._term_counts.pop(doc_id, None)
+        if counts is None:
+            return
+
+        self._total_length -= self._lengths.pop(doc_id)
+        for term in counts:
+            postings = self._postings[term]
+            del postings[doc_id]
+            if not postings:
+                del self._postings[term]
+
+    def search(self, query: str, k: int | None = None) -> list[tuple[Hashable, float]]:
+        """Return ``(doc_id, score)`` of the best matching documents, best first.
+
+        Only documents containing at least one query term are scored. If k is
+        None every matching document is returned.
+        """
+        if not self._term_counts:
+            return []
+
+        num_docs = len(self._term_counts)
+        average_length = self._total_length / num_docs or 1.0
+        scores: dict[Hashable, float] = {}
+        for term, query_frequency in Counter(tokenize(query)).items():
+            postings = self._postings.get(term)
+            if not postings:
+                continue
+            idf = math.log(1 + (num_docs - len(postings) + 0.5) / (len(postings) + 0.5))
+            for doc_id, frequency in postings.items():
+                length = self._lengths[doc_id]
+                norm = self.k1 * (1 - self.b + self.b * length / average_length)
+                score = idf * frequency * (self.k1 + 1) / (frequency + norm)
+                scores[doc_id] = scores.get(doc_id, 0.0) + query_frequency * score
+
+        if k is None:
+            return sorted(scores.items(), key=lambda item: item[1], reverse=True)
+        return heapq.nlargest(k, scores.items(), key=lambda item: item[1])
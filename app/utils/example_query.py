@@ -0,0 +1,32 @@
+"""Build query vectors from positive and negative example vectors."""
+
+import numpy as np
+
+
+def example_query(
+    positive: np.ndarray,
+    negative: np.ndarray | None = None,
+    negative_weight: float = 0.5,
+) -> np.ndarray:
+    """Combine example vectors into one unit query vector (Rocchio).
+
+    The query is the centroid of the unit-normalized positive examples minus
+    ``negative_weight`` times the centroid of the unit-normalized negative
+    ones, so every example weighs the same regardless of its norm. Raises
+    ValueError if the examples cancel out.
+    """
+    query = _unit(positive).mean(axis=0)
+    if negative is not None and len(negative):
+        query = query - negative_weight * _unit(negative).mean(axis=0)
+
+    norm = np.linalg.norm(query)
+    if not np.isfinite(norm) or norm == 0:
+        raise ValueError("The example vectors cancel out")
+    return query / norm
+
+
+def _unit(vectors: np.ndarray) -> np.ndarray:
+    """Normalize the rows of a 2-D array to unit length, leaving zero rows."""
+    vectors = np.asarray(vectors, dtype=np.float64)
+    norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+    return vectors / np.where(norms == 0, 1.0, norms)
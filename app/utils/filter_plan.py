@@ -0,0 +1,276 @@
+"""Compiled metadata filter predicates reused across queries."""
+
+import operator as operators
+from collections import OrderedDict
+from collections.abc import Callable, Hashable
+from datetime import datetime
+from typing import Any
+
+from app.models.models import FilterExpression, FilterGroup, MetadataFilter
+
+# Estimated selectivity rank of each operator, most selective first. Clauses run
+# in this order so the ones most likely to reject an item short-circuit early.
+OPERATOR_SELECTIVITY = {
+    "eq": 0,
+    "in": 1,
+    "starts_with": 2,
+    "ends_with": 2,
+    "gt": 3,
+    "gte": 3,
+    "lt": 3,
+    "lte": 3,
+    "contains": 4,
+    "ne": 5,
+}
+# Nested groups cost a full sub-plan evaluation, so they run after the leaves
+GROUP_SELECTIVITY = 6
+
+_COMPARISONS = {
+    "eq": operators.eq,
+    "ne": operators.ne,
+    "gt": operators.gt,
+    "gte": operators.ge,
+    "lt": operators.lt,
+    "lte": operators.le,
+}
+
+# Which form of the filter value a field value is compared against
+RAW, NUMBER, DATE = 0, 1, 2
+
+
+def _parse_float(value: Any) -> float | None:
+    """Convert a string to float, or None if it is not numeric."""
+    try:
+        return float(value)
+    except ValueError:
+        return None
+
+
+def _parse_date(value: str) -> datetime | None:
+    """Parse an ISO date string, accepting a trailing ``Z``."""
+    try:
+        return datetime.fromisoformat(value.replace("Z", "+00:00"))
+    except ValueError:
+        return None
+
+
+class CompiledFilter:
+    """A single metadata filter with its constant parsed once.
+
+    Field values are normalized against the pre-parsed number and date forms of
+    the filter value, then handed to a closure specialised for the operator.
+    """
+
+    def __init__(self, filter_condition: MetadataFilter):
+        """Parse the filter value and build the operator predicate."""
+        self.filter = filter_condition
+        self.field = filter_condition.field
+        self.operator = filter_condition.operator
+
+        value = filter_condition.value
+        self._is_string = isinstance(value, str)
+        self._is_number = isinstance(value, int | float)
+        number = _parse_float(value) if self._is_string else None
+        date = _parse_date(value) if self._is_string else None
+        self._number = number
+        self._date = date
+        self._none_result = self.operator == "ne" and value is not None
+        self._compare = self._build_predicate((value, number, date))
+
+    def __call__(self, field_value: Any) -> bool:
+        """Check if a field value matches the filter."""
+        if field_value is None:
+            return self._none_result
+
+        field_value, form = self._normalize(field_value)
+        try:
+            return self._compare(field_value, form)
+        except (TypeError, ValueError):
+            # If comparison fails, filter doesn't match
+            return False
+
+    def matches(self, attributes: dict[str, Any]) -> bool:
+        """Check if an item's attributes match the filter."""
+        return self(attributes.get(self.field))
+
+    def _normalize(self, field_value: Any) -> tuple[Any, int]:
+        """Convert a field value for comparison and pick the filter value form."""
+        if self._date is not None:
+            if isinstance(field_value, str):
+                field_date = _parse_date(field_value)
+                if field_date is not None:
+                    return field_date, DATE
+            elif isinstance(field_value, datetime):
+                return field_value, DATE
+
+        if self._is_string:
+            if isinstance(field_value, str):
+                field_number = _parse_float(field_value)
+                if field_number is not None and self._number is not None:
+                    return field_number, NUMBER
+            elif isinstance(field_value, int | float) and self._number is not None:
+                return field_value, NUMBER
+        elif self._is_number and isinstance(field_value, str):
+            field_number = _parse_float(field_value)
+            if field_number is not None:
+                return field_number, RAW
+
+        return field_value, RAW
+
+    def _build_predicate(self, forms: tuple) -> Callable[[Any, int], bool]:
+        """Return a closure comparing a normalized field value to the filter."""
+        match self.operator:
+            case "eq" | "ne" | "gt" | "gte" | "lt" | "lte":
+                compare = _COMPARISONS[self.operator]
+                return lambda field_value, form: compare(field_value, forms[form])
+            case "in":
+                members = forms[RAW]
+                if not isinstance(members, list | tuple | set):
+                    return lambda field_value, form: False
+                if all(isinstance(member, Hashable) for member in members):
+                    member_set = frozenset(members)
+                    return lambda field_value, form: (
+                        field_value in member_set
+                        if isinstance(field_value, Hashable)
+                        else field_value in members
+                    )
+                return lambda field_value, form: field_value in members
+            case "contains" | "starts_with" | "ends_with":
+                lowered = tuple(str(value).lower() for value in forms)
+                if self.operator == "contains":
+                    return lambda field_value, form: (
+                        lowered[form] in str(field_value).lower()
+                    )
+                if self.operator == "starts_with":
+                    return lambda field_value, form: (
+                        str(field_value).lower().startswith(lowered[form])
+                    )
+                return lambda field_value, form: (
+                    str(field_value).lower().endswith(lowered[form])
+                )
+            case _:
+                return lambda field_value, form: False
+
+
+class FilterPlan:
+    """A list of filter expressions compiled into predicates.
+
+    The clauses are combined with ``operator``: the top-level filter list is an
+    implicit ``and``, nested ``FilterGroup``s compile into sub-plans. Clauses are
+    ordered so the one most likely to decide the result runs first: most
+    selective first for ``and``/``not``, least selective first for ``or``.
+    """
+
+    def __init__(self, filters: list[FilterExpression], operator: str = "and"):
+        """Compile each filter expression and order them for short-circuiting."""
+        self.operator = operator
+        self.clauses = sorted(
+            (_compile_expression(expression) for expression in filters),
+            key=_clause_selectivity,
+            reverse=operator == "or",
+        )
+
+    @property
+    def filters(self) -> list[FilterExpression]:
+        """The original filter expressions in evaluation order."""
+        return [clause.filter for clause in self.clauses]
+
+    def matches(self, attributes: dict[str, Any]) -> bool:
+        """Check if an item's attributes satisfy the plan."""
+        match self.operator:
+            case "or":
+                return any(clause.matches(attributes) for clause in self.clauses)
+            case "not":
+                return not all(clause.matches(attributes) for clause in self.clauses)
+            case _:
+                return all(clause.matches(attributes) for clause in self.clauses)
+
+
+class GroupPlan(FilterPlan):
+    """A compiled ``FilterGroup`` nested inside a plan."""
+
+    def __init__(self, group: FilterGroup):
+        """Compile the group's filters with its boolean operator."""
+        super().__init__(group.filters, group.operator)
+        self.filter = group
+
+
+def _compile_expression(expression: FilterExpression) -> CompiledFilter | GroupPlan:
+    """Compile a leaf filter or a nested group."""
+    if isinstance(expression, FilterGroup):
+        return GroupPlan(expression)
+    return compile_filter(expression)
+
+
+def _clause_selectivity(clause: CompiledFilter | GroupPlan) -> int:
+    """Estimated selectivity rank of a compiled clause, most selective lowest."""
+    if isinstance(clause, GroupPlan):
+        return GROUP_SELECTIVITY
+    return OPERATOR_SELECTIVITY.get(clause.operator, 0)
+
+
+def _freeze(value: Any) -> Hashable:
+    """Build a hashable, type-tagged cache key for a filter value."""
+    if isinstance(value, list | tuple):
+        return type(value).__name__, tuple(_freeze(item) for item in value)
+    if isinstance(value, set | frozenset):
+        return "set", tuple(sorted((_freeze(item) for item in value), key=repr))
+    if isinstance(value, dict):
+        return "dict", tuple((key, _freeze(item)) for key, item in value.items())
+    if isinstance(value, Hashable):
+        return type(value).__name__, value
+    return "repr", repr(value)
+
+
+def _filter_key(filter_condition: FilterExpression) -> Hashable:
+    """Cache key identifying a filter by field, operator and value."""
+    if isinstance(filter_condition, FilterGroup):
+        return (
+            "group",
+            filter_condition.operator,
+            tuple(map(_filter_key, filter_condition.filters)),
+        )
+    return (
+        filter_condition.field,
+        filter_condition.operator,
+        _freeze(filter_condition.value),
+    )
+
+
+_MAX_CACHED_FILTERS = 1024
+_MAX_CACHED_PLANS = 256
+_filter_cache: OrderedDict[Hashable, CompiledFilter] = OrderedDict()
+_plan_cache: OrderedDict[Hashable, FilterPlan] = OrderedDict()
+
+
+def _cached(cache: OrderedDict, max_size: int, key: Hashable, build: Callable):
+    """Return the cached value for key, building and storing it on a miss (LRU)."""
+    value = cache.get(key)
+    if value is not None:
+        cache.move_to_end(key)
+        return value
+
+    value = cache[key] = build()
+    if len(cache) > max_size:
+        cache.popitem(last=False)
+    return value
+
+
+def compile_filter(filter_condition: MetadataFilter) -> CompiledFilter:
+    """Compile a single filter, reusing the cached predicate for equal filters."""
+    return _cached(
+        _filter_cache,
+        _MAX_CACHED_FILTERS,
+        _filter_key(filter_condition),
+        lambda: CompiledFilter(filter_condition),
+    )
+
+
+def compile_filters(filters: list[FilterExpression]) -> FilterPlan:
+    """Compile a filter list, reusing the cached plan for identical filter sets."""
+    return _cached(
+        _plan_cache,
+        _MAX_CACHED_PLANS,
+        tuple(_filter_key(filter_condition) for filter_condition in filters),
+        lambda: FilterPlan(filters),
+    )
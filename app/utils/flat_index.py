@@ -1,5 +1,9 @@
+from collections.abc import Iterator
+
 import numpy as np
 
+from app.utils.topk import RankedScan
+
 
 class FlatIndex:
     def fit(self, vectors: np.ndarray) -> np.ndarray:
@@ -7,15 +11,84 @@ class FlatIndex:
         return vectors.T.copy()  # return as (D, N) - features x samples
 
     def search(
-        self, query_vector: np.ndarray, vectors: np.ndarray, k: int = 5
+        self,
+        query_vector: np.ndarray,
+        vectors: np.ndarray,
+        k: int = 5,
+        mask: np.ndarray | None = None,
     ) -> list[int]:
-        """Search for k most similar vectors and return index values."""
+        """Search for k most similar vectors and return index values.
+
+        If a boolean row mask is given, only the columns it selects are scored.
+        """
+        indices, _ = self.search_with_scores(query_vector, vectors, k, mask)
+        return indices.tolist()
+
+    def search_with_scores(
+        self,
+        query_vector: np.ndarray,
+        vectors: np.ndarray,
+        k: int = 5,
+        mask: np.ndarray | None = None,
+        min_score: float | None = None,
+    ) -> tuple[np.ndarray, np.ndarray]:
+        """Return column indices and similarities of the k most similar vectors.
+
+        If a boolean row mask is given, only the columns it selects are scored.
+        Columns scoring below ``min_score`` are dropped before the top-k
+        selection, so fewer than k results may be returned.
+        """
+        return self.scan(query_vector, vectors, mask, min_score).next(k)
+
+    def scan(
+        self,
+        query_vector: np.ndarray,
+        vectors: np.ndarray,
+        mask: np.ndarray | None = None,
+        min_score: float | None = None,
+    ) -> RankedScan:
+        """Score the columns once and return them as a resumable ranking."""
         if vectors is None or vectors.shape[1] == 0:
-            return []
+            return RankedScan(np.empty(0, dtype=np.int64), np.empty(0))
+
+        if mask is None:
+            candidates = np.arange(vectors.shape[1])
+            similarities = np.atleast_1d(self.similarities(query_vector, vectors))
+        else:
+            candidates = np.flatnonzero(mask)
+            if len(candidates) == 0:
+                return RankedScan(candidates, np.empty(0))
+            similarities = np.atleast_1d(
+                self.similarities(query_vector, vectors[:, candidates])
+            )
 
-        similarities = self._cosine_similarity(query_vector, vectors)
-        top_k_indices = np.argsort(similarities)[::-1][:k]
-        return top_k_indices.tolist()
+        if min_score is not None:
+            passing = similarities >= min_score
+            candidates, similarities = candidates[passing], similarities[passing]
+        return RankedScan(candidates, similarities)
+
+    def range_search(
+        self,
+        query_vector: np.ndarray,
+        vectors: np.ndarray,
+        radius: float,
+        mask: np.ndarray | None = None,
+        batch_size: int = 256,
+    ) -> Iterator[tuple[np.ndarray, np.ndarray]]:
+        """Yield batches of columns with similarity >= radius, best first."""
+        scan = self.scan(query_vector, vectors, mask, min_score=radius)
+        while not scan.exhausted:
+            yield scan.next(batch_size)
+
+    def similarities(self, query: np.ndarray, vectors: np.ndarray) -> np.ndarray:
+        """Score all vectors against the query with the kernel matching their dtype."""
+        match vectors.dtype:
+            case np.uint8:
+                return self._hamming_similarity(query, vectors)
+            case np.int8:
+                return self._int8_cosine_similarity(query, vectors)
+            case _:
+                return self._cosine_similarity(query, vectors)
 
     def _cosine_similarity(self, query: np.ndarray, vectors: np.ndarray) -> np.ndarray:
         """Calculate cosine similarity between query and vectors."""
@@ -24,3 +97,24 @@ class FlatIndex:
             / (np.linalg.norm(query) * np.linalg.norm(vectors, axis=0))
         )
         return similarities
+
+    def _int8_cosine_similarity(
+        self, query: np.ndarray, vectors: np.ndarray
+    ) -> np.ndarray:
+        """Calculate cosine similarity for int8 vectors without a float64 copy."""
+        query = np.asarray(query, dtype=np.float32).reshape(-1)
+        vectors = vectors.astype(np.float32)
+        return self._cosine_similarity(query, vectors)
+
+    def _hamming_similarity(self, query: np.ndarray, vectors: np.ndarray) -> np.ndarray:
+        """Calculate cosine similarity for packed binary vectors via hamming distance.
+
+        Read as +/-1 per bit (see ``to_float_vectors``), two D-bit vectors have
+        cosine similarity ``1 - 2 * hamming / D``, so flat and IVF searches of
+        ubinary libraries score alike.
+        """
+        query = np.asarray(query, dtype=np.uint8).reshape(-1, 1)
+        distances = np.bitwise_count(np.bitwise_xor(vectors, query)).sum(
+            axis=0, dtype=np.int64
+        )
+        return 1.0 - 2.0 * distances / (vectors.shape[0] * 8)
@@ -1,5 +1,11 @@
+from collections.abc import Iterator
+
 import numpy as np
 
+from app.utils.flat_index import FlatIndex
+from app.utils.quantization import to_float_vectors
+from app.utils.topk import top_k
+
 
 class KMeans:
     def __init__(self, n_clusters: int = 3, max_iters: int = 32):
@@ -65,22 +71,42 @@ class KMeans:
 
 
 class IVF:
-    def __init__(self, n_clusters: int = 16, max_iters: int = 32):
-        """Initialize IVF index with KMeans clustering for coarse search."""
+    def __init__(
+        self,
+        n_clusters: int = 16,
+        max_iters: int = 32,
+        n_probes: int = 1,
+        brute_force_selectivity: float = 0.05,
+    ):
+        """Initialize IVF index with KMeans clustering for coarse search.
+
+        ``n_probes`` is the minimum number of lists scanned per query. Filtered
+        searches whose mask selects at most ``brute_force_selectivity`` of the
+        rows skip the coarse search and scan the matching rows directly.
+        """
         self.n_clusters = n_clusters
         self.ix = [[] for _ in range(self.n_clusters + 1)]
         self.max_iters = max_iters
+        self.n_probes = n_probes
+        self.brute_force_selectivity = brute_force_selectivity
         self.kmeans = KMeans(n_clusters=n_clusters, max_iters=max_iters)
         self.index = None
+        self.vectors = None
+        self.flat_index = FlatIndex()
+        self._list_bounds = None
 
     def fit(self, X):
-        """Fit the IVF index by training the underlying KMeans clustering."""
-        self.kmeans.fit(X)
+        """Fit the IVF index by training the underlying KMeans clustering.
+
+        Quantized vectors are expanded to floats for the clustering only; the
+        centroids are the one part of the index kept as floats.
+        """
+        self.kmeans.fit(to_float_vectors(X))
         return self
 
     def predict(self, X):
         """Predict cluster assignments using the trained KMeans model."""
-        return self.kmeans.predict(X)
+        return self.kmeans.predict(to_float_vectors(X))
 
     @property
     def centroids(self):
@@ -98,7 +124,11 @@ class IVF:
         return self.kmeans.is_fitted
 
     def create_index(self, dataset):
-        """Create inverted file index by grouping vector indices by cluster assignment."""
+        """Create inverted file index by grouping vector indices by cluster assignment.
+
+        The dataset is kept in its stored dtype, so int8 and packed binary lists
+        take their compact size and are scored with the matching kernel.
+        """
         # Fit the dataset and get cluster assignments
         if not self.is_fit:
             self.fit(dataset)
@@ -108,20 +138,193 @@ class IVF:
         for i, label in enumerate(self.labels):
             index[label].append(i)
         self.index = index
+        self.vectors = dataset
+        self._list_bounds = None
         return self.index
 
-    def search(self, query):
-        """Search for vectors in the same cluster as the query vector."""
+    def search(self, query, mask=None):
+        """Search for vectors in the same cluster as the query vector.
+
+        If a boolean row mask is given, only vectors it selects are returned.
+        """
         # Ensure query is 1D vector for distance calculation
         if query.ndim > 1:
             query = query.flatten()
 
         # Coarse search - find nearest centroid to query
+        float_query = to_float_vectors(query)
         distances_to_centroids = [
-            np.linalg.norm(query - centroid) for centroid in self.centroids
+            np.linalg.norm(float_query - centroid) for centroid in self.centroids
         ]
         nearest_centroid = np.argmin(distances_to_centroids)
 
         # Fine search - return indices of vectors in the nearest centroid's index
         nearest_vectors = self.index.get(nearest_centroid, [])
+        if mask is not None:
+            nearest_vectors = [i for i in nearest_vectors if mask[i]]
         return nearest_vectors
+
+    def search_with_scores(
+        self, query, k: int = 5, mask=None, min_score: float | None = None
+    ) -> tuple[np.ndarray, np.ndarray]:
+        """Return row indices and cosine similarities of the k best vectors.
+
+        Lists are probed nearest first and probing continues past ``n_probes``
+        until k rows passing the mask have been collected. Highly selective masks
+        are answered by scanning the matching rows directly, which is both exact
+        and cheaper than probing most of the lists to find k hits. Rows scoring
+        below ``min_score`` are dropped before the top-k selection.
+        """
+        return self.scan(query, mask, min_score).next(k)
+
+    def range_search(
+        self, query, radius: float, mask=None
+    ) -> Iterator[tuple[np.ndarray, np.ndarray]]:
+        """Yield batches of rows with cosine similarity >= radius, best first.
+
+        With members normalized to the unit sphere, no member of a list whose
+        unit centroid is ``c`` and radius ``r`` scores above ``q.c + r`` for the
+        unit query ``q``. Lists are visited in decreasing order of that bound,
+        lists whose bound is below ``radius`` are never scanned, and rows are
+        yielded as soon as no unvisited list can outscore them.
+        """
+        if self.vectors is None or self.index is None:
+            return
+        query = query.flatten()
+        float_query = to_float_vectors(query)
+        norm = np.linalg.norm(float_query)
+        if norm == 0:
+            return
+
+        centers, radii = self.list_bounds()
+        bounds = centers @ (float_query / norm) + radii
+        order = np.argsort(-bounds)
+        rows, scores = np.empty(0, dtype=np.int64), np.empty(0)
+        for position, cluster in enumerate(order):
+            if bounds[cluster] < radius:
+                break
+            members = np.asarray(self.index.get(cluster, []), dtype=np.int64)
+            if mask is not None:
+                members = members[mask[members]]
+            if len(members):
+                member_scores = np.atleast_1d(
+                    self.flat_index.similarities(query, self.vectors[members].T)
+                )
+                passing = member_scores >= radius
+                rows = np.concatenate([rows, members[passing]])
+                scores = np.concatenate([scores, member_scores[passing]])
+
+            next_bound = (
+                bounds[order[position + 1]] if position + 1 < len(order) else -np.inf
+            )
+            ready = scores >= next_bound
+            if ready.any():
+                best = np.argsort(-scores[ready], kind="stable")
+                yield rows[ready][best], scores[ready][best]
+                rows, scores = rows[~ready], scores[~ready]
+
+        if len(rows):
+            best = np.argsort(-scores, kind="stable")
+            yield rows[best], scores[best]
+
+    def list_bounds(self) -> tuple[np.ndarray, np.ndarray]:
+        """Unit-sphere centroid and radius of each list, computed once per index."""
+        # Indexes pickled before range search was added have no cached bounds
+        if getattr(self, "_list_bounds", None) is None:
+            vectors = to_float_vectors(self.vectors)
+            norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+            units = vectors / np.where(norms == 0, 1.0, norms)
+            centers = np.zeros((self.n_clusters, units.shape[1]))
+            radii = np.full(self.n_clusters, -np.inf)
+            for cluster, members in self.index.items():
+                if members:
+                    centers[cluster] = units[members].mean(axis=0)
+                    radii[cluster] = np.linalg.norm(
+                        units[members] - centers[cluster], axis=1
+                    ).max()
+            self._list_bounds = centers, radii
+        return self._list_bounds
+
+    def scan(self, query, mask=None, min_score: float | None = None) -> "IVFScan":
+        """Start a resumable search that probes further lists on demand."""
+        if query.ndim > 1:
+            query = query.flatten()
+        return IVFScan(self, query, mask, min_score)
+
+
+class IVFScan:
+    """A resumable IVF search handing out rows best first in batches.
+
+    The probe order and the scored rows not returned yet are kept between
+    calls, so asking for more results probes the next lists instead of
+    restarting from the nearest one. Each batch is the best of the rows probed
+    so far, so rows of later lists can outscore earlier batches; ``ordered``
+    tells whether every list was probed before the first batch, which makes the
+    batches follow the global score order.
+    """
+
+    def __init__(self, ivf: IVF, query, mask=None, min_score: float | None = None):
+        """Order the lists by centroid distance, or scan a selective mask."""
+        self.ivf = ivf
+        self.query = query
+        self.mask = mask
+        self.min_score = min_score
+        self.probes = 0
+        self.ordered = True
+        self._rows = np.empty(0, dtype=np.int64)
+        self._scores = np.empty(0)
+
+        if ivf.vectors is None or ivf.index is None:
+            self._order = np.empty(0, dtype=np.int64)
+        elif mask is not None and mask.mean() <= ivf.brute_force_selectivity:
+            self._order = np.empty(0, dtype=np.int64)
+            self._add(np.flatnonzero(mask))
+        else:
+            distances = np.linalg.norm(ivf.centroids - to_float_vectors(query), axis=1)
+            self._order = np.argsort(distances)
+
+    @property
+    def exhausted(self) -> bool:
+        """Whether every list has been probed and every row returned."""
+        return self.probes >= len(self._order) and len(self._rows) == 0
+
+    def next(self, k: int) -> tuple[np.ndarray, np.ndarray]:
+        """Return the k best pending rows, probing lists until k are pending."""
+        while self.probes < len(self._order) and (
+            self.probes < self.ivf.n_probes or len(self._rows) < k
+        ):
+            self._probe_next()
+        self.ordered &= self.probes >= len(self._order)
+
+        positions, scores = top_k(self._scores, k)
+        rows = self._rows[positions]
+        self._rows = np.delete(self._rows, positions)
+        self._scores = np.delete(self._scores, positions)
+        return rows, scores
+
+    def probe_all(self):
+        """Probe every remaining list, so all rows are ranked together."""
+        while self.probes < len(self._order):
+            self._probe_next()
+
+    def _probe_next(self):
+        """Score the rows of the nearest list not probed yet."""
+        cluster = self._order[self.probes]
+        self.probes += 1
+        members = np.asarray(self.ivf.index.get(cluster, []), dtype=np.int64)
+        if self.mask is not None:
+            members = members[self.mask[members]]
+        self._add(members)
+
+    def _add(self, rows: np.ndarray):
+        """Score probed rows and keep those passing ``min_score`` as pending."""
+        if len(rows) == 0:
+            return
+        scores = np.atleast_1d(
+            self.ivf.flat_index.similarities(self.query, self.ivf.vectors[rows].T)
+        )
+        if self.min_score is not None:
+            passing = scores >= self.min_score
+            rows, scores = rows[passing], scores[passing]
+        self._rows = np.concatenate([self._rows, rows])
+        self._scores = np.concatenate([self._scores, scores])
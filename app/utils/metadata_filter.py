@@ -1,9 +1,16 @@
 """Metadata filtering utilities for search operations."""
 
-from datetime import datetime
 from typing import Any
 
-from app.models.models import MetadataFilter
+import numpy as np
+
+from app.models.models import FilterExpression, FilterGroup, MetadataFilter
+from app.utils.filter_plan import compile_filter, compile_filters
+
+# Prefix under which a document's attributes are exposed on its chunk rows
+DOCUMENT_FIELD_PREFIX = "document."
+# Document attributes too large to copy onto every chunk row
+_UNSHARED_DOCUMENT_FIELDS = ("content",)
 
 
 class MetadataFilterProcessor:
@@ -12,27 +19,98 @@ class MetadataFilterProcessor:
     @staticmethod
     def apply_filters(
         items: list[Any],
-        filters: list[MetadataFilter],
+        filters: list[FilterExpression],
         metadata_field: str = "metadata",
+        documents: dict[Any, Any] | None = None,
     ) -> list[Any]:
-        """Apply metadata filters to a list of items."""
+        """Apply metadata filters to a list of items.
+
+        If documents (keyed by id) are given, each item is matched together with
+        the attributes of its document, see ``row_attributes``.
+        """
         if not filters:
             return items
 
+        plan = compile_filters(filters)
         filtered_items = []
         for item in items:
-            if MetadataFilterProcessor._item_matches_filters(
-                item, filters, metadata_field
+            if plan.matches(
+                MetadataFilterProcessor.row_attributes(item, documents, metadata_field)
             ):
                 filtered_items.append(item)
 
         return filtered_items
 
+    @staticmethod
+    def build_mask(
+        items: list[Any],
+        filters: list[FilterExpression],
+        metadata_field: str = "metadata",
+        documents: dict[Any, Any] | None = None,
+    ) -> np.ndarray:
+        """Evaluate metadata filters into a boolean row bitmap aligned with items."""
+        if not filters:
+            return np.ones(len(items), dtype=bool)
+
+        plan = compile_filters(filters)
+        return np.fromiter(
+            (
+                plan.matches(
+                    MetadataFilterProcessor.row_attributes(
+                        item, documents, metadata_field
+                    )
+                )
+                for item in items
+            ),
+            dtype=bool,
+            count=len(items),
+        )
+
     @staticmethod
     def _item_matches_filters(
-        item: Any, filters: list[MetadataFilter], metadata_field: str
+        item: Any, filters: list[FilterExpression], metadata_field: str
     ) -> bool:
         """Check if an item matches all the provided filters."""
+        combined_metadata = MetadataFilterProcessor.item_attributes(
+            item, metadata_field
+        )
+
+        # All filters must match (AND logic)
+        return compile_filters(filters).matches(combined_metadata)
+
+    @staticmethod
+    def row_attributes(
+        item: Any,
+        documents: dict[Any, Any] | None = None,
+        metadata_field: str = "metadata",
+    ) -> dict[str, Any]:
+        """Attributes of a chunk row with its document's attributes denormalized.
+
+        Document attributes (except its content) are available as
+        ``document.<field>`` and, where the chunk has no field of the same name,
+        unprefixed, so document metadata filters apply to the document's chunks.
+        """
+        attributes = MetadataFilterProcessor.item_attributes(item, metadata_field)
+        document = (documents or {}).get(getattr(item, "document_id", None))
+        if document is None:
+            return attributes
+
+        document_attributes = {
+            field: value
+            for field, value in MetadataFilterProcessor.item_attributes(
+                document
+            ).items()
+            if field not in _UNSHARED_DOCUMENT_FIELDS
+        }
+        prefixed = {
+            f"{DOCUMENT_FIELD_PREFIX}{field}": value
+            for field, value in document_attributes.items()
+        }
+        return {**document_attributes, **prefixed, **attributes}
+
+    @staticmethod
+    def item_attributes(item: Any, metadata_field: str = "metadata") -> dict[str, Any]:
+        """Merge an item's built-in fields with its custom metadata for filtering."""
         metadata = getattr(item, metadata_field, {}) or {}
 
         # Add built-in fields to metadata for filtering
@@ -57,125 +135,46 @@ class MetadataFilterProcessor:
             built_in_metadata["description"] = item.description
 
         # Merge custom metadata with built-in metadata
-        combined_metadata = {**built_in_metadata, **metadata}
+        return {**built_in_metadata, **metadata}
 
-        # All filters must match (AND logic)
-        for filter_condition in filters:
-            if not MetadataFilterProcessor._matches_filter(
-                combined_metadata, filter_condition
-            ):
-                return False
-
-        return True
+    @staticmethod
+    def matches_value(value: Any, filter_condition: MetadataFilter) -> bool:
+        """Check if a single field value matches a filter condition."""
+        return compile_filter(filter_condition)(value)
 
     @staticmethod
     def _matches_filter(
         metadata: dict[str, Any], filter_condition: MetadataFilter
     ) -> bool:
         """Check if metadata matches a single filter condition."""
-        field_value = metadata.get(filter_condition.field)
-        filter_value = filter_condition.value
-        operator = filter_condition.operator
-
-        # Handle None values
-        if field_value is None:
-            return operator == "ne" and filter_value is not None
-
-        # Convert values for comparison if needed
-        field_value, filter_value = MetadataFilterProcessor._normalize_values(
-            field_value, filter_value
-        )
-
-        # Apply the operator
-        try:
-            match operator:
-                case "eq":
-                    return field_value == filter_value
-                case "ne":
-                    return field_value != filter_value
-                case "gt":
-                    return field_value > filter_value
-                case "gte":
-                    return field_value >= filter_value
-                case "lt":
-                    return field_value < filter_value
-                case "lte":
-                    return field_value <= filter_value
-                case "in":
-                    return (
-                        field_value in filter_value
-                        if isinstance(filter_value, list | tuple | set)
-                        else False
-                    )
-                case "contains":
-                    return str(filter_value).lower() in str(field_value).lower()
-                case "starts_with":
-                    return (
-                        str(field_value).lower().startswith(str(filter_value).lower())
-                    )
-                case "ends_with":
-                    return str(field_value).lower().endswith(str(filter_value).lower())
-                case _:
-                    return False
-        except (TypeError, ValueError):
-            # If comparison fails, filter doesn't match
-            return False
-
-    @staticmethod
-    def _normalize_values(field_value: Any, filter_value: Any) -> tuple[Any, Any]:
-        """Normalize values for comparison, handling type conversions."""
-        # Try to parse dates
-        if isinstance(filter_value, str):
-            try:
-                # Try to parse as ISO date
-                filter_date = datetime.fromisoformat(
-                    filter_value.replace("Z", "+00:00")
-                )
-                if isinstance(field_value, str):
-                    field_date = datetime.fromisoformat(
-                        field_value.replace("Z", "+00:00")
-                    )
-                    return field_date, filter_date
-                elif isinstance(field_value, datetime):
-                    return field_value, filter_date
-            except (ValueError, AttributeError):
-                pass
-
-        # Try to convert to numbers if both are numeric strings
-        if isinstance(field_value, str) and isinstance(filter_value, str):
-            try:
-                field_float = float(field_value)
-                filter_float = float(filter_value)
-                return field_float, filter_float
-            except ValueError:
-                pass
-
-        # Handle numeric comparisons
-        if isinstance(field_value, int | float) and isinstance(filter_value, str):
-            try:
-                return field_value, float(filter_value)
-            except ValueError:
-                pass
-
-        if isinstance(filter_value, int | float) and isinstance(field_value, str):
-            try:
-                return float(field_value), filter_value
-            except ValueError:
-                pass
-
-        return field_value, filter_value
+        return compile_filter(filter_condition)(metadata.get(filter_condition.field))
 
     @staticmethod
-    def validate_filters(filters: list[MetadataFilter]) -> list[str]:
-        """Validate metadata filters and return list of error messages."""
+    def validate_filters(
+        filters: list[FilterExpression], prefix: str = ""
+    ) -> list[str]:
+        """Validate metadata filters and return list of error messages.
+
+        Nested groups are validated recursively and their filters are reported
+        with dotted positions, e.g. ``Filter 1.0``.
+        """
         errors = []
 
         for i, filter_condition in enumerate(filters):
+            if isinstance(filter_condition, FilterGroup):
+                errors.extend(
+                    MetadataFilterProcessor.validate_filters(
+                        filter_condition.filters, f"{prefix}{i}."
+                    )
+                )
+                continue
+
+            position = f"{prefix}{i}"
             # Validate field name
             if not filter_condition.field or not isinstance(
                 filter_condition.field, str
             ):
-                errors.append(f"Filter {i}: field must be a non-empty string")
+                errors.append(f"Filter {position}: field must be a non-empty string")
 
             # Validate operator
             valid_operators = [
@@ -191,14 +190,16 @@ class MetadataFilterProcessor:
                 "ends_with",
             ]
             if filter_condition.operator not in valid_operators:
-                errors.append(f"Filter {i}: operator must be one of {valid_operators}")
+                errors.append(
+                    f"Filter {position}: operator must be one of {valid_operators}"
+                )
 
             # Validate value for specific operators
             if filter_condition.operator == "in" and not isinstance(
                 filter_condition.value, list | tuple
             ):
                 errors.append(
-                    f"Filter {i}: 'in' operator requires a list or tuple value"
+                    f"Filter {position}: 'in' operator requires a list or tuple value"
                 )
 
         return errors
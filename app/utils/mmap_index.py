@@ -0,0 +1,124 @@
+"""Out-of-core exact search over a memory-mapped vector file."""
+
+from collections.abc import Iterator
+from pathlib import Path
+
+import numpy as np
+
+from app.utils.flat_index import FlatIndex
+from app.utils.topk import RankedScan, merge_top_k
+
+
+class MemmapFlatIndex:
+    """Exact flat search that streams fixed-size tiles from a ``.npy`` file.
+
+    Vectors are stored row-major as (N, D) so every tile is a contiguous read.
+    Only one tile of vectors is held in memory at a time, so libraries larger
+    than RAM can be searched exactly. Large flat library indexes keep their
+    vectors in such a file (see ``PersistentFlatIndex``).
+    """
+
+    def __init__(self, path: str | Path, tile_size: int = 65536):
+        """Initialize the index with the vector file path and rows per tile."""
+        self.path = Path(path)
+        self.tile_size = tile_size
+        self.flat_index = FlatIndex()
+        self._vectors = None
+
+    def write(self, vectors: np.ndarray, batch_size: int = 65536):
+        """Write vectors to the backing file in batches and open it for search.
+
+        The file is replaced atomically, so maps of the previous file, which
+        ``vectors`` may itself be, stay readable while it is written.
+        """
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        partial = self.path.with_suffix(".partial.npy")
+        out = np.lib.format.open_memmap(
+            partial, mode="w+", dtype=vectors.dtype, shape=vectors.shape
+        )
+        for start in range(0, len(vectors), batch_size):
+            out[start : start + batch_size] = vectors[start : start + batch_size]
+        out.flush()
+        del out
+        partial.replace(self.path)
+        return self.open()
+
+    def open(self):
+        """Memory-map the backing file read-only."""
+        self._vectors = np.load(self.path, mmap_mode="r")
+        return self
+
+    @property
+    def vectors(self) -> np.ndarray | None:
+        """The memory-mapped (N, D) vectors, or None before the file is opened."""
+        return self._vectors
+
+    def __len__(self) -> int:
+        return 0 if self._vectors is None else len(self._vectors)
+
+    def search(self, query_vector: np.ndarray, k: int = 5) -> list[int]:
+        """Search for k most similar vectors and return index values."""
+        indices, _ = self.search_with_scores(query_vector, k)
+        return indices.tolist()
+
+    def search_with_scores(
+        self, query_vector: np.ndarray, k: int = 5
+    ) -> tuple[np.ndarray, np.ndarray]:
+        """Return row indices and similarities of the k most similar vectors."""
+        best_rows = np.empty(0, dtype=np.int64)
+        best_scores = np.empty(0)
+        if self._vectors is None:
+            return best_rows, best_scores
+
+        for start in range(0, len(self._vectors), self.tile_size):
+            tile = np.asarray(self._vectors[start : start + self.tile_size])
+            scores = np.atleast_1d(self.flat_index.similarities(query_vector, tile.T))
+            rows = np.arange(start, start + len(tile))
+            best_rows, best_scores = merge_top_k(
+                best_rows, best_scores, rows, scores, k
+            )
+        return best_rows, best_scores
+
+    def scan(
+        self,
+        query_vector: np.ndarray,
+        mask: np.ndarray | None = None,
+        min_score: float | None = None,
+    ) -> RankedScan:
+        """Score the rows tile by tile and return them as a resumable ranking.
+
+        Only the rows a tile's slice of the mask selects are read, and rows
+        scoring below ``min_score`` are dropped before they are kept.
+        """
+        candidates, similarities = [], []
+        if self._vectors is not None:
+            for start in range(0, len(self._vectors), self.tile_size):
+                rows = np.arange(start, min(start + self.tile_size, len(self)))
+                if mask is not None:
+                    rows = rows[mask[start : start + self.tile_size]]
+                if len(rows) == 0:
+                    continue
+                tile = np.asarray(self._vectors[rows])
+                scores = np.atleast_1d(
+                    self.flat_index.similarities(query_vector, tile.T)
+                )
+                if min_score is not None:
+                    passing = scores >= min_score
+                    rows, scores = rows[passing], scores[passing]
+                candidates.append(rows)
+                similarities.append(scores)
+        if not candidates:
+            return RankedScan(np.empty(0, dtype=np.int64), np.empty(0))
+        return RankedScan(np.concatenate(candidates), np.concatenate(similarities))
+
+    def range_search(
+        self,
+        query_vector: np.ndarray,
+        radius: float,
+        mask: np.ndarray | None = None,
+        batch_size: int = 256,
+    ) -> Iterator[tuple[np.ndarray, np.ndarray]]:
+        """Yield batches of rows with similarity >= radius, best first."""
+        scan = self.scan(query_vector, mask, min_score=radius)
+        while not scan.exhausted:
+            yield scan.next(batch_size)
@@ -0,0 +1,47 @@
+"""Maximal marginal relevance (MMR) re-ranking for diverse results."""
+
+from collections.abc import Iterator
+
+import numpy as np
+
+from app.utils.quantization import to_float_vectors
+
+
+def mmr(
+    relevance: np.ndarray, vectors: np.ndarray, diversity: float = 0.5
+) -> Iterator[int]:
+    """Yield candidate positions in maximal marginal relevance order.
+
+    Each step picks the candidate maximizing
+    ``(1 - diversity) * relevance - diversity * max_similarity_to_selected``.
+    Relevance is scaled so the best candidate scores 1, which lets BM25 and
+    fused scores weigh like similarities. The candidate x candidate cosine
+    similarity matrix is computed with one matrix product up front; each step
+    then only updates the running maximum similarity to the selection with one
+    matrix column.
+    """
+    relevance = np.asarray(relevance, dtype=np.float64)
+    if len(relevance) == 0:
+        return
+
+    top = relevance.max()
+    if top > 0:
+        relevance = relevance / top
+
+    vectors = to_float_vectors(vectors).astype(np.float64)
+    norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+    unit = vectors / np.where(norms == 0, 1.0, norms)
+    similarity = unit @ unit.T
+
+    redundancy = np.full(len(relevance), -np.inf)
+    available = np.ones(len(relevance), dtype=bool)
+    for _ in range(len(relevance)):
+        # Nothing is redundant before the first pick
+        penalty = np.where(np.isinf(redundancy), 0.0, redundancy)
+        gains = np.where(
+            available, (1 - diversity) * relevance - diversity * penalty, -np.inf
+        )
+        chosen = int(np.argmax(gains))
+        available[chosen] = False
+        redundancy = np.maximum(redundancy, similarity[:, chosen])
+        yield chosen
@@ -3,6 +3,8 @@
 import json
 import logging
 import pickle
+from abc import ABC, abstractmethod
+from collections.abc import Callable, Iterator
 from pathlib import Path
 from typing import Any
 from uuid import UUID
@@ -10,13 +12,23 @@ from uuid import UUID
 import numpy as np
 
 from app.models.chunk import Chunk
+from app.models.document import Document
+from app.models.models import FilterExpression
+from app.utils.attribute_store import AttributeStore
 from app.utils.flat_index import FlatIndex
-from app.utils.ivf import IVF
+from app.utils.ivf import IVF, IVFScan
+from app.utils.mmap_index import MemmapFlatIndex
+from app.utils.quantization import (
+    EMBEDDING_DTYPES,
+    chunks_to_vectors,
+    embedding_type_of,
+)
+from app.utils.topk import RankedScan
 
 logger = logging.getLogger(__name__)
 
 
-class PersistentVectorIndex:
+class PersistentVectorIndex(ABC):
     """Base class for persistent vector indexes."""
 
     def __init__(self, storage_path: str):
@@ -79,6 +91,112 @@ class PersistentVectorIndex:
             logger.error(f"Failed to load index for library {library_id}: {str(e)}")
             return None
 
+    @abstractmethod
+    def empty_like(self) -> "PersistentVectorIndex":
+        """Return an unloaded index of the same kind and configuration."""
+        raise NotImplementedError
+
+    def filter_mask(self, filters: list[FilterExpression]) -> np.ndarray:
+        """Evaluate metadata filters into a row bitmap aligned with the index.
+
+        Trigram indexes built for substring filters are kept in memory and
+        written with the next save of the index, never by a search.
+        """
+        return self._attributes.build_mask(filters)
+
+    def estimate_selectivity(self, filters: list[FilterExpression]) -> float:
+        """Estimate the fraction of index rows the metadata filters select."""
+        return self._attributes.estimate_selectivity(filters)
+
+    @abstractmethod
+    def _save_current_index(self):
+        """Save the current index state to disk."""
+        raise NotImplementedError
+
+    def facet_counts(
+        self,
+        field: str,
+        mask: np.ndarray | None = None,
+        distinct_by: str | None = None,
+    ) -> dict[tuple[str, Any], int]:
+        """Count the distinct values of a metadata field over a row mask."""
+        return self._attributes.facet_counts(field, mask, distinct_by)
+
+    def search_chunks(
+        self, query_vector: np.ndarray, k: int = 5, mask: np.ndarray | None = None
+    ) -> list[Chunk]:
+        """Search for similar chunks, optionally restricted to a row mask."""
+        return [
+            chunk for chunk, _ in self.search_chunks_with_scores(query_vector, k, mask)
+        ]
+
+    def search_chunks_with_scores(
+        self,
+        query_vector: np.ndarray,
+        k: int = 5,
+        mask: np.ndarray | None = None,
+        min_score: float | None = None,
+    ) -> list[tuple[Chunk, float]]:
+        """Search for similar chunks and their similarities, best first."""
+        return self.scan_chunks(query_vector, mask, min_score).next(k)
+
+    @abstractmethod
+    def scan_chunks(
+        self,
+        query_vector: np.ndarray,
+        mask: np.ndarray | None = None,
+        min_score: float | None = None,
+    ) -> "ChunkScan":
+        """Start a resumable search returning chunks best first in batches."""
+        raise NotImplementedError
+
+    @abstractmethod
+    def range_chunks(
+        self,
+        query_vector: np.ndarray,
+        radius: float,
+        mask: np.ndarray | None = None,
+    ) -> Iterator[list[tuple[Chunk, float]]]:
+        """Yield batches of every chunk with similarity >= radius, best first."""
+        raise NotImplementedError
+
+    def _chunk_batches(
+        self, batches: Iterator[tuple[np.ndarray, np.ndarray]]
+    ) -> Iterator[list[tuple[Chunk, float]]]:
+        """Resolve batches of kernel rows to their chunks."""
+        chunks = self._chunks
+        for indices, scores in batches:
+            yield [
+                (chunks[i], float(score))
+                for i, score in zip(indices, scores, strict=True)
+                if i < len(chunks)
+            ]
+
+    @property
+    def documents(self) -> dict[UUID, Document]:
+        """The library's documents by id, as denormalized into the index."""
+        return self._documents
+
+    @property
+    def num_rows(self) -> int:
+        """Number of chunk rows in the index."""
+        return self._attributes.num_rows
+
+    def _is_index_valid(
+        self, index_data: dict[str, Any], current_chunks: list[Chunk]
+    ) -> bool:
+        """Check if the loaded index is still valid for the current chunks."""
+        return self._versions(index_data.get("chunks", [])) == self._versions(
+            current_chunks
+        ) and index_data.get("document_versions") == self._versions(
+            self._documents.values()
+        )
+
+    @staticmethod
+    def _versions(entities) -> dict[UUID, Any]:
+        """Map entity ids to their last update time to detect stale index rows."""
+        return {entity.id: entity.updated_at for entity in entities}
+
     def _delete_index_files(self, library_id: UUID, index_type: str):
         """Delete index files from disk."""
         try:
@@ -98,60 +216,164 @@ class PersistentVectorIndex:
 
 
 class PersistentFlatIndex(PersistentVectorIndex):
-    """Flat index with disk persistence."""
+    """Flat index with disk persistence.
+
+    Libraries with at least ``memmap_min_rows`` chunks keep their vectors in a
+    ``.npy`` file next to the index instead of the pickle. The file is memory
+    mapped on load and scanned in tiles, so searches do not need the whole
+    matrix in memory.
+    """
 
-    def __init__(self, storage_path: str = "data/indexes"):
+    def __init__(
+        self, storage_path: str = "data/indexes", memmap_min_rows: int | None = None
+    ):
         super().__init__(storage_path)
+        self.memmap_min_rows = memmap_min_rows
         self.flat_index = FlatIndex()
+        self._memmap = None
         self._current_library_id = None
         self._chunks = []
         self._vectors = None
         self._chunk_to_index_map = {}
+        self._attributes = AttributeStore()
+        self._documents = {}
+        self._document_versions = {}
 
-    def load_or_create_index(self, library_id: UUID, chunks: list[Chunk]):
-        """Load existing index or create new one for the library."""
+    def empty_like(self) -> "PersistentFlatIndex":
+        """Return an unloaded index with the same storage."""
+        return PersistentFlatIndex(str(self.storage_path), self.memmap_min_rows)
+
+    def load_or_create_index(
+        self,
+        library_id: UUID,
+        chunks: list[Chunk],
+        documents: list[Document] | None = None,
+    ):
+        """Load existing index or create new one for the library.
+
+        A stored index is brought up to date incrementally: rows for deleted or
+        updated chunks, or chunks of updated documents, are dropped and new or
+        updated chunks are appended.
+        """
         self._current_library_id = library_id
+        self._documents = {document.id: document for document in documents or []}
 
         # Try to load existing index
         index_data = self._load_index_data(library_id, "flat")
 
-        if index_data and self._is_index_valid(index_data, chunks):
+        # Indexes saved before the attribute store existed are rebuilt
+        if (
+            index_data
+            and "attributes" in index_data
+            and self._open_vectors(library_id, index_data)
+        ):
             # Load existing index
             self._chunks = index_data["chunks"]
-            self._vectors = index_data["vectors"]
             self._chunk_to_index_map = index_data["chunk_to_index_map"]
-            logger.info(f"Loaded existing flat index for library {library_id}")
+            self._attributes = index_data["attributes"]
+            self._document_versions = index_data.get("document_versions", {})
+            if self._sync_chunks(chunks):
+                self._save_current_index()
+                logger.info(f"Updated existing flat index for library {library_id}")
+            else:
+                logger.info(f"Loaded existing flat index for library {library_id}")
         else:
             # Create new index
             self._build_index(chunks)
             self._save_current_index()
             logger.info(f"Created new flat index for library {library_id}")
 
-    def _is_index_valid(
-        self, index_data: dict[str, Any], current_chunks: list[Chunk]
-    ) -> bool:
-        """Check if the loaded index is still valid for the current chunks."""
-        stored_chunk_ids = {chunk.id for chunk in index_data.get("chunks", [])}
-        current_chunk_ids = {chunk.id for chunk in current_chunks}
-        return stored_chunk_ids == current_chunk_ids
+    def _get_vectors_file_path(self, library_id: UUID) -> Path:
+        """Get the file path of a library's memory-mapped vectors."""
+        return self.storage_path / f"{library_id}_flat_vectors.npy"
+
+    def _open_vectors(self, library_id: UUID, index_data: dict[str, Any]) -> bool:
+        """Take the stored vectors, mapping their file if they were kept in one.
+
+        Returns False if the vector file of a memory-mapped index is missing.
+        """
+        self._memmap = None
+        if not index_data.get("memmap"):
+            self._vectors = index_data["vectors"]
+            return True
+
+        path = self._get_vectors_file_path(library_id)
+        if not path.exists():
+            return False
+        self._memmap = MemmapFlatIndex(path).open()
+        # A transposed view keeps the (D, N) layout without reading the file
+        self._vectors = self._memmap.vectors.T
+        return True
+
+    def _sync_chunks(self, chunks: list[Chunk]) -> bool:
+        """Apply chunk inserts, updates and deletes since the index was saved.
+
+        Chunks of documents updated since then are re-added so their rows carry
+        the current document attributes.
+        """
+        stored = self._versions(self._chunks)
+        current = self._versions(chunks)
+        document_versions = self._versions(self._documents.values())
+        changed_documents = {
+            document_id
+            for document_id, version in document_versions.items()
+            if self._document_versions.get(document_id) != version
+        }
+        stale_ids = [
+            chunk.id
+            for chunk in self._chunks
+            if chunk.id not in current
+            or current[chunk.id] != stored[chunk.id]
+            or chunk.document_id in changed_documents
+        ]
+        stale_set = set(stale_ids)
+        new_chunks = [c for c in chunks if c.id not in stored or c.id in stale_set]
+
+        self._remove_rows(stale_ids)
+        self._append_chunks(new_chunks)
+        changed = bool(stale_ids or new_chunks)
+        changed |= self._document_versions != document_versions
+        self._document_versions = document_versions
+        return changed
 
     def _build_index(self, chunks: list[Chunk]):
         """Build the index from chunks."""
         self._chunks = chunks
+        self._attributes = AttributeStore.from_items(chunks, self._documents)
+        self._document_versions = self._versions(self._documents.values())
+        self._memmap = None
         if chunks:
             raw_vectors = self._chunks_to_vectors(chunks)
             self._vectors = self.flat_index.fit(raw_vectors)
-            self._rebuild_index_map()
+        else:
+            self._vectors = None
+        self._rebuild_index_map()
 
     def _save_current_index(self):
         """Save the current index state to disk."""
         if self._current_library_id:
             from datetime import datetime
 
+            vectors_file = self._get_vectors_file_path(self._current_library_id)
+            memmap = (
+                self.memmap_min_rows is not None
+                and self._vectors is not None
+                and len(self._chunks) >= self.memmap_min_rows
+            )
+            if memmap:
+                self._memmap = MemmapFlatIndex(vectors_file).write(self._vectors.T)
+                self._vectors = self._memmap.vectors.T
+            else:
+                self._memmap = None
+                vectors_file.unlink(missing_ok=True)
+
             data = {
                 "chunks": self._chunks,
-                "vectors": self._vectors,
+                "vectors": None if memmap else self._vectors,
+                "memmap": memmap,
                 "chunk_to_index_map": self._chunk_to_index_map,
+                "attributes": self._attributes,
+                "document_versions": self._document_versions,
                 "num_vectors": len(self._chunks),
                 "vector_dimension": self._vectors.shape[0]
                 if self._vectors is not None
@@ -161,19 +383,62 @@ class PersistentFlatIndex(PersistentVectorIndex):
             }
             self._save_index_data(self._current_library_id, "flat", data)
 
-    def search_chunks(self, query_vector: np.ndarray, k: int = 5) -> list[Chunk]:
-        """Search for similar chunks."""
-        if self._vectors is None:
-            return []
+    def scan_chunks(
+        self,
+        query_vector: np.ndarray,
+        mask: np.ndarray | None = None,
+        min_score: float | None = None,
+    ) -> "ChunkScan":
+        """Score the index once and return the chunks as a resumable ranking."""
+        if self._memmap is not None:
+            return ChunkScan(
+                self._memmap.scan(query_vector, mask, min_score), self._chunks
+            )
+        return ChunkScan(
+            self.flat_index.scan(query_vector, self._vectors, mask, min_score),
+            self._chunks,
+        )
 
-        indices = self.flat_index.search(query_vector, self._vectors, k=k)
-        return [self._chunks[i] for i in indices if i < len(self._chunks)]
+    def range_chunks(
+        self,
+        query_vector: np.ndarray,
+        radius: float,
+        mask: np.ndarray | None = None,
+    ) -> Iterator[list[tuple[Chunk, float]]]:
+        """Yield batches of every chunk with similarity >= radius, best first."""
+        if self._memmap is not None:
+            return self._chunk_batches(
+                self._memmap.range_search(query_vector, radius, mask)
+            )
+        return self._chunk_batches(
+            self.flat_index.range_search(query_vector, self._vectors, radius, mask)
+        )
 
     def add_chunks(self, chunks: list[Chunk]):
         """Add new chunks to the index."""
         if not chunks:
             return
 
+        self._append_chunks(chunks)
+
+        # Save updated index
+        self._save_current_index()
+
+    def remove_chunks(self, chunk_ids: list[UUID]):
+        """Remove chunks from the index."""
+        if not chunk_ids:
+            return
+
+        self._remove_rows(chunk_ids)
+
+        # Save updated index
+        self._save_current_index()
+
+    def _append_chunks(self, chunks: list[Chunk]):
+        """Append chunks as new rows of the vectors and attribute store."""
+        if not chunks:
+            return
+
         start_index = len(self._chunks)
         self._chunks.extend(chunks)
 
@@ -185,48 +450,48 @@ class PersistentFlatIndex(PersistentVectorIndex):
         new_vectors = self._chunks_to_vectors(chunks)
         new_processed_vectors = self.flat_index.fit(new_vectors)
 
+        # The stacked vectors live in memory until the next save maps them again
+        self._memmap = None
         if self._vectors is None:
             self._vectors = new_processed_vectors
         else:
             self._vectors = np.hstack([self._vectors, new_processed_vectors])
 
-        # Save updated index
-        self._save_current_index()
+        self._attributes.add_items(chunks, self._documents)
 
-    def remove_chunks(self, chunk_ids: list[UUID]):
-        """Remove chunks from the index."""
-        if not chunk_ids:
+    def _remove_rows(self, chunk_ids: list[UUID]):
+        """Drop the rows of the given chunks, keeping the other rows in order."""
+        rows = [
+            self._chunk_to_index_map[chunk_id]
+            for chunk_id in chunk_ids
+            if chunk_id in self._chunk_to_index_map
+        ]
+        if not rows:
             return
 
-        chunk_ids_set = set(chunk_ids)
-
-        # Remove chunks
-        self._chunks = [c for c in self._chunks if c.id not in chunk_ids_set]
-
-        # Rebuild vectors and mappings
-        if self._chunks:
-            raw_vectors = self._chunks_to_vectors(self._chunks)
-            self._vectors = self.flat_index.fit(raw_vectors)
-            self._rebuild_index_map()
-        else:
-            self._vectors = None
-            self._chunk_to_index_map = {}
-
-        # Save updated index
-        self._save_current_index()
+        keep = np.ones(len(self._chunks), dtype=bool)
+        keep[rows] = False
+        self._chunks = [c for c, kept in zip(self._chunks, keep, strict=True) if kept]
+        self._vectors = self._vectors[:, keep] if self._chunks else None
+        self._memmap = None
+        self._attributes.remove_rows(np.array(rows))
+        self._rebuild_index_map()
 
     def delete_index(self, library_id: UUID):
         """Delete the index for a library."""
         self._delete_index_files(library_id, "flat")
+        self._get_vectors_file_path(library_id).unlink(missing_ok=True)
         if self._current_library_id == library_id:
             self._chunks = []
             self._vectors = None
+            self._memmap = None
             self._chunk_to_index_map = {}
+            self._attributes = AttributeStore()
             self._current_library_id = None
 
     def _chunks_to_vectors(self, chunks: list[Chunk]) -> np.ndarray:
         """Convert chunks to vector array."""
-        return np.array([np.frombuffer(chunk.embedding) for chunk in chunks])
+        return chunks_to_vectors(chunks)
 
     def _rebuild_index_map(self):
         """Rebuild the chunk to index mapping."""
@@ -248,18 +513,42 @@ class PersistentIVFIndex(PersistentVectorIndex):
         self.ivf = IVF(n_clusters=n_partitions, max_iters=max_iters)
         self._current_library_id = None
         self._chunks = []
+        self._attributes = AttributeStore()
+        self._documents = {}
 
-    def load_or_create_index(self, library_id: UUID, chunks: list[Chunk]):
+    def empty_like(self) -> "PersistentIVFIndex":
+        """Return an unloaded index with the same storage and partitioning."""
+        return PersistentIVFIndex(
+            str(self.storage_path), self.n_partitions, self.max_iters
+        )
+
+    def load_or_create_index(
+        self,
+        library_id: UUID,
+        chunks: list[Chunk],
+        documents: list[Document] | None = None,
+    ):
         """Load existing index or create new one for the library."""
         self._current_library_id = library_id
+        self._documents = {document.id: document for document in documents or []}
 
         # Try to load existing index
         index_data = self._load_index_data(library_id, "ivf")
 
-        if index_data and self._is_index_valid(index_data, chunks):
+        if (
+            index_data
+            and self._is_index_valid(index_data, chunks)
+            # Indexes saved before IVF kept its vectors cannot rank candidates
+            and getattr(index_data["ivf_model"], "vectors", None) is not None
+            # Indexes saved before IVF kept quantized lists hold float vectors
+            and index_data["ivf_model"].vectors.dtype
+            == EMBEDDING_DTYPES[embedding_type_of(chunks[0])]
+            and "attributes" in index_data
+        ):
             # Load existing index
             self._chunks = index_data["chunks"]
             self.ivf = index_data["ivf_model"]
+            self._attributes = index_data["attributes"]
             logger.info(f"Loaded existing IVF index for library {library_id}")
         else:
             # Create new index
@@ -267,17 +556,10 @@ class PersistentIVFIndex(PersistentVectorIndex):
             self._save_current_index()
             logger.info(f"Created new IVF index for library {library_id}")
 
-    def _is_index_valid(
-        self, index_data: dict[str, Any], current_chunks: list[Chunk]
-    ) -> bool:
-        """Check if the loaded index is still valid for the current chunks."""
-        stored_chunk_ids = {chunk.id for chunk in index_data.get("chunks", [])}
-        current_chunk_ids = {chunk.id for chunk in current_chunks}
-        return stored_chunk_ids == current_chunk_ids
-
     def _build_index(self, chunks: list[Chunk]):
         """Build the index from chunks."""
         self._chunks = chunks
+        self._attributes = AttributeStore.from_items(chunks, self._documents)
         if chunks:
             vectors = self._chunks_to_vectors(chunks)
             self.ivf.fit(vectors)
@@ -291,6 +573,8 @@ class PersistentIVFIndex(PersistentVectorIndex):
             data = {
                 "chunks": self._chunks,
                 "ivf_model": self.ivf,
+                "attributes": self._attributes,
+                "document_versions": self._versions(self._documents.values()),
                 "num_vectors": len(self._chunks),
                 "vector_dimension": self._chunks[0].embedding.__len__()
                 if self._chunks
@@ -300,14 +584,29 @@ class PersistentIVFIndex(PersistentVectorIndex):
             }
             self._save_index_data(self._current_library_id, "ivf", data)
 
-    def search_chunks(self, query_vector: np.ndarray, k: int = 5) -> list[Chunk]:
-        """Search for similar chunks."""
-        if not self._chunks:
-            return []
+    def scan_chunks(
+        self,
+        query_vector: np.ndarray,
+        mask: np.ndarray | None = None,
+        min_score: float | None = None,
+    ) -> "ChunkScan":
+        """Start a resumable IVF search that probes further lists on demand."""
+        return ChunkScan(
+            self.ivf.scan(query_vector, mask, min_score),
+            self._chunks,
+        )
+
+    def range_chunks(
+        self,
+        query_vector: np.ndarray,
+        radius: float,
+        mask: np.ndarray | None = None,
+    ) -> Iterator[list[tuple[Chunk, float]]]:
+        """Yield batches of every chunk with similarity >= radius, best first.
 
-        indices = self.ivf.search(query_vector)
-        result_chunks = [self._chunks[i] for i in indices if i < len(self._chunks)]
-        return result_chunks[:k]
+        Only lists whose centroid bound can reach the radius are scanned.
+        """
+        return self._chunk_batches(self.ivf.range_search(query_vector, radius, mask))
 
     def add_chunks(self, chunks: list[Chunk]):
         """Add new chunks to the index."""
@@ -332,6 +631,7 @@ class PersistentIVFIndex(PersistentVectorIndex):
             self._build_index(self._chunks)
         else:
             self.ivf = IVF(n_clusters=self.n_partitions, max_iters=self.max_iters)
+            self._attributes = AttributeStore()
 
         self._save_current_index()
 
@@ -341,8 +641,89 @@ class PersistentIVFIndex(PersistentVectorIndex):
         if self._current_library_id == library_id:
             self._chunks = []
             self.ivf = IVF(n_clusters=self.n_partitions, max_iters=self.max_iters)
+            self._attributes = AttributeStore()
             self._current_library_id = None
 
     def _chunks_to_vectors(self, chunks: list[Chunk]) -> np.ndarray:
         """Convert chunks to vector array."""
-        return np.array([np.frombuffer(chunk.embedding) for chunk in chunks])
+        return chunks_to_vectors(chunks)
+
+
+class ChunkScan:
+    """Resumable kernel scan whose rows are resolved to chunks.
+
+    Wraps a ``RankedScan`` or ``IVFScan``; every ``next`` call continues where
+    the previous one stopped.
+    """
+
+    def __init__(self, scan: RankedScan | IVFScan, chunks: list[Chunk]):
+        """Bind a kernel scan to the chunks its rows index into."""
+        self.scan = scan
+        self.chunks = chunks
+
+    @property
+    def exhausted(self) -> bool:
+        """Whether the scan has no more chunks to return."""
+        return self.scan.exhausted
+
+    @property
+    def ordered(self) -> bool:
+        """Whether chunks are returned in global score order."""
+        return self.scan.ordered
+
+    def probe_all(self):
+        """Score every candidate row before the next batch is returned."""
+        self.scan.probe_all()
+
+    def next(self, k: int) -> list[tuple[Chunk, float]]:
+        """Return the next k chunks with their similarities, best first."""
+        indices, scores = self.scan.next(k)
+        return [
+            (self.chunks[i], float(score))
+            for i, score in zip(indices, scores, strict=True)
+            if i < len(self.chunks)
+        ]
+
+
+class FilteredChunkScan:
+    """Chunk scan that drops chunks rejected by a filter, fetching in batches.
+
+    Used to post-filter an unmasked scan: each fetch pulls ``batch_size`` more
+    chunks and keeps those ``keep`` accepts until enough are pending.
+    """
+
+    def __init__(
+        self,
+        scan: ChunkScan,
+        keep: Callable[[list[Chunk]], list[Chunk]],
+        batch_size: int,
+    ):
+        """Wrap a chunk scan with a batch filter."""
+        self.scan = scan
+        self.keep = keep
+        self.batch_size = batch_size
+        self._pending: list[tuple[Chunk, float]] = []
+
+    @property
+    def exhausted(self) -> bool:
+        """Whether the scan has no more chunks passing the filter."""
+        return not self._pending and self.scan.exhausted
+
+    @property
+    def ordered(self) -> bool:
+        """Whether chunks are returned in global score order."""
+        return self.scan.ordered
+
+    def fetch(self) -> int:
+        """Pull one batch from the scan and return the pending chunk count."""
+        scored = self.scan.next(self.batch_size)
+        kept = {chunk.id for chunk in self.keep([chunk for chunk, _ in scored])}
+        self._pending.extend(pair for pair in scored if pair[0].id in kept)
+        return len(self._pending)
+
+    def next(self, k: int) -> list[tuple[Chunk, float]]:
+        """Return the next k chunks passing the filter."""
+        while len(self._pending) < k and not self.scan.exhausted:
+            self.fetch()
+        batch, self._pending = self._pending[:k], self._pending[k:]
+        return batch
@@ -0,0 +1,63 @@
+"""Compact embedding formats returned natively by the embedding provider."""
+
+from typing import Literal
+
+import numpy as np
+
+from app.models.chunk import Chunk
+
+EmbeddingType = Literal["float", "int8", "ubinary"]
+
+# Storage dtype of each embedding type. ``ubinary`` vectors are packed bits, so a
+# D-dimensional embedding is stored in D / 8 bytes.
+EMBEDDING_DTYPES: dict[str, type[np.generic]] = {
+    "float": np.float64,
+    "int8": np.int8,
+    "ubinary": np.uint8,
+}
+
+# Output dimensions supported by embed-v4.0.
+SUPPORTED_DIMENSIONS = (256, 512, 1024, 1536)
+
+
+def embedding_type_of(chunk: Chunk) -> EmbeddingType:
+    """Return the embedding type a chunk was stored with (float for legacy chunks)."""
+    return (chunk.metadata or {}).get("embedding_type", "float")
+
+
+def decode_embedding(
+    embedding: bytes, embedding_type: EmbeddingType = "float"
+) -> np.ndarray:
+    """Decode a stored embedding blob into its numpy representation."""
+    return np.frombuffer(embedding, dtype=EMBEDDING_DTYPES[embedding_type])
+
+
+def chunks_to_vectors(chunks: list[Chunk]) -> np.ndarray:
+    """Convert chunk embeddings to an (N, D) array in their stored dtype.
+
+    Raises ValueError if the chunks were embedded with different types or
+    dimensions, which cannot share one matrix.
+    """
+    vectors = [
+        decode_embedding(chunk.embedding, embedding_type_of(chunk)) for chunk in chunks
+    ]
+    if len({(vector.dtype, vector.shape) for vector in vectors}) > 1:
+        raise ValueError(
+            "Chunks mix embedding types or dimensions; re-embed them with the "
+            "library's current embedding options"
+        )
+    return np.array(vectors)
+
+
+def to_float_vectors(vectors: np.ndarray) -> np.ndarray:
+    """Expand quantized vectors to floats for algorithms that need real values.
+
+    Packed binary vectors are unpacked to +/-1 per bit so that euclidean distance
+    between them is monotonic in their hamming distance.
+    """
+    if vectors.dtype == np.uint8:
+        bits = np.unpackbits(vectors, axis=-1).astype(np.float32)
+        return bits * 2.0 - 1.0
+    if vectors.dtype == np.int8:
+        return vectors.astype(np.float32)
+    return vectors
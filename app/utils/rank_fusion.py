@@ -0,0 +1,41 @@
+"""Combine rankings from several retrievers into one."""
+
+from collections.abc import Hashable
+
+# Rank offset of reciprocal rank fusion; damps the weight of the very top ranks
+RRF_K = 60
+
+
+def reciprocal_rank_fusion(
+    rankings: list[list[Hashable]], k: int = RRF_K
+) -> list[tuple[Hashable, float]]:
+    """Fuse rankings by summing ``1 / (k + rank)`` per item, best first.
+
+    Only ranks are used, so retrievers with incomparable score scales (cosine
+    similarity, BM25) contribute equally.
+    """
+    scores: dict[Hashable, float] = {}
+    for ranking in rankings:
+        for rank, item in enumerate(ranking, start=1):
+            scores[item] = scores.get(item, 0.0) + 1.0 / (k + rank)
+    return sorted(scores.items(), key=lambda entry: entry[1], reverse=True)
+
+
+def weighted_fusion(
+    scored: list[list[tuple[Hashable, float]]], weights: list[float]
+) -> list[tuple[Hashable, float]]:
+    """Fuse scored rankings by a weighted sum of min-max normalized scores.
+
+    Items missing from a ranking get a normalized score of 0 for it.
+    """
+    fused: dict[Hashable, float] = {}
+    for ranking, weight in zip(scored, weights, strict=True):
+        if not ranking:
+            continue
+        values = [score for _, score in ranking]
+        low, high = min(values), max(values)
+        span = high - low
+        for item, score in ranking:
+            normalized = (score - low) / span if span else 1.0
+            fused[item] = fused.get(item, 0.0) + weight * normalized
+    return sorted(fused.items(), key=lambda entry: entry[1], reverse=True)
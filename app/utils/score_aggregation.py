@@ -0,0 +1,48 @@
+"""Aggregate chunk scores into per-document scores."""
+
+from collections.abc import Hashable
+
+import numpy as np
+
+AGGREGATIONS = ("max", "sum", "top_n")
+
+
+def aggregate_scores(
+    keys: list[Hashable], scores: np.ndarray, method: str = "max", top_n: int = 3
+) -> tuple[list[Hashable], np.ndarray, np.ndarray]:
+    """Aggregate scores sharing a key, returning ``(keys, scores, counts)``.
+
+    Rows are sorted by key and by descending score, so every group is one
+    contiguous run and a single ``reduceat`` over the run starts computes the
+    ``max``, the ``sum`` or the sum of the ``top_n`` best scores of all groups.
+    Groups are returned best aggregate first.
+    """
+    scores = np.asarray(scores, dtype=np.float64)
+    if len(scores) == 0:
+        return [], np.empty(0), np.empty(0, dtype=np.int64)
+    if method not in AGGREGATIONS:
+        raise ValueError(f"Unknown score aggregation: {method}")
+
+    unique_keys = list(dict.fromkeys(keys))
+    codes = {key: code for code, key in enumerate(unique_keys)}
+    groups = np.fromiter((codes[key] for key in keys), np.int64, len(keys))
+
+    order = np.lexsort((-scores, groups))
+    grouped_scores = scores[order]
+    starts = np.flatnonzero(np.diff(groups[order], prepend=-1))
+    counts = np.diff(np.append(starts, len(order)))
+
+    match method:
+        case "max":
+            aggregated = np.maximum.reduceat(grouped_scores, starts)
+        case "sum":
+            aggregated = np.add.reduceat(grouped_scores, starts)
+        case _:
+            # Rank of each row within its group, best first
+            ranks = np.arange(len(order)) - np.repeat(starts, counts)
+            aggregated = np.add.reduceat(
+                np.where(ranks < top_n, grouped_scores, 0.0), starts
+            )
+
+    best = np.argsort(-aggregated, kind="stable")
+    return [unique_keys[i] for i in best], aggregated[best], counts[best]
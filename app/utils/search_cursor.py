@@ -0,0 +1,95 @@
+"""Opaque cursors that resume a paged vector search after its last page."""
+
+import base64
+import binascii
+import secrets
+import zlib
+from typing import Literal
+from uuid import UUID
+
+import numpy as np
+from pydantic import BaseModel, Field
+
+from app.models.models import FilterGroup, MetadataFilter
+
+# Largest decompressed cursor accepted, well above any real query vector
+MAX_CURSOR_BYTES = 1 << 20
+
+# Storage dtype of integer query vectors per dtype kind; float queries keep
+# their own precision, so a restarted scan recomputes the exact same scores
+_INTEGER_DTYPES = {"i": "int8", "u": "uint8"}
+
+
+def new_token() -> str:
+    """Return a random key for a live page scan."""
+    return secrets.token_urlsafe(12)
+
+
+class SearchCursor(BaseModel):
+    """Position of a paged vector search after one page of results.
+
+    Holds everything needed to continue the search without the original
+    request: the query vector, the filters and the index it ran on, the last
+    result returned (its score and id), and the generation of the library rows
+    the scan ranked. Results are ordered by descending score, ties by
+    ascending id, so the last result splits returned results from the rest.
+    """
+
+    token: str = Field(default_factory=new_token)
+    library_id: UUID
+    index_type: Literal["ivf", "flat"]
+    granularity: Literal["document", "chunk"]
+    metadata_filters: list[MetadataFilter | FilterGroup] = Field(default_factory=list)
+    min_score: float | None = None
+    vector: str
+    dtype: Literal["float32", "float64", "int8", "uint8"]
+    generation: str
+    score: float | None = None
+    last_id: UUID | None = None
+
+    @classmethod
+    def for_query(cls, vector: np.ndarray, **fields) -> "SearchCursor":
+        """Start a cursor for a query vector."""
+        vector = np.asarray(vector).reshape(-1)
+        dtype = (
+            vector.dtype.name
+            if vector.dtype.kind == "f"
+            else _INTEGER_DTYPES[vector.dtype.kind]
+        )
+        return cls(
+            vector=base64.b64encode(vector.astype(dtype).tobytes()).decode(),
+            dtype=dtype,
+            **fields,
+        )
+
+    def precedes(self, score: float, key: UUID) -> bool:
+        """Whether a result ranks at or before the last result returned."""
+        if self.score is None or self.last_id is None:
+            return False
+        return score > self.score or (score == self.score and key <= self.last_id)
+
+    def query_vector(self) -> np.ndarray:
+        """Decode the query vector the search ranks by."""
+        return np.frombuffer(base64.b64decode(self.vector), dtype=self.dtype)
+
+    def encode(self) -> str:
+        """Serialize the cursor into a URL-safe token."""
+        return base64.urlsafe_b64encode(
+            zlib.compress(self.model_dump_json().encode())
+        ).decode()
+
+    @classmethod
+    def decode(cls, cursor: str) -> "SearchCursor":
+        """Parse a token made by ``encode``, raising ValueError if malformed."""
+        try:
+            decompressor = zlib.decompressobj()
+            data = decompressor.decompress(
+                base64.urlsafe_b64decode(cursor), MAX_CURSOR_BYTES
+            )
+            if decompressor.unconsumed_tail:
+                raise ValueError("cursor too large")
+            decoded = cls.model_validate_json(data)
+            decoded.query_vector()
+        except (binascii.Error, zlib.error, ValueError) as e:
+            raise ValueError("malformed search cursor") from e
+        return decoded
@@ -0,0 +1,310 @@
+"""Translate metadata filters into SQLite WHERE clauses over chunk rows."""
+
+import re
+from typing import Any
+
+from app.models.models import FilterExpression, FilterGroup, MetadataFilter
+from app.utils.attribute_store import (
+    DATE,
+    NUMBER,
+    NUMERIC_STRING,
+    OTHER,
+    classify_value,
+)
+from app.utils.metadata_filter import DOCUMENT_FIELD_PREFIX
+
+# json_type() results that MetadataFilterProcessor compares as numbers
+_NUMERIC_TYPES = "('integer', 'real', 'true', 'false')"
+
+# Built-in chunk attributes backed by a column instead of the metadata JSON
+_TEXT_COLUMNS = {"id": "id", "content": "content"}
+_TIMESTAMP_COLUMNS = {"created_at": "created_at", "updated_at": "updated_at"}
+# Built-in document attributes denormalized onto chunk rows
+_DOCUMENT_TEXT_COLUMNS = {"id": "id", "title": "title"}
+
+# Slack on timestamp bounds so float rounding never drops a matching row
+_TIMESTAMP_EPSILON = 1e-3
+
+_RANGE_SQL = {"gt": ">", "gte": ">=", "lt": "<", "lte": "<="}
+
+HOT_FIELD_PATTERN = re.compile(r"^[A-Za-z_][A-Za-z0-9_]*$")
+
+Clause = tuple[str, list[Any]]
+
+
+def _is_date_only(kind: str, value: Any) -> bool:
+    """Check if a date string cannot also be read as a number."""
+    if kind != DATE:
+        return False
+    try:
+        float(value)
+        return False
+    except ValueError:
+        return True
+
+
+def hot_field_column(field: str) -> str:
+    """Name of the generated column that materializes a hot metadata field."""
+    return f"meta_{field}"
+
+
+def json_path(field: str) -> str:
+    """SQL literal of the JSON path selecting a top-level metadata key."""
+    return "'$.\"{}\"'".format(field.replace("'", "''"))
+
+
+class SQLFilterCompiler:
+    """Compile filter expressions into a WHERE clause selecting candidate chunks.
+
+    The clause is a superset of the rows MetadataFilterProcessor would accept:
+    comparisons that SQLite evaluates exactly the same way (plain-string
+    equality, ``in`` lists, numeric comparisons on JSON numbers, aware
+    ``created_at``/``updated_at`` bounds) are pushed down, while values that
+    Python normalizes first (numeric or date strings) are let through as
+    candidates and anything else is left unconstrained. Callers verify the
+    returned rows with the compiled filter plan.
+
+    Fields a chunk does not have fall back to its document (joined as
+    ``document_alias``), mirroring ``MetadataFilterProcessor.row_attributes``.
+    """
+
+    def __init__(
+        self,
+        alias: str = "c",
+        hot_columns: dict[str, str] | None = None,
+        document_alias: str | None = "d",
+    ):
+        """Initialize the compiler with the table aliases and hot columns."""
+        self.alias = alias
+        self.hot_columns = hot_columns or {}
+        self.document_alias = document_alias
+
+    def compile(self, filters: list[FilterExpression]) -> Clause:
+        """Compile an implicit AND of filters into ``(sql, params)``."""
+        clause = self._all(filters)
+        return clause if clause is not None else ("1", [])
+
+    def _all(self, filters: list[FilterExpression]) -> Clause | None:
+        """AND the translatable clauses; untranslatable ones constrain nothing."""
+        clauses = [
+            clause for clause in map(self._expression, filters) if clause is not None
+        ]
+        if not clauses:
+            return None
+        return self._join(clauses, "AND")
+
+    def _expression(self, expression: FilterExpression) -> Clause | None:
+        """Compile a filter or group, or None if it cannot narrow the rows."""
+        if not isinstance(expression, FilterGroup):
+            return self._leaf(expression)
+
+        match expression.operator:
+            case "and":
+                return self._all(expression.filters)
+            case "or":
+                clauses = [self._expression(child) for child in expression.filters]
+                if not clauses:
+                    return "0", []
+                if any(clause is None for clause in clauses):
+                    return None
+                return self._join(clauses, "OR")
+            case _:
+                # Negating a superset would drop matching rows
+                return None
+
+    def _leaf(self, filter_condition: MetadataFilter) -> Clause | None:
+        """Compile a single filter on a metadata key or built-in column."""
+        field = filter_condition.field
+        if '"' in field or "\\" in field:
+            return None
+
+        metadata = f"{self.alias}.metadata"
+        type_sql = f"json_type({metadata}, {json_path(field)})"
+        value_sql = (
+            f"{self.alias}.{self.hot_columns[field]}"
+            if field in self.hot_columns
+            else f"json_extract({metadata}, {json_path(field)})"
+        )
+        clause = self._metadata_clause(filter_condition, type_sql, value_sql)
+
+        if field in _TEXT_COLUMNS:
+            fallback = self._text_column_clause(
+                filter_condition, f"{self.alias}.{_TEXT_COLUMNS[field]}"
+            )
+        elif field in _TIMESTAMP_COLUMNS:
+            fallback = self._timestamp_clause(
+                filter_condition, f"{self.alias}.{_TIMESTAMP_COLUMNS[field]}"
+            )
+        elif self.document_alias is None:
+            return clause
+        else:
+            fallback = self._document_clause(
+                filter_condition, field.removeprefix(DOCUMENT_FIELD_PREFIX)
+            )
+
+        # Custom metadata overrides the attribute of the same name it shadows
+        return self._shadow(type_sql, clause, fallback)
+
+    def _document_clause(
+        self, filter_condition: MetadataFilter, field: str
+    ) -> Clause | None:
+        """Compile a filter on an attribute of the chunk's document."""
+        if field == "content":
+            # Document content is not denormalized, so the attribute is missing
+            matches_missing = (
+                filter_condition.operator == "ne" and filter_condition.value is not None
+            )
+            return ("1" if matches_missing else "0"), []
+
+        metadata = f"{self.document_alias}.metadata"
+        type_sql = f"json_type({metadata}, {json_path(field)})"
+        value_sql = f"json_extract({metadata}, {json_path(field)})"
+        clause = self._metadata_clause(filter_condition, type_sql, value_sql)
+
+        if field in _DOCUMENT_TEXT_COLUMNS:
+            builtin = self._text_column_clause(
+                filter_condition,
+                f"{self.document_alias}.{_DOCUMENT_TEXT_COLUMNS[field]}",
+            )
+        elif field in _TIMESTAMP_COLUMNS:
+            builtin = self._timestamp_clause(
+                filter_condition, f"{self.document_alias}.{_TIMESTAMP_COLUMNS[field]}"
+            )
+        else:
+            return clause
+        return self._shadow(type_sql, clause, builtin)
+
+    @staticmethod
+    def _shadow(
+        type_sql: str, clause: Clause | None, fallback: Clause | None
+    ) -> Clause | None:
+        """Use the metadata clause where the key is set, else the fallback."""
+        if clause is None and fallback is None:
+            return None
+        fallback_sql, fallback_params = fallback or ("1", [])
+        clause_sql, clause_params = clause or ("1", [])
+        return (
+            f"(CASE WHEN {type_sql} IS NULL THEN {fallback_sql} ELSE {clause_sql} END)",
+            fallback_params + clause_params,
+        )
+
+    def _metadata_clause(
+        self, filter_condition: MetadataFilter, type_sql: str, value_sql: str
+    ) -> Clause | None:
+        """Compile a filter on a JSON metadata value."""
+        operator = filter_condition.operator
+        value = filter_condition.value
+        kind, number, _ = classify_value(value)
+        # Bind numbers as given so large integers keep their precision
+        number = value if kind == NUMBER else number
+        text_match = f"{type_sql} = 'text'"
+
+        match operator:
+            case "eq" if kind == OTHER and isinstance(value, str):
+                return f"({text_match} AND {value_sql} = ?)", [value]
+            case "eq" if kind in (NUMBER, NUMERIC_STRING):
+                return (
+                    f"(({type_sql} IN {_NUMERIC_TYPES} AND {value_sql} = ?) "
+                    f"OR {text_match})",
+                    [number],
+                )
+            case "eq" if _is_date_only(kind, value):
+                return f"({text_match})", []
+            case "ne" if value is None:
+                return f"({type_sql} IS NOT NULL AND {type_sql} != 'null')", []
+            case "ne" if kind == OTHER and isinstance(value, str):
+                return (
+                    f"({type_sql} IS NULL OR {type_sql} != 'text' OR {value_sql} != ?)",
+                    [value],
+                )
+            case "in":
+                return self._in_clause(value, type_sql, value_sql)
+            case "gt" | "gte" | "lt" | "lte" if kind in (NUMBER, NUMERIC_STRING):
+                return (
+                    f"(({type_sql} IN {_NUMERIC_TYPES} "
+                    f"AND {value_sql} {_RANGE_SQL[operator]} ?) OR {text_match})",
+                    [number],
+                )
+            case "gt" | "gte" | "lt" | "lte" if _is_date_only(kind, value):
+                # Numbers never compare with a date string; text values may
+                return f"({text_match})", []
+            case _:
+                return None
+
+    def _in_clause(self, members: Any, type_sql: str, value_sql: str) -> Clause | None:
+        """Compile an ``in`` filter, which compares raw values without parsing."""
+        if not isinstance(members, list | tuple | set):
+            return "0", []
+
+        texts, numbers = [], []
+        for member in members:
+            if member is None:
+                continue
+            if isinstance(member, str):
+                texts.append(member)
+            elif isinstance(member, bool | int | float):
+                numbers.append(member)
+            else:
+                return None
+
+        parts, params = [], []
+        if texts:
+            placeholders = ", ".join("?" * len(texts))
+            parts.append(f"({type_sql} = 'text' AND {value_sql} IN ({placeholders}))")
+            params.extend(texts)
+        if numbers:
+            placeholders = ", ".join("?" * len(numbers))
+            parts.append(
+                f"({type_sql} IN {_NUMERIC_TYPES} AND {value_sql} IN ({placeholders}))"
+            )
+            params.extend(numbers)
+        if not parts:
+            return "0", []
+        return f"({' OR '.join(parts)})", params
+
+    def _text_column_clause(
+        self, filter_condition: MetadataFilter, column: str
+    ) -> Clause | None:
+        """Compile a filter on a non-null text column such as the chunk id."""
+        value = filter_condition.value
+        match filter_condition.operator:
+            case "eq" | "ne" if (
+                isinstance(value, str) and classify_value(value)[0] == OTHER
+            ):
+                operator = "=" if filter_condition.operator == "eq" else "!="
+                return f"({column} {operator} ?)", [value]
+            case "in" if isinstance(value, list | tuple | set):
+                texts = [member for member in value if isinstance(member, str)]
+                if not texts:
+                    return "0", []
+                return f"({column} IN ({', '.join('?' * len(texts))}))", texts
+            case _:
+                return None
+
+    def _timestamp_clause(
+        self, filter_condition: MetadataFilter, column: str
+    ) -> Clause | None:
+        """Compile a range filter on an epoch-seconds timestamp column.
+
+        The attribute is an aware ISO datetime, so naive bounds never match.
+        """
+        operator = filter_condition.operator
+        if operator not in _RANGE_SQL:
+            return None
+        kind, _, date = classify_value(filter_condition.value)
+        if not _is_date_only(kind, filter_condition.value):
+            return None
+        if date.tzinfo is None:
+            return "0", []
+
+        bound = date.timestamp()
+        if operator in ("gt", "gte"):
+            return f"({column} >= ?)", [bound - _TIMESTAMP_EPSILON]
+        return f"({column} <= ?)", [bound + _TIMESTAMP_EPSILON]
+
+    @staticmethod
+    def _join(clauses: list[Clause], operator: str) -> Clause:
+        """Combine clauses with AND/OR, concatenating their parameters."""
+        sql = f" {operator} ".join(clause for clause, _ in clauses)
+        params = [param for _, clause_params in clauses for param in clause_params]
+        return f"({sql})", params
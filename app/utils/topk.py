@@ -0,0 +1,70 @@
+"""Partial top-k selection helpers shared by the search kernels."""
+
+import numpy as np
+
+
+def top_k(scores: np.ndarray, k: int) -> tuple[np.ndarray, np.ndarray]:
+    """Return positions and values of the k highest scores, best first.
+
+    Uses ``argpartition`` so only the selected k values are sorted.
+    """
+    k = min(k, len(scores))
+    if k <= 0:
+        return np.empty(0, dtype=np.int64), np.empty(0, dtype=scores.dtype)
+
+    if k < len(scores):
+        candidates = np.argpartition(scores, -k)[-k:]
+    else:
+        candidates = np.arange(len(scores))
+    order = candidates[np.argsort(-scores[candidates], kind="stable")]
+    return order, scores[order]
+
+
+def merge_top_k(
+    indices: np.ndarray,
+    scores: np.ndarray,
+    new_indices: np.ndarray,
+    new_scores: np.ndarray,
+    k: int,
+) -> tuple[np.ndarray, np.ndarray]:
+    """Merge a batch of scored rows into a running top-k."""
+    all_indices = np.concatenate([indices, new_indices])
+    all_scores = np.concatenate([scores, new_scores])
+    positions, best_scores = top_k(all_scores, k)
+    return all_indices[positions], best_scores
+
+
+class RankedScan:
+    """Scored rows handed out best first in successive batches.
+
+    Scoring happens once up front; each ``next`` call only selects among the
+    rows not returned yet, so asking for more results resumes the ranking
+    instead of rescoring every row.
+    """
+
+    def __init__(self, rows: np.ndarray, scores: np.ndarray):
+        """Take ownership of the candidate rows and their scores."""
+        self._rows = rows
+        self._scores = np.asarray(scores, dtype=np.float64).copy()
+        self.remaining = len(rows)
+
+    @property
+    def exhausted(self) -> bool:
+        """Whether every row has been returned."""
+        return self.remaining == 0
+
+    @property
+    def ordered(self) -> bool:
+        """Rows are always returned in score order."""
+        return True
+
+    def probe_all(self):
+        """Every row is scored up front; nothing to probe."""
+
+    def next(self, k: int) -> tuple[np.ndarray, np.ndarray]:
+        """Return the k best rows not returned yet, with their scores."""
+        positions, scores = top_k(self._scores, min(k, self.remaining))
+        # Returned rows sink below any real score
+        self._scores[positions] = -np.inf
+        self.remaining -= len(positions)
+        return self._rows[positions], scores
@@ -90,7 +90,7 @@ class TestEndToEnd:
             response = client.post("/search", json=search_data)
             assert response.status_code == 200
 
-            result = response.json()
+            result = response.json()["results"]
             assert len(result) > 0
             first_result = result[0]
             assert "document" in first_result
@@ -136,7 +136,7 @@ class TestEndToEnd:
             }
             response = client.post("/search", json=search_data)
             assert response.status_code == 200
-            result = response.json()
+            result = response.json()["results"]
             assert len(result) > 0
             first_result = result[0]
             assert "document" in first_result
@@ -1,8 +1,18 @@
 import numpy as np
+import pytest
 
 from app.embeddings import Embedder
+from app.exceptions import ValidationError
+from app.utils.bm25 import BM25Index
+from app.utils.example_query import example_query
 from app.utils.flat_index import FlatIndex
 from app.utils.ivf import IVF
+from app.utils.mmap_index import MemmapFlatIndex
+from app.utils.mmr import mmr
+from app.utils.quantization import chunks_to_vectors, to_float_vectors
+from app.utils.rank_fusion import reciprocal_rank_fusion, weighted_fusion
+from app.utils.score_aggregation import aggregate_scores
+from tests.conftest import create_test_chunk
 
 
 class TestFlatIndex:
@@ -19,6 +29,243 @@ class TestFlatIndex:
         assert all(isinstance(idx, int) for idx in results)
         assert all(0 <= idx < 5 for idx in results)
 
+    def test_int8_search_matches_float_ranking(self):
+        np.random.seed(0)
+        vectors = np.random.randint(-128, 128, (50, 16)).astype(np.int8)
+        query = vectors[7]
+
+        flat_index = FlatIndex()
+        int8_results = flat_index.search(query, flat_index.fit(vectors), k=5)
+        float_results = flat_index.search(
+            query.astype(np.float64), flat_index.fit(vectors.astype(np.float64)), k=5
+        )
+
+        assert int8_results[0] == 7
+        assert int8_results == float_results
+
+    def test_ubinary_search_uses_hamming_distance(self):
+        bits = np.zeros((4, 16), dtype=np.uint8)
+        bits[1, :2] = 1
+        bits[2, :8] = 1
+        bits[3, :] = 1
+        vectors = np.packbits(bits, axis=1)
+
+        flat_index = FlatIndex()
+        packed = flat_index.fit(vectors)
+        similarities = flat_index.similarities(vectors[0], packed)
+
+        assert flat_index.search(vectors[0], packed, k=4) == [0, 1, 2, 3]
+        assert similarities.tolist() == [1.0, 0.75, 0.0, -1.0]
+
+    def test_min_score_drops_dissimilar_vectors(self):
+        np.random.seed(0)
+        vectors = np.random.normal(size=(30, 8))
+        query = vectors[4]
+
+        flat_index = FlatIndex()
+        packed = flat_index.fit(vectors)
+        similarities = flat_index.similarities(query, packed)
+        rows, scores = flat_index.search_with_scores(query, packed, k=30, min_score=0.2)
+
+        assert rows[0] == 4
+        assert scores[0] == pytest.approx(1.0)
+        assert sorted(rows.tolist()) == np.flatnonzero(similarities >= 0.2).tolist()
+        assert np.allclose(scores, similarities[rows])
+
+    def test_scan_resumes_ranking(self):
+        np.random.seed(1)
+        vectors = np.random.normal(size=(40, 8))
+        query = np.random.normal(size=8)
+
+        flat_index = FlatIndex()
+        packed = flat_index.fit(vectors)
+        expected, _ = flat_index.search_with_scores(query, packed, k=40)
+        scan = flat_index.scan(query, packed)
+        batches = [scan.next(5)[0], scan.next(15)[0], scan.next(50)[0]]
+
+        assert np.concatenate(batches).tolist() == expected.tolist()
+        assert [len(batch) for batch in batches] == [5, 15, 20]
+        assert scan.exhausted
+
+    def test_range_search_streams_all_rows_above_radius(self):
+        np.random.seed(2)
+        vectors = np.random.normal(size=(100, 8))
+        query = vectors[0]
+
+        flat_index = FlatIndex()
+        packed = flat_index.fit(vectors)
+        similarities = flat_index.similarities(query, packed)
+        batches = list(flat_index.range_search(query, packed, 0.3, batch_size=4))
+        rows = np.concatenate([batch for batch, _ in batches])
+
+        assert len(batches) > 1
+        assert sorted(rows.tolist()) == np.flatnonzero(similarities >= 0.3).tolist()
+        assert similarities[rows].tolist() == sorted(similarities[rows], reverse=True)
+
+
+class TestMemmapFlatIndex:
+    def test_streamed_search_matches_flat_index(self, tmp_path):
+        np.random.seed(3)
+        vectors = np.random.normal(size=(1000, 12))
+        query = np.random.normal(size=12)
+
+        index = MemmapFlatIndex(tmp_path / "vectors.npy", tile_size=128)
+        index.write(vectors)
+        results = index.search(query, k=10)
+
+        flat_index = FlatIndex()
+        expected = flat_index.search(query, flat_index.fit(vectors), k=10)
+        assert len(index) == 1000
+        assert results == expected
+
+    def test_filtered_scan_matches_flat_index(self, tmp_path):
+        np.random.seed(3)
+        vectors = np.random.normal(size=(1000, 12))
+        query = np.random.normal(size=12)
+        mask = np.random.random(1000) < 0.3
+
+        index = MemmapFlatIndex(tmp_path / "vectors.npy", tile_size=128)
+        index.write(vectors)
+        rows, scores = index.scan(query, mask, min_score=0.2).next(1000)
+
+        flat_index = FlatIndex()
+        expected = flat_index.scan(query, flat_index.fit(vectors), mask, 0.2)
+        expected_rows, expected_scores = expected.next(1000)
+        assert rows.tolist() == expected_rows.tolist()
+        assert scores == pytest.approx(expected_scores)
+
+
+class TestBM25Index:
+    def test_ranks_exact_terms_first(self):
+        index = BM25Index()
+        index.add("a", "The error code ERR_4012 is raised on timeout")
+        index.add("b", "Timeouts are retried with exponential backoff")
+        index.add("c", "Unrelated text about embeddings")
+
+        results = index.search("err_4012 timeout")
+        assert [doc_id for doc_id, _ in results] == ["a"]
+        assert index.search("embeddings", k=1)[0][0] == "c"
+        assert index.search("missing") == []
+
+    def test_incremental_updates_match_rebuild(self):
+        texts = {i: f"chunk {i} about {'cats' if i % 3 else 'dogs'}" for i in range(9)}
+        index = BM25Index()
+        for doc_id, text in texts.items():
+            index.add(doc_id, text)
+        index.remove(0)
+        index.add(4, "dogs dogs dogs")
+        texts.pop(0)
+        texts[4] = "dogs dogs dogs"
+
+        rebuilt = BM25Index()
+        for doc_id, text in texts.items():
+            rebuilt.add(doc_id, text)
+        assert len(index) == 8
+        assert index.search("dogs cats") == pytest.approx(rebuilt.search("dogs cats"))
+
+
+class TestRankFusion:
+    def test_reciprocal_rank_fusion_rewards_agreement(self):
+        fused = reciprocal_rank_fusion([["a", "b", "c"], ["b", "d"]], k=60)
+        assert [item for item, _ in fused] == ["b", "a", "d", "c"]
+
+    def test_weighted_fusion_normalizes_scores(self):
+        fused = weighted_fusion(
+            [[("a", 0.9), ("b", 0.5)], [("b", 12.0), ("c", 2.0)]], [0.3, 0.7]
+        )
+        assert dict(fused) == pytest.approx({"b": 0.7, "a": 0.3, "c": 0.0})
+
+
+class TestScoreAggregation:
+    keys = ["a", "b", "a", "c", "b", "a"]
+    scores = np.array([0.9, 0.8, 0.1, 0.7, 0.6, 0.5])
+
+    @pytest.mark.parametrize(
+        "method,expected",
+        [
+            ("max", {"a": 0.9, "b": 0.8, "c": 0.7}),
+            ("sum", {"a": 1.5, "b": 1.4, "c": 0.7}),
+            ("top_n", {"a": 1.4, "b": 1.4, "c": 0.7}),
+        ],
+    )
+    def test_aggregates_per_key(self, method, expected):
+        keys, scores, counts = aggregate_scores(self.keys, self.scores, method, 2)
+
+        assert dict(zip(keys, scores, strict=True)) == pytest.approx(expected)
+        assert dict(zip(keys, counts.tolist(), strict=True)) == {"a": 3, "b": 2, "c": 1}
+        assert list(scores) == sorted(scores, reverse=True)
+
+    def test_empty_and_unknown_method(self):
+        assert aggregate_scores([], np.empty(0))[0] == []
+        with pytest.raises(ValueError):
+            aggregate_scores(self.keys, self.scores, "median")
+
+
+class TestMMR:
+    vectors = np.array([[1.0, 0.0], [0.99, 0.05], [0.6, 0.8], [0.0, 1.0]])
+    relevance = np.array([0.95, 0.94, 0.7, 0.05])
+
+    def test_zero_diversity_keeps_relevance_order(self):
+        assert list(mmr(self.relevance, self.vectors, diversity=0.0)) == [0, 1, 2, 3]
+
+    def test_near_duplicates_give_way_to_distinct_vectors(self):
+        order = list(mmr(self.relevance, self.vectors, diversity=0.5))
+
+        assert order[:2] == [0, 2]
+        assert sorted(order) == [0, 1, 2, 3]
+
+    def test_quantized_vectors(self):
+        bits = np.packbits(
+            np.array([[1] * 8, [1] * 8, [0] * 8], dtype=np.uint8), axis=1
+        )
+        assert list(mmr(np.array([0.9, 0.9, 0.5]), bits, diversity=0.7)) == [0, 2, 1]
+
+
+class TestExampleQuery:
+    def test_examples_weigh_equally_regardless_of_norm(self):
+        query = example_query(np.array([[10.0, 0.0], [0.0, 1.0]]))
+
+        np.testing.assert_allclose(query, [np.sqrt(0.5), np.sqrt(0.5)])
+
+    def test_negative_examples_move_query_away(self):
+        positive = np.array([[1.0, 1.0]])
+        negative = np.array([[0.0, 1.0]])
+
+        query = example_query(positive, negative, negative_weight=0.5)
+
+        assert query @ negative[0] < positive[0] @ negative[0] / np.sqrt(2)
+        assert np.linalg.norm(query) == pytest.approx(1.0)
+
+    def test_cancelling_examples_raise(self):
+        with pytest.raises(ValueError):
+            example_query(np.array([[1.0, 0.0]]), np.array([[2.0, 0.0]]), 1.0)
+
+
+class TestQuantization:
+    def test_chunks_to_vectors_decodes_stored_type(self):
+        int8_chunk = create_test_chunk(0)
+        int8_chunk.embedding = np.arange(-4, 4, dtype=np.int8).tobytes()
+        int8_chunk.metadata = {"embedding_type": "int8"}
+
+        vectors = chunks_to_vectors([int8_chunk])
+
+        assert vectors.dtype == np.int8
+        assert vectors.tolist() == [list(range(-4, 4))]
+
+    def test_chunks_to_vectors_rejects_mixed_embeddings(self):
+        float_chunk = create_test_chunk(0)
+        int8_chunk = create_test_chunk(1)
+        int8_chunk.embedding = np.arange(-4, 4, dtype=np.int8).tobytes()
+        int8_chunk.metadata = {"embedding_type": "int8"}
+
+        with pytest.raises(ValueError, match="re-embed"):
+            chunks_to_vectors([float_chunk, int8_chunk])
+
+    def test_to_float_vectors_unpacks_binary(self):
+        packed = np.packbits(np.array([[1, 0, 1, 0, 0, 0, 0, 1]], dtype=np.uint8))
+
+        assert to_float_vectors(packed).tolist() == [1, -1, 1, -1, -1, -1, -1, 1]
+
 
 class TestIVFIndex:
     def test_search_basic_functionality(self):
@@ -41,6 +288,124 @@ class TestIVFIndex:
         assert all(isinstance(idx, int | np.integer) for idx in result)
         assert result == list(range(20))
 
+    def _clustered_dataset(self):
+        np.random.seed(42)
+        cluster1 = np.random.normal([0, 0], 0.5, (20, 2))
+        cluster2 = np.random.normal([5, 5], 0.5, (20, 2))
+        cluster3 = np.random.normal([10, 0], 0.5, (20, 2))
+        return np.vstack([cluster1, cluster2, cluster3])
+
+    def test_ubinary_scores_match_flat_index(self):
+        np.random.seed(0)
+        packed = np.packbits(np.random.randint(0, 2, (12, 64)), axis=1).astype(np.uint8)
+        query = packed[0]
+
+        ivf = IVF(n_clusters=1)
+        ivf.fit(packed)
+        ivf.create_index(packed)
+        rows, scores = ivf.search_with_scores(query, k=12)
+
+        flat_index = FlatIndex()
+        expected = flat_index.similarities(query, flat_index.fit(packed))
+        assert scores == pytest.approx(expected[rows])
+
+    def test_lists_keep_quantized_vectors(self):
+        np.random.seed(0)
+        vectors = np.random.randint(-128, 128, (40, 16)).astype(np.int8)
+
+        ivf = IVF(n_clusters=4)
+        ivf.create_index(vectors)
+        rows, scores = ivf.search_with_scores(vectors[0], k=1)
+
+        assert ivf.vectors.dtype == np.int8
+        assert ivf.centroids.dtype.kind == "f"
+        assert rows.tolist() == [0]
+        assert scores[0] == pytest.approx(1.0)
+
+    def test_filtered_search_expands_probes_until_k_hits(self):
+        dataset = self._clustered_dataset()
+        # Only a few rows of the farthest cluster pass the filter
+        mask = np.zeros(60, dtype=bool)
+        mask[[45, 50, 55]] = True
+
+        ivf = IVF(n_clusters=3, brute_force_selectivity=0.0)
+        ivf.fit(dataset)
+        ivf.create_index(dataset)
+        rows, scores = ivf.search_with_scores(np.array([0.1, 0.1]), k=3, mask=mask)
+
+        assert sorted(rows.tolist()) == [45, 50, 55]
+        assert list(scores) == sorted(scores, reverse=True)
+
+    def test_selective_filter_uses_brute_force(self):
+        dataset = self._clustered_dataset()
+        mask = np.zeros(60, dtype=bool)
+        mask[[3, 25, 58]] = True
+
+        ivf = IVF(n_clusters=3, brute_force_selectivity=0.1)
+        ivf.fit(dataset)
+        ivf.create_index(dataset)
+        rows, _ = ivf.search_with_scores(np.array([0.1, 0.1]), k=2, mask=mask)
+
+        flat_index = FlatIndex()
+        expected = flat_index.search(
+            np.array([0.1, 0.1]), flat_index.fit(dataset), k=2, mask=mask
+        )
+        assert rows.tolist() == expected
+
+    def test_min_score_limits_results(self):
+        dataset = self._clustered_dataset()
+        query = np.array([0.1, 0.1])
+
+        ivf = IVF(n_clusters=3)
+        ivf.fit(dataset)
+        ivf.create_index(dataset)
+        rows, scores = ivf.search_with_scores(query, k=60)
+        kept, kept_scores = ivf.search_with_scores(query, k=60, min_score=0.9)
+
+        assert kept.tolist() == rows[scores >= 0.9].tolist()
+        assert all(kept_scores >= 0.9)
+
+    def test_scan_probes_further_lists_on_demand(self):
+        dataset = self._clustered_dataset()
+
+        ivf = IVF(n_clusters=3)
+        ivf.fit(dataset)
+        ivf.create_index(dataset)
+        scan = ivf.scan(np.array([0.1, 0.1]))
+        first, _ = scan.next(5)
+        assert scan.probes == 1
+
+        rest = [scan.next(20)[0] for _ in range(3)]
+        returned = np.concatenate([first, *rest]).tolist()
+        assert sorted(returned) == list(range(60))
+        assert scan.probes == 3
+        assert scan.exhausted
+
+    def test_range_search_prunes_lists_by_centroid_bound(self):
+        dataset = self._clustered_dataset()
+        query = np.array([0.1, 0.1])
+        flat_index = FlatIndex()
+        similarities = flat_index.similarities(query, dataset.T)
+
+        ivf = IVF(n_clusters=3)
+        ivf.fit(dataset)
+        ivf.create_index(dataset)
+        scored_rows = []
+        similarities_of = ivf.flat_index.similarities
+
+        def counting_similarities(query, vectors):
+            scored_rows.append(vectors.shape[1])
+            return similarities_of(query, vectors)
+
+        ivf.flat_index.similarities = counting_similarities
+        batches = list(ivf.range_search(query, radius=0.99))
+        rows = np.concatenate([batch for batch, _ in batches])
+        scores = np.concatenate([batch_scores for _, batch_scores in batches])
+
+        assert sorted(rows.tolist()) == np.flatnonzero(similarities >= 0.99).tolist()
+        assert list(scores) == sorted(scores, reverse=True)
+        assert sum(scored_rows) < len(dataset)
+
     def test_ivf_embeddings(self):
         eb = Embedder()
         phrases = [
@@ -62,3 +427,16 @@ class TestIVFIndex:
         assert isinstance(res, list)
         assert all(isinstance(idx, int) for idx in res)
         assert all(query_term in phrases[i] for i in res)
+
+    def test_embedding_options_from_library_metadata(self):
+        options = Embedder.options_from_metadata(
+            {"embedding_dimension": 256, "embedding_type": "ubinary"}
+        )
+
+        assert options == {"output_dimension": 256, "embedding_type": "ubinary"}
+        assert Embedder.options_from_metadata(None) == {
+            "output_dimension": 1024,
+            "embedding_type": "float",
+        }
+        with pytest.raises(ValidationError):
+            Embedder.options_from_metadata({"embedding_type": "int4"})
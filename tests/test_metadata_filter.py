@@ -1,297 +1,305 @@
 """Unit tests for metadata filtering functionality."""
 
-from datetime import datetime, UTC
+from datetime import UTC, datetime, timedelta
 from uuid import uuid4
 
 import pytest
 
-from app.models.models import MetadataFilter
+from app.models.models import FilterGroup, MetadataFilter
+from app.utils.attribute_store import AttributeStore
+from app.utils.filter_plan import compile_filter, compile_filters
 from app.utils.metadata_filter import MetadataFilterProcessor
 
 
 class MockItem:
     """Mock item for testing metadata filtering."""
-    
+
     def __init__(self, **kwargs):
-        self.id = kwargs.get('id', uuid4())
-        self.title = kwargs.get('title')
-        self.content = kwargs.get('content')
-        self.name = kwargs.get('name')
-        self.description = kwargs.get('description')
-        self.created_at = kwargs.get('created_at')
-        self.updated_at = kwargs.get('updated_at')
-        self.metadata = kwargs.get('metadata', {})
+        self.id = kwargs.get("id", uuid4())
+        self.title = kwargs.get("title")
+        self.content = kwargs.get("content")
+        self.name = kwargs.get("name")
+        self.description = kwargs.get("description")
+        self.created_at = kwargs.get("created_at")
+        self.updated_at = kwargs.get("updated_at")
+        self.metadata = kwargs.get("metadata", {})
 
 
 class TestMetadataFilterProcessor:
     """Test cases for MetadataFilterProcessor."""
-    
+
     def test_apply_filters_no_filters(self):
         """Test that items are unchanged when no filters applied."""
         items = [MockItem(title="test1"), MockItem(title="test2")]
         result = MetadataFilterProcessor.apply_filters(items, [])
         assert result == items
-    
+
     def test_apply_filters_empty_items(self):
         """Test filtering empty item list."""
         filters = [MetadataFilter(field="title", operator="eq", value="test")]
         result = MetadataFilterProcessor.apply_filters([], filters)
         assert result == []
-    
+
     def test_filter_operator_eq(self):
         """Test equality operator."""
         items = [
             MockItem(title="test", metadata={"category": "doc"}),
             MockItem(title="other", metadata={"category": "doc"}),
-            MockItem(title="test", metadata={"category": "image"})
+            MockItem(title="test", metadata={"category": "image"}),
         ]
-        
+
         # Filter by title
         title_filter = MetadataFilter(field="title", operator="eq", value="test")
         result = MetadataFilterProcessor.apply_filters(items, [title_filter])
         assert len(result) == 2
         assert all(item.title == "test" for item in result)
-        
+
         # Filter by metadata
         category_filter = MetadataFilter(field="category", operator="eq", value="doc")
         result = MetadataFilterProcessor.apply_filters(items, [category_filter])
         assert len(result) == 2
         assert all(item.metadata["category"] == "doc" for item in result)
-    
+
     def test_filter_operator_ne(self):
         """Test not equal operator."""
         items = [
             MockItem(title="test"),
             MockItem(title="other"),
-            MockItem(title="another")
+            MockItem(title="another"),
         ]
-        
+
         filter_ne = MetadataFilter(field="title", operator="ne", value="test")
         result = MetadataFilterProcessor.apply_filters(items, [filter_ne])
         assert len(result) == 2
         assert all(item.title != "test" for item in result)
-    
+
     def test_filter_operator_gt_lt(self):
         """Test greater than and less than operators."""
         items = [
             MockItem(metadata={"score": 5}),
             MockItem(metadata={"score": 10}),
-            MockItem(metadata={"score": 15})
+            MockItem(metadata={"score": 15}),
         ]
-        
+
         # Greater than
         gt_filter = MetadataFilter(field="score", operator="gt", value=7)
         result = MetadataFilterProcessor.apply_filters(items, [gt_filter])
         assert len(result) == 2
         assert all(item.metadata["score"] > 7 for item in result)
-        
+
         # Less than
         lt_filter = MetadataFilter(field="score", operator="lt", value=12)
         result = MetadataFilterProcessor.apply_filters(items, [lt_filter])
         assert len(result) == 2
         assert all(item.metadata["score"] < 12 for item in result)
-    
+
     def test_filter_operator_gte_lte(self):
         """Test greater than or equal and less than or equal operators."""
         items = [
             MockItem(metadata={"score": 5}),
             MockItem(metadata={"score": 10}),
-            MockItem(metadata={"score": 15})
+            MockItem(metadata={"score": 15}),
         ]
-        
+
         # Greater than or equal
         gte_filter = MetadataFilter(field="score", operator="gte", value=10)
         result = MetadataFilterProcessor.apply_filters(items, [gte_filter])
         assert len(result) == 2
         assert all(item.metadata["score"] >= 10 for item in result)
-        
+
         # Less than or equal
         lte_filter = MetadataFilter(field="score", operator="lte", value=10)
         result = MetadataFilterProcessor.apply_filters(items, [lte_filter])
         assert len(result) == 2
         assert all(item.metadata["score"] <= 10 for item in result)
-    
+
     def test_filter_operator_in(self):
         """Test in operator."""
         items = [
             MockItem(metadata={"category": "doc"}),
             MockItem(metadata={"category": "image"}),
             MockItem(metadata={"category": "video"}),
-            MockItem(metadata={"category": "audio"})
+            MockItem(metadata={"category": "audio"}),
         ]
-        
-        in_filter = MetadataFilter(field="category", operator="in", value=["doc", "image"])
+
+        in_filter = MetadataFilter(
+            field="category", operator="in", value=["doc", "image"]
+        )
         result = MetadataFilterProcessor.apply_filters(items, [in_filter])
         assert len(result) == 2
         assert all(item.metadata["category"] in ["doc", "image"] for item in result)
-    
+
     def test_filter_operator_contains(self):
         """Test contains operator."""
         items = [
             MockItem(title="machine learning"),
             MockItem(title="deep learning"),
             MockItem(title="artificial intelligence"),
-            MockItem(title="data science")
+            MockItem(title="data science"),
         ]
-        
-        contains_filter = MetadataFilter(field="title", operator="contains", value="learning")
+
+        contains_filter = MetadataFilter(
+            field="title", operator="contains", value="learning"
+        )
         result = MetadataFilterProcessor.apply_filters(items, [contains_filter])
         assert len(result) == 2
         assert all("learning" in item.title.lower() for item in result)
-    
+
     def test_filter_operator_starts_with(self):
         """Test starts_with operator."""
         items = [
             MockItem(title="machine learning"),
             MockItem(title="machine vision"),
             MockItem(title="deep learning"),
-            MockItem(title="data science")
+            MockItem(title="data science"),
         ]
-        
-        starts_filter = MetadataFilter(field="title", operator="starts_with", value="machine")
+
+        starts_filter = MetadataFilter(
+            field="title", operator="starts_with", value="machine"
+        )
         result = MetadataFilterProcessor.apply_filters(items, [starts_filter])
         assert len(result) == 2
         assert all(item.title.lower().startswith("machine") for item in result)
-    
+
     def test_filter_operator_ends_with(self):
         """Test ends_with operator."""
         items = [
             MockItem(title="machine learning"),
             MockItem(title="deep learning"),
             MockItem(title="artificial intelligence"),
-            MockItem(title="data science")
+            MockItem(title="data science"),
         ]
-        
-        ends_filter = MetadataFilter(field="title", operator="ends_with", value="learning")
+
+        ends_filter = MetadataFilter(
+            field="title", operator="ends_with", value="learning"
+        )
         result = MetadataFilterProcessor.apply_filters(items, [ends_filter])
         assert len(result) == 2
         assert all(item.title.lower().endswith("learning") for item in result)
-    
+
     def test_filter_built_in_fields(self):
         """Test filtering on built-in fields."""
         item_id = uuid4()
         created_time = datetime.now(UTC)
-        
+
         items = [
             MockItem(id=item_id, created_at=created_time),
-            MockItem(id=uuid4(), created_at=datetime.now(UTC))
+            MockItem(id=uuid4(), created_at=datetime.now(UTC)),
         ]
-        
+
         # Filter by ID
         id_filter = MetadataFilter(field="id", operator="eq", value=str(item_id))
         result = MetadataFilterProcessor.apply_filters(items, [id_filter])
         assert len(result) == 1
         assert result[0].id == item_id
-        
+
         # Filter by created_at
         created_filter = MetadataFilter(
-            field="created_at", 
-            operator="eq", 
-            value=created_time.isoformat()
+            field="created_at", operator="eq", value=created_time.isoformat()
         )
         result = MetadataFilterProcessor.apply_filters(items, [created_filter])
         assert len(result) == 1
         assert result[0].created_at == created_time
-    
+
     def test_filter_date_comparison(self):
         """Test date filtering with comparison operators."""
         now = datetime.now(UTC)
         past = datetime(2023, 1, 1, tzinfo=UTC)
         future = datetime(2025, 1, 1, tzinfo=UTC)
-        
+
         items = [
             MockItem(created_at=past),
             MockItem(created_at=now),
-            MockItem(created_at=future)
+            MockItem(created_at=future),
         ]
-        
+
         # Filter items created after 2024
         after_filter = MetadataFilter(
-            field="created_at", 
-            operator="gt", 
-            value="2024-01-01T00:00:00+00:00"
+            field="created_at", operator="gt", value="2024-01-01T00:00:00+00:00"
         )
         result = MetadataFilterProcessor.apply_filters(items, [after_filter])
         assert len(result) == 2  # now and future
         assert all(item.created_at.year >= 2024 for item in result)
-    
+
     def test_multiple_filters_and_logic(self):
         """Test multiple filters with AND logic."""
         items = [
             MockItem(title="machine learning", metadata={"score": 8, "category": "AI"}),
             MockItem(title="deep learning", metadata={"score": 9, "category": "AI"}),
             MockItem(title="data science", metadata={"score": 7, "category": "DS"}),
-            MockItem(title="machine vision", metadata={"score": 6, "category": "AI"})
+            MockItem(title="machine vision", metadata={"score": 6, "category": "AI"}),
         ]
-        
+
         filters = [
             MetadataFilter(field="category", operator="eq", value="AI"),
             MetadataFilter(field="score", operator="gt", value=7),
-            MetadataFilter(field="title", operator="contains", value="learning")
+            MetadataFilter(field="title", operator="contains", value="learning"),
         ]
-        
+
         result = MetadataFilterProcessor.apply_filters(items, filters)
         assert len(result) == 2  # machine learning and deep learning
         assert all(item.metadata["category"] == "AI" for item in result)
         assert all(item.metadata["score"] > 7 for item in result)
         assert all("learning" in item.title for item in result)
-    
+
     def test_filter_none_values(self):
         """Test filtering when field values are None."""
         items = [
             MockItem(title="test", description=None),
             MockItem(title="test2", description="has description"),
-            MockItem(title="test3")  # description not set
+            MockItem(title="test3"),  # description not set
         ]
-        
+
         # Test ne with None - the current implementation treats None values as not equal to non-None values
         ne_filter = MetadataFilter(field="description", operator="ne", value="test")
         result = MetadataFilterProcessor.apply_filters(items, [ne_filter])
-        # All items should match since their description != "test" 
+        # All items should match since their description != "test"
         assert len(result) == 3
-        
+
         # Test eq with existing value
-        eq_filter = MetadataFilter(field="description", operator="eq", value="has description")
+        eq_filter = MetadataFilter(
+            field="description", operator="eq", value="has description"
+        )
         result = MetadataFilterProcessor.apply_filters(items, [eq_filter])
         assert len(result) == 1
         assert result[0].description == "has description"
-    
+
     def test_filter_type_coercion(self):
         """Test automatic type coercion during filtering."""
         items = [
             MockItem(metadata={"score": "8.5"}),  # String number
-            MockItem(metadata={"score": 9.0}),    # Float
-            MockItem(metadata={"score": 10}),     # Int
-            MockItem(metadata={"score": "low"})   # Non-numeric string
+            MockItem(metadata={"score": 9.0}),  # Float
+            MockItem(metadata={"score": 10}),  # Int
+            MockItem(metadata={"score": "low"}),  # Non-numeric string
         ]
-        
+
         # Should convert and compare numerically - "8.5", 9.0, and 10 are all > "8.7"
         gt_filter = MetadataFilter(field="score", operator="gt", value="8.7")
         result = MetadataFilterProcessor.apply_filters(items, [gt_filter])
         assert len(result) == 3  # "8.5", 9.0 and 10 (non-numeric "low" filtered out)
-    
+
     def test_filter_validation_valid_filters(self):
         """Test validation of valid filters."""
         valid_filters = [
             MetadataFilter(field="title", operator="eq", value="test"),
             MetadataFilter(field="score", operator="gt", value=5),
             MetadataFilter(field="tags", operator="in", value=["tag1", "tag2"]),
-            MetadataFilter(field="description", operator="contains", value="search")
+            MetadataFilter(field="description", operator="contains", value="search"),
         ]
-        
+
         errors = MetadataFilterProcessor.validate_filters(valid_filters)
         assert len(errors) == 0
-    
+
     def test_filter_validation_invalid_operators(self):
         """Test validation catches invalid operators."""
-        # Since Pydantic validates at model creation, we need to test that 
+        # Since Pydantic validates at model creation, we need to test that
         # invalid operators are caught at the Pydantic level
         with pytest.raises(ValueError):
             MetadataFilter(field="title", operator="invalid", value="test")
-        
+
         with pytest.raises(ValueError):
             MetadataFilter(field="score", operator="equals", value=5)
-    
+
     def test_filter_validation_empty_fields(self):
         """Test validation catches empty field names."""
         # Test empty string field
@@ -299,53 +307,425 @@ class TestMetadataFilterProcessor:
         errors = MetadataFilterProcessor.validate_filters([empty_field_filter])
         assert len(errors) == 1
         assert "field must be a non-empty string" in errors[0]
-        
+
         # Test None field - Pydantic will catch this at model creation
         with pytest.raises(ValueError):
             MetadataFilter(field=None, operator="eq", value="test")
-    
+
+    def test_filter_validation_nested_groups(self):
+        """Test validation reports errors inside nested groups by position."""
+        filters = [
+            MetadataFilter(field="title", operator="eq", value="test"),
+            FilterGroup(
+                operator="or",
+                filters=[
+                    MetadataFilter(field="score", operator="gt", value=5),
+                    MetadataFilter(field="tags", operator="in", value="not_a_list"),
+                ],
+            ),
+        ]
+
+        errors = MetadataFilterProcessor.validate_filters(filters)
+        assert errors == ["Filter 1.1: 'in' operator requires a list or tuple value"]
+
     def test_filter_validation_in_operator_requirements(self):
         """Test validation of 'in' operator value requirements."""
         invalid_filters = [
             MetadataFilter(field="tags", operator="in", value="not_a_list"),
-            MetadataFilter(field="categories", operator="in", value=42)
+            MetadataFilter(field="categories", operator="in", value=42),
         ]
-        
+
         errors = MetadataFilterProcessor.validate_filters(invalid_filters)
         assert len(errors) == 2
         assert "'in' operator requires a list or tuple value" in errors[0]
         assert "'in' operator requires a list or tuple value" in errors[1]
-    
+
     def test_filter_case_insensitive_string_operations(self):
         """Test that string operations are case insensitive."""
         items = [
             MockItem(title="Machine Learning"),
             MockItem(title="DEEP LEARNING"),
-            MockItem(title="artificial intelligence")
+            MockItem(title="artificial intelligence"),
         ]
-        
+
         # Test case insensitive contains
-        contains_filter = MetadataFilter(field="title", operator="contains", value="LEARNING")
+        contains_filter = MetadataFilter(
+            field="title", operator="contains", value="LEARNING"
+        )
         result = MetadataFilterProcessor.apply_filters(items, [contains_filter])
         assert len(result) == 2
-        
+
         # Test case insensitive starts_with
-        starts_filter = MetadataFilter(field="title", operator="starts_with", value="machine")
+        starts_filter = MetadataFilter(
+            field="title", operator="starts_with", value="machine"
+        )
         result = MetadataFilterProcessor.apply_filters(items, [starts_filter])
         assert len(result) == 1
         assert result[0].title == "Machine Learning"
-    
+
     def test_filter_error_handling(self):
         """Test that comparison errors are handled gracefully."""
         items = [
             MockItem(metadata={"mixed_field": "text"}),
             MockItem(metadata={"mixed_field": 42}),
-            MockItem(metadata={"mixed_field": None})
+            MockItem(metadata={"mixed_field": None}),
         ]
-        
+
         # Try to compare text with number - should not crash
         gt_filter = MetadataFilter(field="mixed_field", operator="gt", value=30)
         result = MetadataFilterProcessor.apply_filters(items, [gt_filter])
         # Should only match the numeric value
         assert len(result) == 1
-        assert result[0].metadata["mixed_field"] == 42
\ No newline at end of file
+        assert result[0].metadata["mixed_field"] == 42
+
+    def test_build_mask_aligned_with_items(self):
+        """Test filters evaluate to a row bitmap in item order."""
+        items = [
+            MockItem(metadata={"category": "doc"}),
+            MockItem(metadata={"category": "image"}),
+            MockItem(metadata={"category": "doc"}),
+        ]
+
+        doc_filter = MetadataFilter(field="category", operator="eq", value="doc")
+        mask = MetadataFilterProcessor.build_mask(items, [doc_filter])
+
+        assert mask.dtype == bool
+        assert mask.tolist() == [True, False, True]
+        assert MetadataFilterProcessor.build_mask(items, []).all()
+
+    def test_document_attributes_denormalized(self):
+        """Test chunks match on their document's attributes unless they shadow them."""
+        document = MockItem(
+            title="Report",
+            content="full text",
+            metadata={"region": "eu", "category": "doc"},
+        )
+        chunks = [
+            MockItem(content="a", metadata={"category": "image"}),
+            MockItem(content="b", metadata={}),
+            MockItem(content="c", metadata={"region": "us"}),
+        ]
+        for chunk in chunks:
+            chunk.document_id = document.id
+        documents = {document.id: document}
+
+        def matching(*filters):
+            return MetadataFilterProcessor.build_mask(
+                chunks, list(filters), documents=documents
+            ).tolist()
+
+        assert matching(MetadataFilter(field="region", operator="eq", value="eu")) == [
+            True,
+            True,
+            False,
+        ]
+        assert matching(
+            MetadataFilter(field="category", operator="eq", value="doc")
+        ) == [False, True, True]
+        assert matching(
+            MetadataFilter(field="document.category", operator="eq", value="doc")
+        ) == [True, True, True]
+        assert matching(
+            MetadataFilter(field="document.title", operator="eq", value="Report")
+        ) == [True, True, True]
+        # Document content is not copied onto the chunk rows
+        assert matching(
+            MetadataFilter(field="document.content", operator="eq", value="full text")
+        ) == [False, False, False]
+
+
+class TestAttributeStore:
+    """Test cases for the inverted attribute index."""
+
+    def _items(self):
+        created = datetime(2024, 1, 1, tzinfo=UTC)
+        return [
+            MockItem(
+                title="alpha",
+                created_at=created,
+                metadata={"category": "doc", "score": 5, "due": "2024-03-01"},
+            ),
+            MockItem(
+                title="beta",
+                created_at=created + timedelta(days=30),
+                metadata={"category": "image", "score": "10", "due": "soon"},
+            ),
+            MockItem(
+                title="gamma",
+                metadata={"category": "doc", "tags": ["a", "b"], "due": 7},
+            ),
+            MockItem(
+                title="delta",
+                created_at=created + timedelta(days=60),
+                metadata={"score": 1.0, "flag": True, "due": "2024-01-15T00:00:00Z"},
+            ),
+        ]
+
+    @pytest.mark.parametrize(
+        "metadata_filter",
+        [
+            MetadataFilter(field="category", operator="eq", value="doc"),
+            MetadataFilter(field="category", operator="ne", value="doc"),
+            MetadataFilter(field="category", operator="ne", value=None),
+            MetadataFilter(field="category", operator="in", value=["image", "x"]),
+            MetadataFilter(field="score", operator="eq", value=10),
+            MetadataFilter(field="score", operator="in", value=[1, 5]),
+            MetadataFilter(field="score", operator="gte", value=5),
+            MetadataFilter(field="score", operator="lt", value="6"),
+            MetadataFilter(field="score", operator="gt", value="2024-01-01"),
+            MetadataFilter(field="flag", operator="gte", value=1),
+            MetadataFilter(field="created_at", operator="gte", value="2024-01-31"),
+            MetadataFilter(
+                field="created_at", operator="gt", value="2024-01-31T00:00:00Z"
+            ),
+            MetadataFilter(field="created_at", operator="lte", value="2024-01-01Z"),
+            MetadataFilter(field="due", operator="lt", value="2024-02-01"),
+            MetadataFilter(field="due", operator="lt", value="2024-02-01T00:00Z"),
+            MetadataFilter(field="due", operator="gt", value=5),
+            MetadataFilter(field="due", operator="gt", value="5"),
+            MetadataFilter(field="due", operator="gt", value="rain"),
+            MetadataFilter(field="flag", operator="in", value=[1]),
+            MetadataFilter(field="tags", operator="eq", value=["a", "b"]),
+            MetadataFilter(field="title", operator="starts_with", value="AL"),
+            MetadataFilter(field="title", operator="ends_with", value="MMA"),
+            MetadataFilter(field="due", operator="contains", value="2024-0"),
+            MetadataFilter(field="score", operator="contains", value="1.0"),
+            MetadataFilter(field="flag", operator="contains", value="rue"),
+            MetadataFilter(field="tags", operator="contains", value="'a'"),
+            MetadataFilter(field="score", operator="ne", value=5),
+            MetadataFilter(field="score", operator="ne", value=10),
+            MetadataFilter(field="score", operator="ne", value="10"),
+            MetadataFilter(field="flag", operator="ne", value=True),
+            MetadataFilter(field="flag", operator="ne", value=1),
+            MetadataFilter(field="tags", operator="ne", value=["a", "b"]),
+            MetadataFilter(field="tags", operator="ne", value="a"),
+            MetadataFilter(field="due", operator="ne", value=7),
+        ],
+    )
+    def test_matches_processor_semantics(self, metadata_filter):
+        """Test bitmaps agree with the per-item filter evaluation."""
+        items = self._items()
+        store = AttributeStore.from_items(items)
+
+        expected = MetadataFilterProcessor.build_mask(items, [metadata_filter])
+        assert store.filter_mask(metadata_filter).tolist() == expected.tolist()
+
+    def test_remove_rows_keeps_alignment(self):
+        """Test removing rows shifts later rows down."""
+        items = self._items()
+        store = AttributeStore.from_items(items)
+        store.remove_rows([0, 2])
+        store.add_items([MockItem(title="epsilon", metadata={"category": "doc"})])
+
+        doc_filter = MetadataFilter(field="category", operator="eq", value="doc")
+        assert store.num_rows == 3
+        assert store.filter_mask(doc_filter).tolist() == [False, False, True]
+
+    @pytest.mark.parametrize(
+        "expression",
+        [
+            FilterGroup(
+                operator="or",
+                filters=[
+                    MetadataFilter(field="category", operator="eq", value="image"),
+                    MetadataFilter(field="flag", operator="eq", value=True),
+                ],
+            ),
+            FilterGroup(
+                operator="not",
+                filters=[MetadataFilter(field="category", operator="eq", value="doc")],
+            ),
+            FilterGroup(
+                operator="and",
+                filters=[
+                    MetadataFilter(field="score", operator="ne", value=None),
+                    FilterGroup(
+                        operator="or",
+                        filters=[
+                            MetadataFilter(field="score", operator="gt", value=4),
+                            FilterGroup(
+                                operator="not",
+                                filters=[
+                                    MetadataFilter(
+                                        field="title", operator="contains", value="e"
+                                    )
+                                ],
+                            ),
+                        ],
+                    ),
+                ],
+            ),
+            FilterGroup(operator="or", filters=[]),
+        ],
+    )
+    def test_filter_groups_match_processor_semantics(self, expression):
+        """Test nested boolean groups agree with the per-item evaluation."""
+        items = self._items()
+        store = AttributeStore.from_items(items)
+
+        expected = MetadataFilterProcessor.build_mask(items, [expression])
+        assert store.build_mask([expression]).tolist() == expected.tolist()
+
+    def test_estimate_selectivity(self):
+        """Test lookups are counted exactly and scans are estimated by sampling."""
+        items = [
+            MockItem(
+                title=f"title {i}", metadata={"category": "doc" if i < 25 else "x"}
+            )
+            for i in range(100)
+        ]
+        store = AttributeStore.from_items(items)
+
+        doc_filter = MetadataFilter(field="category", operator="eq", value="doc")
+        title_filter = MetadataFilter(field="title", operator="contains", value="1")
+        assert store.estimate_selectivity([doc_filter]) == 0.25
+        assert store.estimate_selectivity(
+            [title_filter], sample_size=20
+        ) == pytest.approx(0.19, abs=0.1)
+        assert (
+            store.estimate_selectivity(
+                [FilterGroup(operator="not", filters=[doc_filter])]
+            )
+            == 0.75
+        )
+
+    def test_substring_filters_use_trigram_index(self):
+        """Test substring filters only verify values sharing the needle's trigrams."""
+        items = self._items()
+        store = AttributeStore.from_items(items)
+        contains = MetadataFilter(field="title", operator="contains", value="ELT")
+
+        assert store._trigram_candidates("title", "elt") == {("str", "delta")}
+        assert store.filter_mask(contains).tolist() == [False, False, False, True]
+
+        store.remove_rows([3])
+        store.add_items([MockItem(title="Pelton")])
+        assert store._trigram_candidates("title", "elt") == {("str", "Pelton")}
+        for operator, value in [
+            ("contains", "ELT"),
+            ("starts_with", "pel"),
+            ("ends_with", "mma"),
+            ("contains", "a"),
+        ]:
+            substring = MetadataFilter(field="title", operator=operator, value=value)
+            expected = MetadataFilterProcessor.build_mask(
+                [*items[:3], MockItem(title="Pelton")], [substring]
+            )
+            assert store.filter_mask(substring).tolist() == expected.tolist()
+
+    def test_document_attributes_match_processor_semantics(self):
+        """Test rows built with documents agree with the per-item evaluation."""
+        items = self._items()
+        document = MockItem(title="report", metadata={"region": "eu", "score": 3})
+        for item in items:
+            item.document_id = document.id
+        documents = {document.id: document}
+        store = AttributeStore.from_items(items[:2], documents)
+        store.add_items(items[2:], documents)
+
+        for metadata_filter in [
+            MetadataFilter(field="region", operator="eq", value="eu"),
+            MetadataFilter(field="score", operator="lt", value=4),
+            MetadataFilter(field="document.score", operator="eq", value=3),
+            MetadataFilter(field="document.title", operator="eq", value="report"),
+        ]:
+            expected = MetadataFilterProcessor.build_mask(
+                items, [metadata_filter], documents=documents
+            )
+            assert store.filter_mask(metadata_filter).tolist() == expected.tolist()
+
+    def test_range_columns_follow_removed_rows(self):
+        """Test typed columns stay aligned after rows are removed and added."""
+        store = AttributeStore.from_items(self._items())
+        store.remove_rows([0])
+        store.add_items([MockItem(title="epsilon", metadata={"score": 20})])
+
+        score_filter = MetadataFilter(field="score", operator="gt", value=4)
+        assert store.filter_mask(score_filter).tolist() == [True, False, False, True]
+
+    def test_facet_counts(self):
+        """Test value counts over a bitmap, by row and by distinct document."""
+        items = self._items()
+        documents = [MockItem(title="first"), MockItem(title="second")]
+        for item, document in zip(
+            items, [*documents, documents[0], documents[0]], strict=True
+        ):
+            item.document_id = document.id
+        store = AttributeStore.from_items(
+            items, {document.id: document for document in documents}
+        )
+
+        assert store.facet_counts("category") == {
+            ("str", "doc"): 2,
+            ("str", "image"): 1,
+        }
+        assert store.facet_counts("score") == {
+            ("int", 5): 1,
+            ("str", "10"): 1,
+            ("float", 1.0): 1,
+        }
+        assert store.facet_counts("tags") == {}
+
+        mask = store.filter_mask(
+            MetadataFilter(field="title", operator="ne", value="beta")
+        )
+        assert store.facet_counts("category", mask) == {("str", "doc"): 2}
+        assert store.facet_counts("category", mask, distinct_by="document.id") == {
+            ("str", "doc"): 1
+        }
+
+        # Code columns are rebuilt once rows change
+        store.remove_rows([0])
+        store.add_items([MockItem(metadata={"category": "image"})])
+        assert store.facet_counts("category") == {
+            ("str", "doc"): 1,
+            ("str", "image"): 2,
+        }
+
+
+class TestFilterPlan:
+    """Test cases for compiled filter plans."""
+
+    def test_identical_filters_reuse_plan(self):
+        """Test equal filter lists share one compiled plan."""
+        filters = [MetadataFilter(field="tags", operator="in", value=["a", "b"])]
+        same = [MetadataFilter(field="tags", operator="in", value=["a", "b"])]
+        other = [MetadataFilter(field="tags", operator="in", value=["a", "c"])]
+
+        assert compile_filters(filters) is compile_filters(same)
+        assert compile_filters(filters) is not compile_filters(other)
+
+    def test_cache_key_distinguishes_value_types(self):
+        """Test values equal across types do not share a plan."""
+        as_int = compile_filters([MetadataFilter(field="x", operator="eq", value=1)])
+        as_bool = compile_filters(
+            [MetadataFilter(field="x", operator="eq", value=True)]
+        )
+        assert as_int is not as_bool
+
+    def test_clauses_ordered_by_selectivity(self):
+        """Test equality clauses run before range and negation clauses."""
+        plan = compile_filters(
+            [
+                MetadataFilter(field="a", operator="ne", value="x"),
+                MetadataFilter(field="b", operator="gt", value=1),
+                MetadataFilter(field="c", operator="eq", value="y"),
+            ]
+        )
+        assert [clause.operator for clause in plan.clauses] == ["eq", "gt", "ne"]
+        assert not plan.matches({"a": "z", "b": 2, "c": "n"})
+        assert plan.matches({"a": "z", "b": 2, "c": "y"})
+
+    def test_compiled_filter_normalizes_values(self):
+        """Test compiled predicates apply the date and number normalization."""
+        after = compile_filter(
+            MetadataFilter(field="d", operator="gt", value="2024-01-01T00:00:00Z")
+        )
+        assert after("2024-06-01T00:00:00+00:00")
+        assert not after("2023-06-01T00:00:00+00:00")
+
+        contains = compile_filter(
+            MetadataFilter(field="n", operator="contains", value="ALP")
+        )
+        assert contains("alpha")
+        assert not contains(None)
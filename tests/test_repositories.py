@@ -1,4 +1,6 @@
+from datetime import UTC, datetime
 from pathlib import Path
+from uuid import uuid4
 
 import numpy as np
 import pytest
@@ -7,11 +9,14 @@ import pytest_asyncio
 from app.models.chunk import Chunk
 from app.models.document import Document
 from app.models.library import Library
+from app.models.models import FilterGroup, MetadataFilter
 from app.repositories.chunk import ChunkRepository
 from app.repositories.db import DB
 from app.repositories.document import DocumentRepository
 from app.repositories.library import LibraryRepository
 from app.repositories.vector_index import FlatIndexRepository, IVFIndexRepository
+from app.utils.metadata_filter import MetadataFilterProcessor
+from app.utils.persistent_index import PersistentFlatIndex, PersistentVectorIndex
 from tests.conftest import create_test_chunk
 
 
@@ -138,6 +143,15 @@ class TestDocumentRepository:
         is_in_db_doc = await docs.find(doc.id)
         assert is_in_db_doc.title == "New Test Doc"
 
+    @pytest.mark.asyncio
+    async def test_find_attributes_by_library_skips_content(self, docs, doc):
+        found = await docs.find_attributes_by_library(doc.library_id)
+
+        assert [d.id for d in found] == [doc.id]
+        assert found[0].content is None
+        assert found[0].title == doc.title
+        assert found[0].updated_at == doc.updated_at
+
     @pytest.mark.asyncio
     async def test_delete(self, docs, doc):
         deleted = await docs.delete(doc.id)
@@ -174,6 +188,149 @@ class TestChunkRepository:
         assert deleted == 1
 
 
+FILTER_METADATA = [
+    {"category": "doc", "score": 5},
+    {"category": "image", "score": "10"},
+    {"category": "doc", "score": 1.5, "flag": True},
+    {"tags": ["a", "b"], "due": "2024-03-01"},
+    None,
+]
+
+PUSHDOWN_FILTERS = [
+    [MetadataFilter(field="category", operator="eq", value="doc")],
+    [MetadataFilter(field="category", operator="ne", value="doc")],
+    [MetadataFilter(field="category", operator="in", value=["image", "x"])],
+    [MetadataFilter(field="score", operator="gte", value=2)],
+    [MetadataFilter(field="flag", operator="eq", value=1)],
+    [MetadataFilter(field="due", operator="lt", value="2024-06-01")],
+    [MetadataFilter(field="created_at", operator="gte", value="2000-01-01T00:00Z")],
+    [MetadataFilter(field="created_at", operator="gte", value="2000-01-01")],
+    [
+        FilterGroup(
+            operator="or",
+            filters=[
+                MetadataFilter(field="category", operator="eq", value="image"),
+                MetadataFilter(field="score", operator="lt", value=2),
+            ],
+        )
+    ],
+    [MetadataFilter(field="region", operator="eq", value="eu")],
+    [MetadataFilter(field="region", operator="ne", value="eu")],
+    [MetadataFilter(field="title", operator="eq", value="Test Document")],
+    [MetadataFilter(field="document.category", operator="in", value=["report"])],
+    [MetadataFilter(field="document.content", operator="ne", value="x")],
+    [MetadataFilter(field="document.created_at", operator="lt", value="2000-01-01Z")],
+]
+
+
+class TestChunkFilterPushdown:
+    @pytest_asyncio.fixture
+    async def report(self, lib, docs):
+        return await docs.create(
+            Document(
+                title="Report",
+                library_id=lib.id,
+                metadata={"region": "eu", "category": "report"},
+            )
+        )
+
+    @pytest_asyncio.fixture
+    async def filtered_chunks(self, chunks, doc, report):
+        created = []
+        for document in (doc, report):
+            for metadata in FILTER_METADATA:
+                created.append(
+                    await chunks.create(
+                        Chunk(
+                            content="filtered chunk",
+                            embedding=np.random.random(10).tobytes(),
+                            document_id=document.id,
+                            metadata=metadata,
+                        )
+                    )
+                )
+        return created
+
+    @pytest.mark.asyncio
+    @pytest.mark.parametrize("metadata_filters", PUSHDOWN_FILTERS)
+    async def test_find_ids_selects_superset(
+        self, chunks, docs, lib, filtered_chunks, metadata_filters
+    ):
+        """Test the SQL clause never drops a chunk the filters accept."""
+        library_chunks = await chunks.find_by_library(lib.id)
+        documents = {d.id: d for d in await docs.find_by_library(lib.id)}
+        expected = {
+            c.id
+            for c in MetadataFilterProcessor.apply_filters(
+                library_chunks, metadata_filters, documents=documents
+            )
+        }
+        candidates = set(await chunks.find_ids_by_library(lib.id, metadata_filters))
+
+        assert expected <= candidates
+        assert candidates <= {c.id for c in library_chunks}
+
+    @pytest.mark.asyncio
+    async def test_plain_string_filters_are_exact(self, chunks, lib, filtered_chunks):
+        """Test plain-string equality is resolved entirely in SQL."""
+        doc_filter = [MetadataFilter(field="category", operator="eq", value="doc")]
+        candidates = set(await chunks.find_ids_by_library(lib.id, doc_filter))
+        assert candidates == {filtered_chunks[i].id for i in (0, 2, 5, 7)}
+
+        found = await chunks.find_many([filtered_chunks[2].id, filtered_chunks[0].id])
+        assert [c.id for c in found] == [filtered_chunks[2].id, filtered_chunks[0].id]
+
+    @pytest.mark.asyncio
+    async def test_document_filters_are_pushed_down(
+        self, chunks, docs, lib, report, filtered_chunks
+    ):
+        """Test document fields select the chunks that do not shadow them."""
+        region_filter = [MetadataFilter(field="region", operator="eq", value="eu")]
+        candidates = set(await chunks.find_ids_by_library(lib.id, region_filter))
+        assert candidates == {c.id for c in filtered_chunks[5:]}
+
+        # Chunks with their own category shadow the document's
+        category_filter = [
+            MetadataFilter(field="category", operator="eq", value="report")
+        ]
+        candidates = set(await chunks.find_ids_by_library(lib.id, category_filter))
+        assert candidates == {filtered_chunks[i].id for i in (8, 9)}
+
+        found = await docs.find_many([report.id, uuid4()])
+        assert found == [report]
+
+    @pytest.mark.asyncio
+    async def test_hot_field_generated_column(self, tmp_path):
+        """Test hot fields get an indexed generated column used by the clause."""
+        db = DB(db_path=str(tmp_path / "hot.db"), hot_metadata_fields=["category"])
+        await db.initialize()
+        try:
+            repo = ChunkRepository(db=db)
+            library = await LibraryRepository(db=db).create(Library(name="hot"))
+            document = await DocumentRepository(db=db).create(
+                Document(title="hot", library_id=library.id)
+            )
+            chunk = await repo.create(
+                Chunk(
+                    content="hot chunk",
+                    embedding=np.random.random(10).tobytes(),
+                    document_id=document.id,
+                    metadata={"category": "doc"},
+                )
+            )
+
+            assert db.hot_columns == {"category": "meta_category"}
+            doc_filter = [MetadataFilter(field="category", operator="eq", value="doc")]
+            assert await repo.find_ids_by_library(library.id, doc_filter) == [chunk.id]
+            plan = await db.read_query(
+                "EXPLAIN QUERY PLAN SELECT id FROM chunks WHERE meta_category = ?",
+                ("doc",),
+            )
+            assert any("idx_chunks_meta_category" in row[-1] for row in plan)
+        finally:
+            await db.close()
+
+
 @pytest.fixture
 def flat_index_repository():
     yield FlatIndexRepository()
@@ -222,6 +379,21 @@ class TestFlatIndexRepository:
             assert chunk_id not in result_ids
         assert len(results) == 8
 
+    def test_search_chunks_with_mask(self, flat_index_repository):
+        chunks = [create_test_chunk(i) for i in range(10)]
+        flat_index_repository.fit_chunks(chunks)
+        mask = np.zeros(10, dtype=bool)
+        mask[[2, 5, 7]] = True
+
+        query = np.frombuffer(chunks[0].embedding)
+        results = flat_index_repository.search_chunks(query, k=5, mask=mask)
+
+        assert {chunk.id for chunk in results} == {
+            chunks[2].id,
+            chunks[5].id,
+            chunks[7].id,
+        }
+
 
 class TestIVFIndexRepository:
     def test_fit_and_search(self):
@@ -253,3 +425,132 @@ class TestIVFIndexRepository:
         result_ids = [chunk.id for chunk in results]
 
         assert initial_chunks[0].id not in result_ids
+
+    def test_search_chunks_with_mask(self):
+        chunks = [create_test_chunk(i) for i in range(30)]
+        repo = IVFIndexRepository(n_partitions=1)
+        repo.fit_chunks(chunks)
+        mask = np.zeros(30, dtype=bool)
+        mask[::3] = True
+
+        query = np.random.random(128)
+        results = repo.search_chunks(query, k=30, mask=mask)
+
+        assert {chunk.id for chunk in results} == {c.id for c in chunks[::3]}
+
+
+class TestPersistentFlatIndex:
+    def test_reload_applies_chunk_changes_incrementally(self, tmp_path):
+        chunks = [create_test_chunk(i) for i in range(6)]
+        for i, chunk in enumerate(chunks):
+            chunk.metadata = {"group": "even" if i % 2 == 0 else "odd"}
+        library_id = uuid4()
+        PersistentFlatIndex(str(tmp_path)).load_or_create_index(
+            library_id, list(chunks)
+        )
+
+        # Delete one chunk, update another and insert a new one
+        updated = chunks[1].model_copy(
+            update={"metadata": {"group": "even"}, "updated_at": datetime.now(UTC)}
+        )
+        added = create_test_chunk(6)
+        added.metadata = {"group": "even"}
+        current = [chunks[0], updated, *chunks[2:5], added]
+
+        index = PersistentFlatIndex(str(tmp_path))
+        index.load_or_create_index(library_id, current)
+        mask = index.filter_mask(
+            [MetadataFilter(field="group", operator="eq", value="even")]
+        )
+
+        query = np.frombuffer(chunks[0].embedding)
+        results = index.search_chunks(query, k=10, mask=mask)
+        assert {c.id for c in results} == {
+            chunks[0].id,
+            updated.id,
+            chunks[2].id,
+            chunks[4].id,
+            added.id,
+        }
+
+    def test_reload_reattributes_chunks_of_updated_documents(self, tmp_path):
+        document = Document(title="draft", library_id=uuid4())
+        chunks = [create_test_chunk(i) for i in range(4)]
+        for chunk in chunks:
+            chunk.document_id = document.id
+        library_id = uuid4()
+        PersistentFlatIndex(str(tmp_path)).load_or_create_index(
+            library_id, chunks, [document]
+        )
+
+        published = document.model_copy(
+            update={"title": "published", "updated_at": datetime.now(UTC)}
+        )
+        index = PersistentFlatIndex(str(tmp_path))
+        index.load_or_create_index(library_id, chunks, [published])
+
+        title_filter = MetadataFilter(field="title", operator="eq", value="published")
+        assert index.filter_mask([title_filter]).all()
+
+    def test_trigram_index_persists_with_the_next_write(self, tmp_path):
+        chunks = [create_test_chunk(i) for i in range(4)]
+        for i, chunk in enumerate(chunks):
+            chunk.metadata = {"source": f"report-{i}.pdf"}
+        library_id = uuid4()
+        index = PersistentFlatIndex(str(tmp_path))
+        index.load_or_create_index(library_id, chunks)
+        index_file = tmp_path / f"{library_id}_flat.pkl"
+        saved = index_file.read_bytes()
+
+        # Searching builds the trigram index in memory only
+        substring = MetadataFilter(field="source", operator="contains", value="rt-2")
+        assert index.filter_mask([substring]).tolist() == [False, False, True, False]
+        assert index_file.read_bytes() == saved
+
+        added = create_test_chunk(4)
+        added.metadata = {"source": "report-24.pdf"}
+        index.add_chunks([added])
+
+        reloaded = PersistentFlatIndex(str(tmp_path))
+        reloaded.load_or_create_index(library_id, [*chunks, added])
+        assert reloaded._attributes.trigram_fields == {"source"}
+        assert reloaded.filter_mask([substring]).tolist() == [
+            False,
+            False,
+            True,
+            False,
+            True,
+        ]
+
+    def test_large_index_is_memory_mapped(self, tmp_path):
+        np.random.seed(4)
+        chunks = [create_test_chunk(i) for i in range(6)]
+        library_id = uuid4()
+        in_memory = PersistentFlatIndex(str(tmp_path / "in_memory"))
+        in_memory.load_or_create_index(library_id, list(chunks))
+        PersistentFlatIndex(str(tmp_path), memmap_min_rows=4).load_or_create_index(
+            library_id, list(chunks)
+        )
+
+        index = PersistentFlatIndex(str(tmp_path), memmap_min_rows=4)
+        index.load_or_create_index(library_id, list(chunks))
+        query = np.random.random(128)
+        assert (tmp_path / f"{library_id}_flat_vectors.npy").exists()
+        assert isinstance(index._vectors.base, np.memmap)
+        results = index.search_chunks_with_scores(query, k=6)
+        expected = in_memory.search_chunks_with_scores(query, k=6)
+        assert [c.id for c, _ in results] == [c.id for c, _ in expected]
+        assert [s for _, s in results] == pytest.approx([s for _, s in expected])
+
+        # Dropping below the threshold moves the vectors back into the pickle
+        index.remove_chunks([chunk.id for chunk in chunks[:3]])
+        assert not (tmp_path / f"{library_id}_flat_vectors.npy").exists()
+        assert len(index.search_chunks(query, k=6)) == 3
+
+    def test_index_without_search_methods_cannot_be_created(self, tmp_path):
+        class Partial(PersistentVectorIndex):
+            def empty_like(self):
+                return Partial(str(self.storage_path))
+
+        with pytest.raises(TypeError, match="abstract"):
+            Partial(str(tmp_path))
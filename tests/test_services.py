@@ -1,13 +1,33 @@
 import tempfile
+import time
 from pathlib import Path
+from uuid import uuid4
 
+import numpy as np
 import pytest
 import pytest_asyncio
 
+from app.exceptions import ChunkNotFoundException, ValidationError
+from app.models.chunk import Chunk
+from app.models.document import Document
 from app.models.library import Library
+from app.models.models import (
+    ExampleSearchText,
+    MetadataFilter,
+    RangeSearchText,
+    SearchText,
+    VectorSearchText,
+)
+from app.repositories.chunk import ChunkRepository
 from app.repositories.db import DB
+from app.repositories.document import DocumentRepository
+from app.repositories.library import LibraryRepository
+from app.services.document_service import DocumentService
 from app.services.library_service import LibraryService
+from app.services.search_service import SearchService, _search_pages
+from app.settings import settings
 from app.utils.load_documents import load_documents_from_directory
+from app.utils.persistent_index import PersistentFlatIndex, PersistentIVFIndex
 
 
 @pytest_asyncio.fixture(scope="class")
@@ -125,3 +145,847 @@ class TestLibraryService:
         )
 
         assert result is not None
+
+    @pytest.mark.asyncio
+    async def test_embedding_options_are_fixed_once_documents_exist(self, service):
+        library = await service.create_library(
+            Library(name="Embedded", metadata={"embedding_type": "int8"})
+        )
+        await service.add_document(
+            title="doc", content="some text", library_id=library.id
+        )
+
+        library.metadata = {"embedding_type": "ubinary"}
+        with pytest.raises(ValidationError, match="embedding options"):
+            await service.update_library(library)
+
+        library.metadata = {"embedding_type": "int8", "owner": "docs"}
+        updated = await service.update_library(library)
+        assert updated.metadata["owner"] == "docs"
+
+
+class TestSearchPlanner:
+    @pytest_asyncio.fixture
+    async def search_service(self, test_db, tmp_path, monkeypatch):
+        # The planner is exercised with precomputed query vectors; the embedding
+        # client is never called
+        monkeypatch.setattr(settings, "cohere_api_key", "unused")
+        search_service = SearchService(test_db)
+        search_service.flat_index = PersistentFlatIndex(str(tmp_path))
+        search_service.ivf_index = PersistentIVFIndex(str(tmp_path), n_partitions=4)
+        return search_service
+
+    @pytest_asyncio.fixture
+    async def library_id(self, test_db):
+        library = await LibraryRepository(test_db).create(Library(name="planner"))
+        document = await DocumentRepository(test_db).create(
+            Document(title="planner", library_id=library.id)
+        )
+        chunks = ChunkRepository(test_db)
+        for i in range(40):
+            await chunks.create(
+                Chunk(
+                    content=f"chunk {i}",
+                    embedding=np.random.random(16).tobytes(),
+                    document_id=document.id,
+                    metadata={"group": "rare" if i < 3 else "common", "i": i},
+                )
+            )
+        return library.id
+
+    @pytest.mark.asyncio
+    async def test_selective_filter_uses_brute_force(
+        self, search_service, library_id, monkeypatch
+    ):
+        monkeypatch.setattr(settings, "sql_prefilter_limit", 10)
+        rare = [MetadataFilter(field="group", operator="eq", value="rare")]
+
+        scored, plan = await search_service._plan_and_search(
+            library_id, np.random.random(16), "flat", 5, rare
+        )
+        chunks = [chunk for chunk, _ in scored]
+
+        assert plan.strategy == "brute_force"
+        assert plan.sql_candidates == 3
+        assert {c.metadata["group"] for c in chunks} == {"rare"}
+        assert len(chunks) == 3
+
+    @pytest.mark.asyncio
+    async def test_broad_filter_on_ivf_post_filters(
+        self, search_service, library_id, monkeypatch
+    ):
+        monkeypatch.setattr(settings, "sql_prefilter_limit", 10)
+        common = [MetadataFilter(field="group", operator="eq", value="common")]
+
+        scored, plan = await search_service._plan_and_search(
+            library_id, np.random.random(16), "ivf", 5, common
+        )
+        chunks = [chunk for chunk, _ in scored]
+
+        assert plan.strategy in ("post_filter", "in_scan_mask")
+        assert plan.estimated_selectivity == pytest.approx(37 / 40)
+        assert plan.estimated_matches == 37
+        assert plan.fallback == (plan.strategy == "in_scan_mask")
+        assert len(chunks) == 5
+        assert {c.metadata["group"] for c in chunks} == {"common"}
+
+    @pytest.mark.asyncio
+    async def test_range_filter_on_flat_uses_mask(
+        self, search_service, library_id, monkeypatch
+    ):
+        monkeypatch.setattr(settings, "sql_prefilter_limit", 10)
+        upper = [MetadataFilter(field="i", operator="gte", value=20)]
+
+        scored, plan = await search_service._plan_and_search(
+            library_id, np.random.random(16), "flat", 5, upper
+        )
+        chunks = [chunk for chunk, _ in scored]
+
+        assert plan.strategy == "in_scan_mask"
+        assert plan.total_rows == 40
+        assert plan.estimated_matches == 20
+        assert all(c.metadata["i"] >= 20 for c in chunks)
+
+    @pytest.mark.asyncio
+    async def test_scores_are_similarities_above_min_score(
+        self, search_service, library_id, monkeypatch
+    ):
+        monkeypatch.setattr(settings, "sql_prefilter_limit", 10)
+        query = np.random.random(16)
+        rare = [MetadataFilter(field="group", operator="eq", value="rare")]
+
+        for index_type, filters in (("flat", []), ("ivf", []), ("flat", rare)):
+            scored, _ = await search_service._plan_and_search(
+                library_id, query, index_type, 40, filters
+            )
+            scores = [score for _, score in scored]
+            assert scores == sorted(scores, reverse=True)
+            for chunk, score in scored:
+                vector = np.frombuffer(chunk.embedding)
+                expected = (
+                    vector @ query / np.linalg.norm(vector) / np.linalg.norm(query)
+                )
+                assert score == pytest.approx(expected, abs=1e-5)
+
+            threshold = float(np.median(scores))
+            above, _ = await search_service._plan_and_search(
+                library_id, query, index_type, 40, filters, min_score=threshold
+            )
+            assert [chunk.id for chunk, _ in above] == [
+                chunk.id for chunk, score in scored if score >= threshold
+            ]
+
+    @pytest.mark.asyncio
+    @pytest.mark.parametrize("index_type", ["flat", "ivf"])
+    async def test_scan_deepens_until_enough_documents(
+        self, test_db, search_service, library_id, index_type
+    ):
+        # All 40 chunks of the first document outrank the only chunk of this one
+        document = await DocumentRepository(test_db).create(
+            Document(title="outlier", library_id=library_id)
+        )
+        await ChunkRepository(test_db).create(
+            Chunk(
+                content="outlier",
+                embedding=(-np.ones(16)).tobytes(),
+                document_id=document.id,
+            )
+        )
+        search_service.embedder.embed = lambda texts: np.ones((1, 16))
+        index = getattr(search_service, f"{index_type}_index")
+        scans = []
+        scan_chunks = index.scan_chunks
+
+        def counting_scan(*args, **kwargs):
+            scans.append(args)
+            return scan_chunks(*args, **kwargs)
+
+        index.scan_chunks = counting_scan
+
+        results, plan = await search_service.search_with_plan(
+            SearchText(
+                content=f"deepen {uuid4()}",
+                library_id=library_id,
+                index_type=index_type,
+                limit=2,
+            )
+        )
+
+        assert {r.document.title for r in results} == {"planner", "outlier"}
+        assert plan.expansions > 0
+        assert len(scans) == 1
+
+    @pytest.mark.asyncio
+    @pytest.mark.parametrize("index_type", ["flat", "ivf"])
+    async def test_range_search_returns_every_chunk_above_radius(
+        self, test_db, search_service, library_id, index_type
+    ):
+        query = np.random.random(16)
+        search_service.embedder.embed = lambda texts: query[np.newaxis]
+        common = [MetadataFilter(field="group", operator="eq", value="common")]
+
+        batches = await search_service.range_search(
+            RangeSearchText(
+                content=f"range {uuid4()}",
+                library_id=library_id,
+                radius=0.75,
+                index_type=index_type,
+                metadata_filters=common,
+                fields=["metadata"],
+            )
+        )
+        results = [result for batch in batches for result in batch]
+
+        expected = set()
+        for chunk in await ChunkRepository(test_db).find_by_library(library_id):
+            vector = np.frombuffer(chunk.embedding)
+            similarity = vector @ query / np.linalg.norm(vector) / np.linalg.norm(query)
+            if chunk.metadata["group"] == "common" and similarity >= 0.75:
+                expected.add(chunk.id)
+        assert {r.chunk_id for r in results} == expected
+        assert [r.score for r in results] == sorted(
+            (r.score for r in results), reverse=True
+        )
+        assert all(r.content is None for r in results)
+
+    @pytest.mark.asyncio
+    async def test_mmr_skips_near_duplicate_chunks(self, test_db, search_service):
+        library = await LibraryRepository(test_db).create(Library(name="mmr"))
+        document = await DocumentRepository(test_db).create(
+            Document(title="overlapping", library_id=library.id)
+        )
+        chunks = ChunkRepository(test_db)
+        created = {}
+        for name, vector in (
+            ("passage", [1.0, 0.0, 0.0]),
+            ("overlap", [0.99, 0.05, 0.0]),
+            ("distinct", [0.6, 0.0, 0.8]),
+        ):
+            created[name] = await chunks.create(
+                Chunk(
+                    content=name,
+                    embedding=np.array(vector).tobytes(),
+                    document_id=document.id,
+                )
+            )
+        search_service.embedder.embed = lambda texts: np.array([[1.0, 0.0, 0.2]])
+
+        for rerank, expected in (("none", "overlap"), ("mmr", "distinct")):
+            results, _ = await search_service.search_with_plan(
+                SearchText(
+                    content=f"mmr {uuid4()}",
+                    library_id=library.id,
+                    limit=2,
+                    granularity="chunk",
+                    rerank=rerank,
+                )
+            )
+            assert [r.chunk_id for r in results] == [
+                created["passage"].id,
+                created[expected].id,
+            ]
+
+    @pytest.mark.asyncio
+    async def test_cursor_pages_through_chunks(
+        self, test_db, search_service, library_id
+    ):
+        query = np.random.random(16)
+        calls = []
+
+        def embed(texts):
+            calls.append(texts)
+            return query[np.newaxis]
+
+        search_service.embedder.embed = embed
+        expected = []
+        for chunk in await ChunkRepository(test_db).find_by_library(library_id):
+            vector = np.frombuffer(chunk.embedding)
+            similarity = vector @ query / np.linalg.norm(vector) / np.linalg.norm(query)
+            expected.append((similarity, chunk.id))
+        expected = [chunk_id for _, chunk_id in sorted(expected, reverse=True)]
+
+        results, plan = await search_service.search_with_plan(
+            SearchText(
+                content=f"pages {uuid4()}",
+                library_id=library_id,
+                limit=15,
+                granularity="chunk",
+            )
+        )
+        pages = [[r.chunk_id for r in results]]
+        cursors = [plan.next_cursor]
+        while cursors[-1]:
+            results, plan = await search_service.search_with_plan(
+                SearchText(
+                    content="ignored",
+                    library_id=library_id,
+                    limit=15,
+                    cursor=cursors[-1],
+                )
+            )
+            pages.append([r.chunk_id for r in results])
+            cursors.append(plan.next_cursor)
+
+        assert [len(page) for page in pages] == [15, 15, 10]
+        assert [chunk_id for page in pages for chunk_id in page] == expected
+        assert len(calls) == 1
+
+        # Without the live scan the search restarts from the cursor's vector
+        _search_pages.clear()
+        next_page = SearchText(
+            content="ignored", library_id=library_id, limit=15, cursor=cursors[0]
+        )
+        results, _ = await search_service.search_with_plan(next_page)
+        assert [r.chunk_id for r in results] == pages[1]
+
+        await ChunkRepository(test_db).delete(expected[-1])
+        with pytest.raises(ValidationError, match="stale"):
+            await search_service.search_with_plan(next_page)
+
+    @pytest.mark.asyncio
+    async def test_cursor_pages_through_tied_scores(
+        self, test_db, search_service, library_id
+    ):
+        query = np.random.random(16)
+        document = await DocumentRepository(test_db).create(
+            Document(title="ties", library_id=library_id)
+        )
+        tied = []
+        for i in range(5):
+            chunk = await ChunkRepository(test_db).create(
+                Chunk(
+                    content=f"tie {i}",
+                    embedding=query.tobytes(),
+                    document_id=document.id,
+                )
+            )
+            tied.append(chunk.id)
+        search_service.embedder.embed = lambda texts: query[np.newaxis]
+
+        # Restarted pages split tied chunks like the live scan, without gaps or
+        # repeats
+        pages = {}
+        for live in (True, False):
+            search = SearchText(
+                content=f"ties {uuid4()}",
+                library_id=library_id,
+                limit=2,
+                granularity="chunk",
+            )
+            pages[live] = []
+            for _ in range(3):
+                if not live:
+                    _search_pages.clear()
+                results, plan = await search_service.search_with_plan(search)
+                pages[live].extend(r.chunk_id for r in results)
+                search = search.model_copy(update={"cursor": plan.next_cursor})
+        assert pages[False] == pages[True]
+        assert set(pages[False][:5]) == set(tied)
+        assert len(set(pages[False])) == 6
+
+    @pytest.mark.asyncio
+    async def test_cursor_requires_ordered_ivf_scan(
+        self, search_service, library_id, monkeypatch
+    ):
+        monkeypatch.setattr(settings, "sql_prefilter_limit", 0)
+        query = np.random.random(16)
+        search_service.embedder.embed = lambda texts: query[np.newaxis]
+
+        # Batches of a partially probed IVF scan are not in global score order
+        _, plan = await search_service.search_with_plan(
+            SearchText(
+                content=f"ivf {uuid4()}",
+                library_id=library_id,
+                index_type="ivf",
+                limit=5,
+                granularity="chunk",
+            )
+        )
+        assert plan.next_cursor is None
+
+        # A selective mask is scanned whole, so its chunks can be paged
+        first_two = [MetadataFilter(field="i", operator="lt", value=2)]
+        results, plan = await search_service.search_with_plan(
+            SearchText(
+                content=f"ivf {uuid4()}",
+                library_id=library_id,
+                index_type="ivf",
+                limit=1,
+                metadata_filters=first_two,
+                granularity="chunk",
+            )
+        )
+        assert plan.strategy == "in_scan_mask"
+        assert plan.next_cursor is not None
+
+        _search_pages.clear()
+        following, plan = await search_service.search_with_plan(
+            SearchText(
+                content="ignored",
+                library_id=library_id,
+                limit=1,
+                cursor=plan.next_cursor,
+            )
+        )
+        assert len(following) == 1
+        assert following[0].chunk_id != results[0].chunk_id
+        assert following[0].score <= results[0].score
+
+    @pytest.mark.asyncio
+    @pytest.mark.parametrize("live", [True, False])
+    async def test_cursor_pages_through_documents(
+        self, test_db, search_service, library_id, live
+    ):
+        # The extra documents rank in creation order, above the random chunks
+        query = -np.ones(16)
+        titles = []
+        for i in range(4):
+            document = await DocumentRepository(test_db).create(
+                Document(title=f"page {i}", library_id=library_id)
+            )
+            await ChunkRepository(test_db).create(
+                Chunk(
+                    content=f"page {i}",
+                    embedding=(query - np.eye(16)[0] * i / 2).tobytes(),
+                    document_id=document.id,
+                )
+            )
+            titles.append(document.title)
+        search_service.embedder.embed = lambda texts: query[np.newaxis]
+
+        results, plan = await search_service.search_with_plan(
+            SearchText(content=f"documents {uuid4()}", library_id=library_id, limit=2)
+        )
+        pages = [[r.document.title for r in results]]
+        while plan.next_cursor:
+            if not live:
+                _search_pages.clear()
+            results, plan = await search_service.search_with_plan(
+                SearchText(
+                    content="ignored",
+                    library_id=library_id,
+                    limit=2,
+                    cursor=plan.next_cursor,
+                )
+            )
+            pages.append([r.document.title for r in results])
+
+        assert pages == [titles[:2], titles[2:], ["planner"]]
+
+    @pytest.mark.asyncio
+    @pytest.mark.parametrize("index_type", ["flat", "ivf"])
+    async def test_fan_out_merges_libraries_with_one_embedding(
+        self, test_db, search_service, library_id, index_type
+    ):
+        query = np.random.random(16)
+        calls = []
+
+        def embed(texts):
+            calls.append(texts)
+            return query[np.newaxis]
+
+        search_service.embedder.embed = embed
+        other = await LibraryRepository(test_db).create(Library(name="fan-out"))
+        document = await DocumentRepository(test_db).create(
+            Document(title="fan-out", library_id=other.id)
+        )
+        chunks = ChunkRepository(test_db)
+        for vector in (query, np.random.random(16)):
+            await chunks.create(
+                Chunk(
+                    content="fan-out",
+                    embedding=vector.tobytes(),
+                    document_id=document.id,
+                )
+            )
+
+        expected = []
+        for library in (library_id, other.id):
+            for chunk in await chunks.find_by_library(library):
+                vector = np.frombuffer(chunk.embedding)
+                similarity = (
+                    vector @ query / np.linalg.norm(vector) / np.linalg.norm(query)
+                )
+                expected.append((similarity, chunk.id))
+        expected = [chunk_id for _, chunk_id in sorted(expected, reverse=True)[:5]]
+
+        results, plans = await search_service.search_libraries(
+            SearchText(
+                content=f"fan-out {uuid4()}",
+                library_ids=[library_id, other.id],
+                index_type=index_type,
+                limit=5,
+                granularity="chunk",
+            )
+        )
+
+        assert len(calls) == 1
+        assert [plan.library_id for plan in plans] == [library_id, other.id]
+        assert all(plan.next_cursor is None for plan in plans)
+        assert results[0].score == pytest.approx(1.0)
+        if index_type == "flat":
+            assert [r.chunk_id for r in results] == expected
+        loaded = list(search_service._loaded_indexes.values())
+        assert len(loaded) == 2 and loaded[0] is not loaded[1]
+
+    @pytest.mark.asyncio
+    async def test_facets_count_candidates_and_results(
+        self, search_service, library_id
+    ):
+        facets = await search_service.search_facets(
+            SearchText(
+                content="",
+                library_id=library_id,
+                facets=["group", "missing"],
+                granularity="chunk",
+            )
+        )
+        assert [(f.value, f.count) for f in facets["group"]] == [
+            ("common", 37),
+            ("rare", 3),
+        ]
+        assert facets["missing"] == []
+
+        facets = await search_service.search_facets(
+            SearchText(content="", library_id=library_id, facets=["group"])
+        )
+        assert [(f.value, f.count) for f in facets["group"]] == [
+            ("common", 1),
+            ("rare", 1),
+        ]
+
+        even = [MetadataFilter(field="i", operator="in", value=[0, 2, 4, 6])]
+        facets = await search_service.search_facets(
+            SearchText(
+                content="",
+                library_id=library_id,
+                facets=["group"],
+                metadata_filters=even,
+                granularity="chunk",
+            )
+        )
+        assert [(f.value, f.count) for f in facets["group"]] == [
+            ("common", 2),
+            ("rare", 2),
+        ]
+
+        results, _ = await search_service.search_by_vector(
+            VectorSearchText(
+                library_id=library_id,
+                vector=np.random.random(16).tolist(),
+                limit=5,
+                granularity="chunk",
+            )
+        )
+        facets = await search_service.search_facets(
+            SearchText(
+                content="",
+                library_id=library_id,
+                facets=["i"],
+                facet_scope="results",
+                facet_limit=3,
+                granularity="chunk",
+            ),
+            results,
+        )
+        assert len(facets["i"]) == 3
+        assert {f.count for f in facets["i"]} == {1}
+
+        # A cursor page counts the candidates of the cursor's filters
+        _, plan = await search_service.search_by_vector(
+            VectorSearchText(
+                library_id=library_id,
+                vector=np.random.random(16).tolist(),
+                limit=1,
+                metadata_filters=even,
+                granularity="chunk",
+            )
+        )
+        facets = await search_service.search_facets(
+            SearchText(
+                content="",
+                library_id=library_id,
+                facets=["group"],
+                cursor=plan.next_cursor,
+            )
+        )
+        assert [(f.value, f.count) for f in facets["group"]] == [
+            ("common", 2),
+            ("rare", 2),
+        ]
+
+    @pytest.mark.asyncio
+    async def test_search_by_vector_and_example_skip_embedding(
+        self, test_db, search_service
+    ):
+        def embed(texts):
+            raise AssertionError("the query must not be embedded")
+
+        search_service.embedder.embed = embed
+        library = await LibraryRepository(test_db).create(Library(name="examples"))
+        document = await DocumentRepository(test_db).create(
+            Document(title="examples", library_id=library.id)
+        )
+        chunks = ChunkRepository(test_db)
+        created = {}
+        for name, vector in (
+            ("source", [1.0, 0.0, 0.0]),
+            ("near", [0.9, 0.3, 0.0]),
+            ("diagonal", [0.7, 0.0, 0.7]),
+            ("away", [0.0, 1.0, 0.0]),
+        ):
+            created[name] = await chunks.create(
+                Chunk(
+                    content=name,
+                    embedding=np.array(vector).tobytes(),
+                    document_id=document.id,
+                )
+            )
+        names = {chunk.id: name for name, chunk in created.items()}
+
+        results, _ = await search_service.search_by_vector(
+            VectorSearchText(
+                library_id=library.id,
+                vector=[2.0, 0.0, 0.0],
+                limit=4,
+                granularity="chunk",
+            )
+        )
+        assert [names[r.chunk_id] for r in results] == [
+            "source",
+            "near",
+            "diagonal",
+            "away",
+        ]
+        assert results[0].score == pytest.approx(1.0)
+
+        results, _ = await search_service.search_similar_to(
+            created["source"].id, ExampleSearchText(limit=4, granularity="chunk")
+        )
+        assert [names[r.chunk_id] for r in results] == ["near", "diagonal", "away"]
+
+        # Moving away from the negative example reorders the rest and drops it
+        results, _ = await search_service.search_similar_to(
+            created["source"].id,
+            ExampleSearchText(
+                negative=[created["away"].id],
+                negative_weight=1.0,
+                limit=4,
+                granularity="chunk",
+            ),
+        )
+        assert [names[r.chunk_id] for r in results] == ["diagonal", "near"]
+
+        with pytest.raises(ValidationError, match="dimension"):
+            await search_service.search_by_vector(
+                VectorSearchText(library_id=library.id, vector=[1.0, 0.0])
+            )
+        with pytest.raises(ChunkNotFoundException):
+            await search_service.search_similar_to(uuid4(), ExampleSearchText())
+
+
+class TestKeywordSearch:
+    @pytest_asyncio.fixture
+    async def search_service(self, test_db, tmp_path, monkeypatch):
+        monkeypatch.setattr(settings, "cohere_api_key", "unused")
+        search_service = SearchService(test_db)
+        search_service.flat_index = PersistentFlatIndex(str(tmp_path))
+        return search_service
+
+    @pytest_asyncio.fixture
+    async def library_id(self, test_db):
+        library = await LibraryRepository(test_db).create(Library(name="keywords"))
+        documents = DocumentRepository(test_db)
+        chunks = ChunkRepository(test_db)
+        for i, content in enumerate(
+            [
+                "Error ERR_4012 is raised when the upload times out",
+                "Uploads are retried with exponential backoff",
+                "Vector search ranks chunks by cosine similarity",
+            ]
+        ):
+            document = await documents.create(
+                Document(
+                    title=f"doc {i}",
+                    library_id=library.id,
+                    metadata={"team": "infra" if i < 2 else "search"},
+                )
+            )
+            await chunks.create(
+                Chunk(
+                    content=content,
+                    embedding=np.random.random(16).tobytes(),
+                    document_id=document.id,
+                    metadata={
+                        "chunk_number": 0,
+                        "start_position": 0,
+                        "end_position": len(content),
+                    },
+                )
+            )
+        return library.id
+
+    @pytest.mark.asyncio
+    async def test_keyword_mode_skips_embedding(self, search_service, library_id):
+        def embed(texts):
+            raise AssertionError("keyword search must not embed the query")
+
+        search_service.embedder.embed = embed
+        results, plan = await search_service.search_with_plan(
+            SearchText(
+                content="err_4012", library_id=library_id, limit=3, mode="keyword"
+            )
+        )
+
+        assert plan.strategy == "keyword"
+        assert plan.keyword_matches == 1
+        assert [r.document.title for r in results] == ["doc 0"]
+
+    @pytest.mark.asyncio
+    async def test_chunk_granularity_projects_fields(self, search_service, library_id):
+        results, _ = await search_service.search_with_plan(
+            SearchText(
+                content="upload uploads",
+                library_id=library_id,
+                limit=5,
+                mode="keyword",
+                granularity="chunk",
+            )
+        )
+
+        assert len(results) == 2
+        assert all(r.content and "upload" in r.content.lower() for r in results)
+        assert all(r.start_position == 0 for r in results)
+        assert all(r.end_position == len(r.content) for r in results)
+        assert "embedding" not in results[0].model_dump()
+
+        results, _ = await search_service.search_with_plan(
+            SearchText(
+                content="uploads",
+                library_id=library_id,
+                mode="keyword",
+                granularity="chunk",
+                fields=["offsets"],
+            )
+        )
+        assert results[0].model_fields_set == {
+            "chunk_id",
+            "document_id",
+            "score",
+            "chunk_number",
+            "start_position",
+            "end_position",
+        }
+
+    @pytest.mark.asyncio
+    async def test_document_fields_omit_body(self, search_service, library_id):
+        results, _ = await search_service.search_with_plan(
+            SearchText(
+                content="uploads",
+                library_id=library_id,
+                mode="keyword",
+                fields=["metadata"],
+            )
+        )
+
+        document = results[0].document.model_dump(exclude_unset=True)
+        assert "content" not in document
+        assert document["metadata"] == {"team": "infra"}
+
+    @pytest.mark.asyncio
+    async def test_hybrid_mode_fuses_both_rankings(self, search_service, library_id):
+        search_service.embedder.embed = lambda texts: np.random.random((1, 16))
+        infra = [MetadataFilter(field="team", operator="eq", value="infra")]
+
+        for fusion in ("rrf", "weighted"):
+            results, plan = await search_service.search_with_plan(
+                SearchText(
+                    content="uploads backoff",
+                    library_id=library_id,
+                    limit=3,
+                    metadata_filters=infra,
+                    mode="hybrid",
+                    fusion=fusion,
+                )
+            )
+
+            assert plan.mode == "hybrid"
+            assert plan.keyword_matches == 1
+            assert {r.document.title for r in results} == {"doc 0", "doc 1"}
+
+    @pytest.mark.asyncio
+    async def test_keyword_index_follows_document_changes(
+        self, test_db, search_service, library_id
+    ):
+        await search_service.keyword_indexes.get(library_id)
+        document_service = DocumentService(test_db)
+        document_service._chunk_and_embed_document = lambda document: [
+            Chunk(
+                content=document.content,
+                embedding=np.random.random(16).tobytes(),
+                document_id=document.id,
+            )
+        ]
+
+        created = await document_service.create(
+            Document(title="new", content="zeppelin manual", library_id=library_id)
+        )
+        zeppelin = SearchText(content="zeppelin", library_id=library_id, mode="keyword")
+        results, _ = await search_service.search_with_plan(zeppelin)
+        assert [r.document.id for r in results] == [created.id]
+
+        await document_service.delete(created.id)
+        results, _ = await search_service.search_with_plan(zeppelin)
+        assert results == []
+
+    @pytest.mark.asyncio
+    async def test_slow_embedding_degrades_to_keyword(
+        self, search_service, library_id, monkeypatch
+    ):
+        monkeypatch.setattr(settings, "embedding_timeout", 0.05)
+
+        def embed(texts):
+            time.sleep(0.5)
+            return np.random.random((1, 16))
+
+        search_service.embedder.embed = embed
+        results, plan = await search_service.search_with_plan(
+            SearchText(content="err_4012 slow provider", library_id=library_id, limit=3)
+        )
+
+        assert plan.degraded == "embedding_timeout"
+        assert plan.strategy == "keyword"
+        assert [r.document.title for r in results] == ["doc 0"]
+
+    @pytest.mark.asyncio
+    async def test_failed_embedding_reuses_cached_query_vector(
+        self, search_service, library_id
+    ):
+        query = f"cosine similarity {uuid4()}"
+        search_service.embedder.embed = lambda texts: np.random.random((1, 16))
+        _, plan = await search_service.search_with_plan(
+            SearchText(content=query, library_id=library_id, limit=3)
+        )
+        assert plan.degraded is None
+
+        def embed(texts):
+            raise RuntimeError("provider unavailable")
+
+        search_service.embedder.embed = embed
+        _, plan = await search_service.search_with_plan(
+            SearchText(content=query, library_id=library_id, limit=3)
+        )
+        assert plan.degraded is None
+        assert plan.strategy == "unfiltered"
+
+        results, plan = await search_service.search_with_plan(
+            SearchText(
+                content=f"uploads backoff {uuid4()}",
+                library_id=library_id,
+                limit=3,
+                mode="hybrid",
+            )
+        )
+        assert plan.degraded == "embedding_error"
+        assert plan.mode == "hybrid"
+        assert [r.document.title for r in results] == ["doc 1"]